@@ -1,425 +1,427 @@
+import base64
+import os
+import sys
+import threading
+from functools import partial
+
 from shiny import App, render, ui, reactive
-import matplotlib.pyplot as plt
-import pandas as pd
-import plotly.express as px
-from shinywidgets import output_widget, render_widget
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+from client_charts import CHART_MODE, line_payload, output_chart, render_chart, scatter_payload
+from coalesce import coalesced
+from data_api import data_routes, response_cache
+from data_store import DataStore, Once
+from debug_routes import debug_routes, format_memory_report
+from export import exported_images
+from figure_templates import template_stats
+from figures import choropleth_figure, gender_scatter_figure, line_figure, summary_cards_ui
+from geo_payloads import payload_for
+from geometry import geometry_routes, geometry_url
+from instrumentation import instrument, metrics_routes, phase, stats_gauge, track_session
+from plot_cache import PooledResult, cached_plot, plot_cache
+from preprocess import memory_report
+from render_pool import render_pool
+from rollups import country_choices
+from scatter_frames import ScatterFrames, compose_frame
+from snapshot import open_datasets
 
 ###############################################################################
 # Load datasets
-df_deaths_new_cases = pd.read_csv("data/deaths-and-new-cases-of-hiv.csv")
-df_art_24 = pd.read_csv("data/antiretroviral-therapy-coverage.csv")
-df_art = pd.read_csv("data/antiretroviral-therapy-coverage-among-people-living-with-hiv.csv")
+# The preprocessing pipeline lives in preprocess.py; snapshot.py caches its
+# output so workers only re-parse the CSVs when a file in data/ changes, and
+# data_store.py swaps in a new snapshot when one changes while the app runs.
+#
+# HIV_FAST_START=1 is for scaling from zero: the app then starts from the
+# snapshot manifest alone and serves the UI right away. The panels' data and
+# the plotting libraries are loaded in the background once the first page
+# has been built (or by the first session that needs them, whichever comes
+# first), so the warm-up doesn't compete with that page for the CPU.
+# Otherwise everything is loaded here, before the first request.
+#
+# HIV_EXPORT_DIR names the output of a batch export (see export.py); when it
+# is of the same data, its PNG charts are put in the plot cache by the
+# warm-up, so the first sessions don't render them.
+DATA_DIR = os.environ.get("HIV_DATA_DIR", "data")
+FAST_START = os.environ.get("HIV_FAST_START", "0") == "1"
+EXPORT_DIR = os.environ.get("HIV_EXPORT_DIR")
+store = DataStore(open_datasets(DATA_DIR), DATA_DIR)
+
+# Frames behind the gender scatter
+SCATTER_DATA = ["df_prevalence_male_reshaped", "df_prevalence_female_reshaped"]
+
+# Base scatter frames for the prevalence animation, rendered on first use
+scatter_frames = ScatterFrames(lambda: store.snapshot.scatter_points, store.snapshot.version)
+
+
+@store.on_swap
+def update_scatter_frames(snapshot, changed):
+    if changed.intersection(SCATTER_DATA):
+        scatter_frames.invalidate(snapshot.version)
+
+
+def warm_plot_cache(snapshot):
+    """Put the exported charts of `snapshot`'s data in the plot cache; returns how many."""
+    revisions = snapshot.revisions
+    count = 0
+    for info, png in exported_images(EXPORT_DIR, snapshot.version):
+        # The keys the cached_plot outputs in server() compute
+        if info["output"] == "gender_scatter":
+            key = (tuple(revisions[name] for name in SCATTER_DATA), info["year"], info["highlight"])
+        else:
+            key = (revisions["df_deaths_new_cases"], info["country"], tuple(info["year_range"]))
+        plot_cache.put(
+            (info["output"], key, info["width"], info["height"], info["pixelratio"]),
+            "data:image/png;base64," + base64.b64encode(png).decode("ascii"),
+        )
+        count += 1
+    return count
 
-df_children_newly_infected = pd.read_csv("data/children-newly-infected-with-hiv.csv")
-df_adult_newly_infected = pd.read_csv("data/adults-newly-infected-with-hiv.csv")
 
-df_prevalence_male = pd.read_csv("data/prevalence-of-hiv-male-teenager.csv")
-df_prevalence_female = pd.read_csv("data/prevalence-of-hiv-female-teenager.csv")
+def warm_up():
+    """Load every panel's data and import the libraries the renderers use."""
+    # Imported for the side effect only: loading them now rather than in the
+    # first session that renders a plot or the map
+    import matplotlib.backends.backend_agg  # noqa: F401 (warm-up import)
+    import plotly.express  # noqa: F401 (warm-up import)
+    import shinywidgets  # noqa: F401 (warm-up import)
+
+    store.snapshot.load()
+    if EXPORT_DIR and CHART_MODE == "png":
+        count = warm_plot_cache(store.snapshot)
+        print(f"Plot cache: {count} charts from {EXPORT_DIR}", file=sys.stderr)
 
-###############################################################################
-# Preprocessing
-# Deaths and new cases dataset
-df_deaths_new_cases = df_deaths_new_cases[df_deaths_new_cases['Code'].notna()]
-df_deaths_new_cases = df_deaths_new_cases.rename(columns={
-    'Entity': 'Country',
-    'Incidence - HIV/AIDS - Sex: Both - Age: All Ages (Number)': 'New Cases',
-    'Deaths - HIV/AIDS - Sex: Both - Age: All Ages (Number)': 'Deaths',
-})
-df_deaths_new_cases = df_deaths_new_cases.drop(columns=['Prevalence - HIV/AIDS - Sex: Both - Age: All Ages (Number)'])
-
-# ART dataset
-df_art = df_art[df_art['Code'].notna()]
-df_art = df_art.rename(columns={
-    'Entity': 'Country',
-    'Antiretroviral therapy coverage (% of people living with HIV)': 'ART',
-})
-
-# Merge data set for part 1
-df_deaths_new_cases = df_deaths_new_cases.merge(
-    df_art[['Country', 'Code', 'Year', 'ART']],
-    on=['Country', 'Code', 'Year'],
-    how='left'
-)
-
-# Fill missing ART values with 0
-df_deaths_new_cases['ART'] = df_deaths_new_cases['ART'].fillna(0)
-
-# Prevalence of HIV by gender
-df_prevalence_male = df_prevalence_male[df_prevalence_male['Country Code'].notna()]
-df_prevalence_male = df_prevalence_male.rename(columns={
-    'Country Name': 'Country',
-    'Country Code': 'Code',
-})
-df_prevalence_male = df_prevalence_male.drop(columns=['Indicator Name', 'Indicator Code'])
-
-df_prevalence_female = df_prevalence_female[df_prevalence_female['Country Code'].notna()]
-df_prevalence_female = df_prevalence_female.rename(columns={
-    'Country Name': 'Country',
-    'Country Code': 'Code',
-})
-df_prevalence_female = df_prevalence_female.drop(columns=['Indicator Name', 'Indicator Code'])
-
-# Reshape the datasets (Prevalence of HIV female/male teenager)
-## Male
-df_prevalence_male_reshaped = df_prevalence_male.melt(
-    id_vars=['Country', 'Code'], var_name='Year', value_name='Prevalence_male'
-)
-df_prevalence_male_reshaped = df_prevalence_male_reshaped[df_prevalence_male_reshaped['Year'].str.isnumeric()]
-df_prevalence_male_reshaped['Year'] = df_prevalence_male_reshaped['Year'].astype(int)
-df_prevalence_male_reshaped = df_prevalence_male_reshaped.dropna(subset=['Prevalence_male'])
-## Female
-df_prevalence_female_reshaped = df_prevalence_female.melt(
-    id_vars=['Country', 'Code'], var_name='Year', value_name='Prevalence_female'
-)
-df_prevalence_female_reshaped = df_prevalence_female_reshaped[df_prevalence_female_reshaped['Year'].str.isnumeric()]
-df_prevalence_female_reshaped['Year'] = df_prevalence_female_reshaped['Year'].astype(int)
-df_prevalence_female_reshaped = df_prevalence_female_reshaped.dropna(subset=['Prevalence_female'])
-
-# children/adult newly infected with hiv
-df_children_newly_infected = df_children_newly_infected[df_children_newly_infected['Country Code'].notna()]
-df_children_newly_infected = df_children_newly_infected.rename(columns={
-    'Country Name': 'Country',
-    'Country Code': 'Code',
-    'children_newly_infected': 'Children'
-})
-df_children_newly_infected = df_children_newly_infected.drop(columns=['Indicator Name', 'Indicator Code'])
-
-df_adult_newly_infected = df_adult_newly_infected[df_adult_newly_infected['Country Code'].notna()]
-df_adult_newly_infected = df_adult_newly_infected.rename(columns={
-    'Country Name': 'Country',
-    'Country Code': 'Code',
-    'adult_newly_infected': 'Adult'
-})
-df_adult_newly_infected = df_adult_newly_infected.drop(columns=['Indicator Name', 'Indicator Code'])
-
-# Reshape the datasets (children-newly-infected-with-hiv, adults-newly-infected-with-hiv)
-# For children newly infected
-df_children_newly_infected_reshaped = df_children_newly_infected.melt(
-    id_vars=['Country', 'Code'], var_name='Year', value_name='Children'
-)
-
-df_children_newly_infected_reshaped = df_children_newly_infected_reshaped[
-    df_children_newly_infected_reshaped['Year'].str.isnumeric()
-]
-df_children_newly_infected_reshaped['Year'] = df_children_newly_infected_reshaped['Year'].astype(int)
-df_children_newly_infected_reshaped = df_children_newly_infected_reshaped.dropna(subset=['Children'])
-
-# For adult newly infected
-df_adult_newly_infected_reshaped = df_adult_newly_infected.melt(
-    id_vars=['Country', 'Code'], var_name='Year', value_name='Adult'
-)
-df_adult_newly_infected_reshaped = df_adult_newly_infected_reshaped[
-    df_adult_newly_infected_reshaped['Year'].str.isnumeric()
-]
-df_adult_newly_infected_reshaped['Year'] = df_adult_newly_infected_reshaped['Year'].astype(int)
-df_adult_newly_infected_reshaped = df_adult_newly_infected_reshaped.dropna(subset=['Adult'])
 
-# List all countries, years
-countries = sorted(df_deaths_new_cases['Country'].unique())
+def start_warm_up():
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
 
-years_scatter = sorted(df_prevalence_male_reshaped['Year'].unique())
-years_scatter = [str(year) for year in years_scatter]
 
-countries_list = sorted(df_prevalence_male_reshaped['Country'].unique())
+if FAST_START:
+    start_warm_up = Once(start_warm_up)
+else:
+    warm_up()
+    print(format_memory_report(memory_report(store.snapshot.datasets)), file=sys.stderr)
 
-years_children = df_children_newly_infected_reshaped['Year'].unique()
-years_adult = df_adult_newly_infected_reshaped['Year'].unique()
-available_years = sorted(set(years_children).union(years_adult))
 
 # ###############################################################################
 # UI layout
-app_ui = ui.page_fluid(
-    ui.TagList(
-        ui.panel_title("", "HIV Dashboard"),
-        ui.h2(
-            "🧪 HIV Dashboard",
-            style="color:#800000; font-family:monospace; background-color:#fff3cd; padding:10px; border-radius:8px; box-shadow: 2px 2px 5px rgba(0,0,0,0.1);"
-        )
-    ),
+def plot_output(id, kind, **options):
+    """The output of a line chart or the scatter: a PNG, or a client-side chart (see client_charts.py)."""
+    if CHART_MODE == "client":
+        return output_chart(id, kind, **options)
+    return ui.output_plot(id)
+
+
+def app_ui(request):
+    # Built for every page load, so new sessions start from the current data
+    # (only the LISTS, which come with the snapshot manifest)
+    from shinywidgets import output_widget
+
+    data = store.snapshot
+    countries = country_choices(data["countries"], data["aggregates"])
+    year_range = data["year_range"]
+    years_scatter = data["years_scatter"]
+    countries_list = data["countries_list"]
+    available_years = data["available_years"]
+
+    page = ui.page_fluid(
+        ui.TagList(
+            ui.panel_title("", "HIV Dashboard"),
+            ui.h2(
+                "🧪 HIV Dashboard",
+                style="color:#800000; font-family:monospace; background-color:#fff3cd; padding:10px; border-radius:8px; box-shadow: 2px 2px 5px rgba(0,0,0,0.1);"
+            )
+        ),
 
-    ui.div(style="margin-top: 20px;"),
+        ui.div(style="margin-top: 20px;"),
     
-    ui.panel_well(
-        ui.h4("HIV in the specific country"),
-        ui.input_select("country", "Country", choices=countries, selected="Vietnam"),
-        ui.output_ui("summary_cards"),
+        ui.panel_well(
+            ui.h4("HIV in the specific country"),
+            ui.input_select("country", "Country", choices=countries, selected="Vietnam"),
+            ui.output_ui("summary_cards"),
     
-        ui.hr(),
-
-        ui.layout_columns(
-            # Group 1: New Cases
-            ui.div(
-                ui.h5("New HIV Cases Over Time"),
-                ui.output_plot("new_cases_line"),
-                # output_widget("new_cases_line"),
-                ui.input_slider("new_cases_years", "Select Year Range",
-                    min=df_deaths_new_cases['Year'].min(),
-                    max=df_deaths_new_cases['Year'].max(),
-                    value=(df_deaths_new_cases['Year'].min(), df_deaths_new_cases['Year'].max()),
-                    step=1,
-                    sep="",
-                    width="100%"),
-            ),
-            # Group 2: Deaths
-            ui.div(
-                ui.h5("HIV-related Deaths Over Time"),
-                ui.output_plot("deaths_line"),
-                # output_widget("deaths_line"),
-                ui.input_slider("deaths_years", "Select Year Range",
-                    min=df_deaths_new_cases['Year'].min(),
-                    max=df_deaths_new_cases['Year'].max(),
-                    value=(df_deaths_new_cases['Year'].min(), df_deaths_new_cases['Year'].max()),
-                    step=1,
-                    sep="",
-                    width="100%"),
-            ),
-            # Group 3: ART Coverage
-            ui.div(
-                ui.h5("ART Coverage Over Time"),
-                # output_widget("art_coverage_line"),
-                ui.output_plot("art_coverage_line"),
-                ui.input_slider("art_years", "Select Year Range",
-                    min=df_deaths_new_cases['Year'].min(),
-                    max=df_deaths_new_cases['Year'].max(),
-                    value=(df_deaths_new_cases['Year'].min(), df_deaths_new_cases['Year'].max()),
-                    step=1,
-                    sep="",
-                    width="100%"),
+            ui.hr(),
+
+            ui.layout_columns(
+                # Group 1: New Cases
+                ui.div(
+                    ui.h5("New HIV Cases Over Time"),
+                    plot_output("new_cases_line", "line", color="#dc3545",
+                                xlabel="Year", ylabel="New Cases", range_input="new_cases_years"),
+                    # output_widget("new_cases_line"),
+                    ui.input_slider("new_cases_years", "Select Year Range",
+                        min=year_range[0],
+                        max=year_range[1],
+                        value=tuple(year_range),
+                        step=1,
+                        sep="",
+                        width="100%"),
+                ),
+                # Group 2: Deaths
+                ui.div(
+                    ui.h5("HIV-related Deaths Over Time"),
+                    plot_output("deaths_line", "line", color="#6c757d",
+                                xlabel="Year", ylabel="Deaths", range_input="deaths_years"),
+                    # output_widget("deaths_line"),
+                    ui.input_slider("deaths_years", "Select Year Range",
+                        min=year_range[0],
+                        max=year_range[1],
+                        value=tuple(year_range),
+                        step=1,
+                        sep="",
+                        width="100%"),
+                ),
+                # Group 3: ART Coverage
+                ui.div(
+                    ui.h5("ART Coverage Over Time"),
+                    # output_widget("art_coverage_line"),
+                    plot_output("art_coverage_line", "line", color="#28a745",
+                                xlabel="Year", ylabel="ART (%)", range_input="art_years"),
+                    ui.input_slider("art_years", "Select Year Range",
+                        min=year_range[0],
+                        max=year_range[1],
+                        value=tuple(year_range),
+                        step=1,
+                        sep="",
+                        width="100%"),
+                ),
             ),
+            ui.p(
+                "The data is sourced from the UNICEF Data Warehouse",
+                style="font-size: 0.9em; color: #555; margin-top: 20px;"
+            )
         ),
-        ui.p(
-            "The data is sourced from the UNICEF Data Warehouse",
-            style="font-size: 0.9em; color: #555; margin-top: 20px;"
-        )
-    ),
-
-    ui.div(style="margin-top: 20px;"),
-
-    ui.panel_well(
-        ui.h4("Prevalence of HIV by gender (teenager)"),
-        ui.layout_columns(
-            # Column 1 (1 portion): Both selectors stacked vertically in one card
-            ui.card(
-                # ui.input_select("year", "Year", choices=years_scatter, selected="2019"),
-                ui.input_slider(
-                    "year",
-                    "Year (Animation supported)",
-                    min=min(years_scatter),
-                    max=max(years_scatter),
-                    value=1990,
-                    step=1,
-                    sep="",
-                    width="100%",
-                    animate={"interval": 2000, "loop": False}
+
+        ui.div(style="margin-top: 20px;"),
+
+        ui.panel_well(
+            ui.h4("Prevalence of HIV by gender (teenager)"),
+            ui.layout_columns(
+                # Column 1 (1 portion): Both selectors stacked vertically in one card
+                ui.card(
+                    # ui.input_select("year", "Year", choices=years_scatter, selected="2019"),
+                    ui.input_slider(
+                        "year",
+                        "Year (Animation supported)",
+                        min=min(years_scatter),
+                        max=max(years_scatter),
+                        value=1990,
+                        step=1,
+                        sep="",
+                        width="100%",
+                        animate={"interval": 500, "loop": False}
+                    ),
+                    ui.input_select("country_scatter", "Highlight Country", choices=countries_list, selected="Viet Nam"),
+                    style="width: 100%"
                 ),
-                ui.input_select("country_scatter", "Highlight Country", choices=countries_list, selected="Viet Nam"),
-                style="width: 100%"
-            ),
-            # Column 2 (2 portions): Scatter plot output
-            ui.card(
-                ui.output_plot("gender_scatter"),
-                # output_widget("gender_scatter"),
-                style="width: 100%"
+                # Column 2 (2 portions): Scatter plot output
+                ui.card(
+                    plot_output("gender_scatter", "scatter", xlabel="Male Prevalence",
+                                ylabel="Female Prevalence", highlight_input="country_scatter"),
+                    # output_widget("gender_scatter"),
+                    style="width: 100%"
+                ),
+                col_widths=[4, 8],
             ),
-            col_widths=[4, 8],
+            ui.p(
+                "The data is sourced from the UNICEF Data Warehouse",
+                style="font-size: 0.9em; color: #555; margin-top: 20px;"
+            )
         ),
-        ui.p(
-            "The data is sourced from the UNICEF Data Warehouse",
-            style="font-size: 0.9em; color: #555; margin-top: 20px;"
-        )
-    ),
-
-    ui.div(style="margin-top: 20px;"),
-
-    ui.panel_well(
-        ui.h4("HIV distribution across countries"),
-        ui.row(
-            ui.column(
-                8,
-                output_widget("geo_map"),
-                ui.input_slider(
-                    "year_slider",
-                    "Select Year",
-                    min=min(available_years),
-                    max=max(available_years),
-                    value=max(available_years),
-                    step=1,
-                    sep="",
-                    width="100%",
-                )
-            ),
-            ui.column(
-                4,
-                ui.h5("Select the dataset"),
-                ui.div(
-                    ui.value_box("Newly infected with HIV", "Children (ages 0-14)", color="blue"),
-                    onclick="Shiny.setInputValue('dataset_type', 'children', {priority: 'event'})",
-                    style="cursor: pointer; margin-bottom: 10px;"
+
+        ui.div(style="margin-top: 20px;"),
+
+        ui.panel_well(
+            ui.h4("HIV distribution across countries"),
+            ui.row(
+                ui.column(
+                    8,
+                    output_widget("geo_map"),
+                    ui.input_slider(
+                        "year_slider",
+                        "Select Year",
+                        min=min(available_years),
+                        max=max(available_years),
+                        value=max(available_years),
+                        step=1,
+                        sep="",
+                        width="100%",
+                    )
                 ),
+                ui.column(
+                    4,
+                    ui.h5("Select the dataset"),
+                    ui.div(
+                        ui.value_box("Newly infected with HIV", "Children (ages 0-14)", color="blue"),
+                        onclick="Shiny.setInputValue('dataset_type', 'children', {priority: 'event'})",
+                        style="cursor: pointer; margin-bottom: 10px;"
+                    ),
                 
-                ui.div(
-                    ui.value_box("Newly infected with HIV", "Adults (ages 15-49)", color="green"),
-                    onclick="Shiny.setInputValue('dataset_type', 'adult', {priority: 'event'})",
-                    style="cursor: pointer;"
-                ),
+                    ui.div(
+                        ui.value_box("Newly infected with HIV", "Adults (ages 15-49)", color="green"),
+                        onclick="Shiny.setInputValue('dataset_type', 'adult', {priority: 'event'})",
+                        style="cursor: pointer;"
+                    ),
 
-                ui.hr()
+                    ui.hr()
+                ),
             ),
+            ui.p(
+                "The data is sourced from the World Bank Open Data",
+                style="font-size: 0.9em; color: #555; margin-top: 20px;"
+            )
         ),
         ui.p(
-            "The data is sourced from the World Bank Open Data",
+            "@Phan Minh Tri, 2025",
             style="font-size: 0.9em; color: #555; margin-top: 20px;"
         )
-    ),
-    ui.p(
-        "@Phan Minh Tri, 2025",
-        style="font-size: 0.9em; color: #555; margin-top: 20px;"
     )
-)
-import plotly.io as pio
+    if FAST_START:
+        start_warm_up()
+    return page
+
+
 ###############################################################################
 # Server logic
+# Input values reported by the slow-render log (HIV_SLOW_RENDER_MS)
+APP_INPUTS = [
+    "country", "new_cases_years", "deaths_years", "art_years",
+    "year", "country_scatter", "dataset_type", "year_slider",
+]
+
+stats_gauge("hiv_plot_cache", "Plot cache statistics.", plot_cache.stats)
+stats_gauge("hiv_render_pool", "Render pool statistics.", render_pool.stats)
+stats_gauge("hiv_api_cache", "Data API response cache statistics.", response_cache.stats)
+stats_gauge("hiv_figure_templates", "Figure template statistics.", template_stats)
+
+
 def server(input, output, session):
+    from shinywidgets import render_widget
+
+    # Drop this session's queued renders when it disconnects
+    session.on_ended(lambda: render_pool.cancel_session(session.id))
+    track_session(session, inputs=APP_INPUTS)
+
+    # The sliders, passed on at their debounce/throttle settings (see coalesce.py)
+    new_cases_years = coalesced(input, "new_cases_years")
+    deaths_years = coalesced(input, "deaths_years")
+    art_years = coalesced(input, "art_years")
+    scatter_year = coalesced(input, "year")
+    year_slider = coalesced(input, "year_slider")
+
     @reactive.Calc
+    @instrument
     def selected_country_data():
         return input.country()
 
+    # Shared by the summary cards and the three line charts: one backend
+    # lookup per country switch, which the outputs slice by year range
+    @reactive.Calc
+    @instrument
+    def selected_country_series():
+        data = store.use("df_deaths_new_cases")
+        series = data.backend.country(selected_country_data())
+        return data.revisions["df_deaths_new_cases"], series
+
     @output
+    @instrument
     @render.ui
     def summary_cards():
-        df = df_deaths_new_cases[df_deaths_new_cases["Country"] == selected_country_data()]
-        latest = df[df["Year"] == df["Year"].max()]
-        year = latest["Year"].values[0]
-        new_cases = int(latest["New Cases"].values[0])
-        deaths = int(latest["Deaths"].values[0])
-        coverage = int(latest["ART"].values[0])
-
-        return ui.layout_column_wrap(
-            ui.value_box(
-                title="New HIV Cases",
-                value=f"{new_cases:,} cases | {year}",
-                theme="danger"
-            ),
-            ui.value_box(
-                title="HIV-related Deaths",
-                value=f"{deaths:,} cases | {year}",
-                theme="secondary"
-            ),
-            ui.value_box(
-                title="ART Coverage",
-                value=f"{coverage}% | {year}",
-                theme="success"
-            ),
-        )
-
-    @output
-    @render.plot
-    def new_cases_line():
-        df = df_deaths_new_cases[df_deaths_new_cases["Country"] == selected_country_data()]
-        year_range = input.new_cases_years()
-        df = df[(df["Year"] >= year_range[0]) & (df["Year"] <= year_range[1])]
-
-        fig, ax = plt.subplots()
-        ax.plot(df["Year"], df["New Cases"], marker='o', linestyle='-', color='#dc3545')
-        ax.set_xlabel("Year")
-        ax.set_ylabel("New Cases")
-        ax.grid(True)
-        ax.spines['top'].set_visible(False)
-        ax.spines['right'].set_visible(False)
-        ax.spines['bottom'].set_visible(False)
-        ax.spines['left'].set_visible(False)
-        return fig
-
-    @render.plot
-    def deaths_line():
-        df = df_deaths_new_cases[df_deaths_new_cases["Country"] == selected_country_data()]
-        year_range = input.deaths_years()
-        df = df[(df["Year"] >= year_range[0]) & (df["Year"] <= year_range[1])]
-
-        fig, ax = plt.subplots()
-        ax.plot(df["Year"], df["Deaths"], marker='o', linestyle='-', color='#6c757d')
-        ax.set_xlabel("Year")
-        ax.set_ylabel("Deaths")
-        ax.grid(True)
-        ax.spines['top'].set_visible(False)
-        ax.spines['right'].set_visible(False)
-        ax.spines['bottom'].set_visible(False)
-        ax.spines['left'].set_visible(False)
-        return fig
-
-    @render.plot
-    def art_coverage_line():
-        df = df_deaths_new_cases[df_deaths_new_cases["Country"] == selected_country_data()]
-        year_range = input.art_years()
-        df = df[(df["Year"] >= year_range[0]) & (df["Year"] <= year_range[1])]
-
-        fig, ax = plt.subplots()
-        ax.plot(df["Year"], df["ART"], marker='o', linestyle='-', color='#28a745')
-        ax.set_xlabel("Year")
-        ax.set_ylabel("ART (%)")
-        ax.grid(True)
-        ax.spines['top'].set_visible(False)
-        ax.spines['right'].set_visible(False)
-        ax.spines['bottom'].set_visible(False)
-        ax.spines['left'].set_visible(False)
-        return fig
-    
-    @output
-    @render.plot
-    def gender_scatter():
-        year = int(input.year())
-        df_m = df_prevalence_male_reshaped[df_prevalence_male_reshaped["Year"] == year]
-        df_f = df_prevalence_female_reshaped[df_prevalence_female_reshaped["Year"] == year]
-
-        merged = pd.merge(df_m, df_f, on=["Country", "Code", "Year"])
-
-        fig, ax = plt.subplots()
-        ax.scatter(
-            merged["Prevalence_male"],
-            merged["Prevalence_female"],
-            s=30,  # marker size
-            alpha=0.7,
-            label="Countries"
-        )
-
-        ax.set_title(f"HIV Prevalence by Gender in {year}")
-        ax.set_xlabel("Male Prevalence")
-        ax.set_ylabel("Female Prevalence")
-
-        # Highlight selected country
-        selected = merged[merged["Country"] == input.country_scatter()]
-        if not selected.empty:
-            x_val = selected["Prevalence_male"].values[0]
-            y_val = selected["Prevalence_female"].values[0]
-            
-            # Plot the highlighted point
-            ax.scatter(
-                x_val,
-                y_val,
-                color="red",
-                s=100,
-                label=input.country_scatter()
+        _, series = selected_country_series()
+        return summary_cards_ui(series.latest())
+
+    if CHART_MODE == "client":
+        # Only the data goes to the browser: a line chart gets the country's
+        # whole series (the year range is applied client-side) and the
+        # scatter gets one year's points (so does the highlight)
+        def country_series(metric):
+            data = store.use("year_range")
+            _, series = selected_country_series()
+            years, values = series.between(*data["year_range"])
+            return line_payload(years, values[metric])
+
+        @output
+        @instrument
+        @render_chart
+        def new_cases_line():
+            return country_series("New Cases")
+
+        @output
+        @instrument
+        @render_chart
+        def deaths_line():
+            return country_series("Deaths")
+
+        @output
+        @instrument
+        @render_chart
+        def art_coverage_line():
+            return country_series("ART")
+
+        @output
+        @instrument
+        @render_chart
+        def gender_scatter():
+            year = int(scatter_year())
+            store.use(*SCATTER_DATA)
+            return scatter_payload(year, *scatter_frames.points.get(year, ([], [], [])))
+
+    else:
+        @output
+        @instrument
+        @cached_plot
+        def new_cases_line():
+            revision, series = selected_country_series()
+            year_range = tuple(int(y) for y in new_cases_years())
+            years, values = series.between(*year_range)
+            return (revision, selected_country_data(), year_range), partial(
+                line_figure, years, values["New Cases"], color='#dc3545', ylabel="New Cases"
             )
-            
-            # Annotate with (x, y) value
-            ax.annotate(
-                f"({x_val:.2f}, {y_val:.2f})",
-                (x_val, y_val),
-                textcoords="offset points",
-                xytext=(-10, 20),  # offset to avoid overlapping the point
-                ha='left',
-                fontsize=12,
-                color='red'
+
+        @instrument
+        @cached_plot
+        def deaths_line():
+            revision, series = selected_country_series()
+            year_range = tuple(int(y) for y in deaths_years())
+            years, values = series.between(*year_range)
+            return (revision, selected_country_data(), year_range), partial(
+                line_figure, years, values["Deaths"], color='#6c757d', ylabel="Deaths"
             )
 
-        ax.legend()
-        ax.grid(True)
-        ax.spines['top'].set_visible(False)
-        ax.spines['right'].set_visible(False)
-        ax.spines['bottom'].set_visible(False)
-        ax.spines['left'].set_visible(False)
+        @instrument
+        @cached_plot
+        def art_coverage_line():
+            revision, series = selected_country_series()
+            year_range = tuple(int(y) for y in art_years())
+            years, values = series.between(*year_range)
+            return (revision, selected_country_data(), year_range), partial(
+                line_figure, years, values["ART"], color='#28a745', ylabel="ART (%)"
+            )
 
-        return fig
+        @output
+        @instrument
+        @cached_plot
+        def gender_scatter():
+            year = int(scatter_year())
+            highlight = input.country_scatter()
+            width = session.clientdata.output_width("gender_scatter")
+            height = session.clientdata.output_height("gender_scatter")
+            pixelratio = session.clientdata.pixelratio()
+            data = store.use(*SCATTER_DATA)
+            revision = tuple(data.revisions[name] for name in SCATTER_DATA)
+
+            point = scatter_frames.highlight_point(year, highlight)
+
+            # Pre-rendered base frame with the highlight drawn on top
+            frame = scatter_frames.base_frame(year, width, height, pixelratio)
+            if frame is not None:
+                return (revision, year, highlight), partial(compose_frame, frame, highlight, point)
+
+            # Frames for this size are still being rendered: draw it in full
+            _, male, female = scatter_frames.points.get(year, ([], [], []))
+            return (revision, year, highlight), partial(
+                gender_scatter_figure, year, male, female, highlight, point
+            )
 
 
     # NOTE: The render_widget generates an interactive plot that is too slow, which significantly impacts performance. As a result, I switched to static images using Matplotlib.
@@ -486,45 +488,127 @@ def server(input, output, session):
    
     # Reactive dataset selector: children or adult
     @reactive.Calc
+    @instrument
     def selected_dataset():
         if input.dataset_type() == "children":
-            return df_children_newly_infected_reshaped, 'Children'
+            data = store.use("df_children_newly_infected_reshaped")
+            return data.geo_payloads["children"], 'Children'
         else:
-            return df_adult_newly_infected_reshaped, 'Adult'
+            data = store.use("df_adult_newly_infected_reshaped")
+            return data.geo_payloads["adult"], 'Adult'
+
+    # Render interactive geo map for all countries by selected year.
+    # The figure is only rebuilt when the dataset changes; year changes are
+    # applied in place by geo_map_year() below. It is built in the render
+    # pool without holding up the reactive flush, like the cached plots.
+    geo_map_figure = PooledResult("geo_map")
 
-    # Render interactive geo map for all countries by selected year
     @output
+    @instrument
     @render_widget
-    def geo_map():
-        df, value_col = selected_dataset()
-        year = input.year_slider()
+    async def geo_map():
+        import pandas as pd
+
+        with phase("geo_map", "data"):
+            payloads, value_col = selected_dataset()
+            with reactive.isolate():
+                year = year_slider()
+                # Level of detail of the bundled geometry for the map's size
+                geojson = geometry_url(
+                    session.clientdata.output_width("geo_map"), session.clientdata.pixelratio()
+                )
 
-        df_year = df[df['Year'] == year]
+            payload = payload_for(payloads, year)
+            df_year = pd.DataFrame({
+                "Code": payload["locations"],
+                value_col: payload["z"],
+                "Country": payload["hovertext"],
+            })
 
         # Set the color bar title dynamically
         colorbar_title = (
             "Children Newly Infected" if input.dataset_type() == "children" else "Adult Newly Infected"
         )
 
-        fig = px.choropleth(
+        # The year is part of the key: a figure finished after the slider
+        # moved is rebuilt for the current year, since geo_map_year() had no
+        # widget to patch meanwhile
+        key = (store.snapshot.version, input.dataset_type(), year, geojson)
+        return await geo_map_figure.get(
+            key,
+            choropleth_figure,
             df_year,
-            locations="Code",
-            color=value_col,
-            hover_name="Country",
-            # color_continuous_scale="Reds",
-            color_continuous_scale=px.colors.sequential.Plasma,
-            title=f"{input.dataset_type().capitalize()} Newly Infected - {year}",
+            value_col,
+            f"{input.dataset_type().capitalize()} Newly Infected - {year}",
+            colorbar_title,
+            geojson,
         )
-        fig.update_layout(
-            margin={"r":0,"t":30,"l":0,"b":0},
-            coloraxis_colorbar=dict(
-                title=colorbar_title
-            )
+
+    # Patch only the trace arrays and title of the existing widget, so a
+    # slider step doesn't re-send the geometry, layout and widget bundle.
+    @reactive.effect
+    @reactive.event(year_slider)
+    def geo_map_year():
+        widget = geo_map.widget
+        if widget is None:
+            # The first figure is still being built, for the latest year
+            return
+        payloads, _ = selected_dataset()
+        year = year_slider()
+        payload = payload_for(payloads, year)
+
+        with widget.batch_update():
+            trace = widget.data[0]
+            trace.locations = payload["locations"]
+            trace.z = payload["z"]
+            trace.hovertext = payload["hovertext"]
+            widget.layout.title.text = f"{input.dataset_type().capitalize()} Newly Infected - {year}"
+
+    # Keep the choices and slider bounds of a live session in line with
+    # reloaded data (new sessions get them from app_ui)
+    @reactive.effect
+    @reactive.event(store.changed("countries"), store.changed("aggregates"), ignore_init=True)
+    def update_countries():
+        data = store.snapshot
+        choices = country_choices(data["countries"], data["aggregates"])
+        ui.update_select("country", choices=choices, selected=input.country())
+
+    @reactive.effect
+    @reactive.event(store.changed("year_range"), ignore_init=True)
+    def update_year_ranges():
+        first, last = store.snapshot["year_range"]
+        for slider in ("new_cases_years", "deaths_years", "art_years"):
+            ui.update_slider(slider, min=first, max=last)
+
+    @reactive.effect
+    @reactive.event(store.changed("years_scatter"), store.changed("countries_list"), ignore_init=True)
+    def update_scatter_inputs():
+        years_scatter = store.snapshot["years_scatter"]
+        ui.update_slider("year", min=int(min(years_scatter)), max=int(max(years_scatter)))
+        ui.update_select(
+            "country_scatter", choices=store.snapshot["countries_list"], selected=input.country_scatter()
         )
-        return fig
+
+    @reactive.effect
+    @reactive.event(store.changed("available_years"), ignore_init=True)
+    def update_geo_years():
+        available_years = store.snapshot["available_years"]
+        ui.update_slider("year_slider", min=min(available_years), max=max(available_years))
 
 ###############################################################################
 # Run the app
-app = App(app_ui, server)
+shiny_app = App(app_ui, server)
+
+
+# Extra HTTP routes (/metrics, the bundled map geometry, the data API, debug
+# endpoints) are matched first; everything else, including the websocket,
+# goes to the Shiny app.
+app = Starlette(routes=[
+    *metrics_routes(),
+    *geometry_routes(),
+    *data_routes(store),
+    *debug_routes(store),
+    Mount("/", app=shiny_app),
+], lifespan=store.lifespan)
 
 # End of code
\ No newline at end of file
@@ -0,0 +1,257 @@
+import os
+import sqlite3
+import tempfile
+import threading
+from itertools import repeat
+
+import numpy as np
+
+from country_index import METRICS, CountrySeries, latest_record
+from preprocess import CUBE
+
+###############################################################################
+# Data access backends
+#
+# Outputs don't slice the frames themselves; they ask the snapshot's backend
+# for the rows they need:
+#
+#   country(country)
+#       one country's whole series as a CountrySeries, which the session's
+#       selected country calc fetches once and the outputs slice by year
+#   country_series(country, start_year, end_year, metrics)
+#       one country's years in a range, with only the requested metrics
+#   latest(country)
+#       that country's most recent year
+#   aligned(year, *indicators)
+#       every country with all `indicators` in one year
+#   years_with_data(*indicators)
+#
+# "pandas" answers from the in-memory snapshot (CountryIndex and the
+# IndicatorCube), returning views. "sqlite" ingests the snapshot once into
+# indexed tables of an embedded database stored next to it, and pushes every
+# filter and projection down into SQL, so a query only reads and returns the
+# matching rows and columns however large the data is. HIV_BACKEND selects
+# the backend ("pandas" by default).
+
+BACKEND = os.environ.get("HIV_BACKEND", "pandas")
+
+
+class PandasBackend:
+    """Queries over the in-memory snapshot, loaded panel by panel on first use."""
+
+    name = "pandas"
+
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+
+    def country(self, country):
+        return self._snapshot.country_index.get(country)
+
+    def country_series(self, country, start_year, end_year, metrics=METRICS):
+        years, values = self._snapshot.country_index.get(country).between(start_year, end_year)
+        return years, {metric: values[metric] for metric in metrics}
+
+    def latest(self, country):
+        return self._snapshot.country_index.get(country).latest()
+
+    def aligned(self, year, *indicators):
+        return self._snapshot[CUBE].aligned(year, *indicators)
+
+    def years_with_data(self, *indicators):
+        return self._snapshot[CUBE].years_with_data(*indicators)
+
+
+# Bump when the schema below changes
+SQLITE_SCHEMA = 1
+METRIC_COLUMNS = {"New Cases": "new_cases", "Deaths": "deaths", "ART": "art"}
+
+# Countries' positions on the cube's country axis keep query results in the
+# same order as the pandas backend's.
+SCHEMA = """
+CREATE TABLE country_panel (
+    country TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    new_cases REAL,
+    deaths REAL,
+    art REAL
+);
+CREATE TABLE indicator_values (
+    indicator TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    code TEXT NOT NULL,
+    country TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (indicator, year, position)
+) WITHOUT ROWID;
+"""
+# Created after the rows are inserted, which is faster than maintaining it
+INDEXES = """
+CREATE INDEX country_panel_country_year ON country_panel (country, year);
+"""
+
+
+def database_path(snapshot):
+    """Where the database of `snapshot` lives: inside its snapshot directory if it has one."""
+    from snapshot import publish_dir
+
+    directory = os.path.join(publish_dir(), snapshot.version)
+    if not os.path.isdir(directory):
+        directory = tempfile.gettempdir()
+    return os.path.join(directory, f"analytics-{SQLITE_SCHEMA}-{snapshot.version}.sqlite")
+
+
+def build_database(path, datasets):
+    """Ingest the deaths / new cases / ART panel and the cube into a new database at `path`."""
+    # Built under a temporary name and renamed into place, like snapshots
+    tmp = f"{path}.tmp-{os.getpid()}"
+    con = sqlite3.connect(tmp)
+    try:
+        con.execute("PRAGMA journal_mode = OFF")
+        con.execute("PRAGMA synchronous = OFF")
+        con.executescript(SCHEMA)
+
+        df = datasets["df_deaths_new_cases"]
+        con.executemany(
+            "INSERT INTO country_panel VALUES (?, ?, ?, ?, ?)",
+            zip(
+                df["Country"].astype(str).tolist(),
+                df["Year"].tolist(),
+                *[df[metric].astype(float).tolist() for metric in METRICS],
+            ),
+        )
+
+        cube = datasets[CUBE]
+        for name in cube.names:
+            # Year-major, like the table's primary key
+            values = cube.indicator(name).T
+            year_i, position = np.nonzero(~np.isnan(values))
+            con.executemany(
+                "INSERT INTO indicator_values VALUES (?, ?, ?, ?, ?, ?)",
+                zip(
+                    repeat(name),
+                    cube.years[year_i].tolist(),
+                    position.tolist(),
+                    cube.codes[position].tolist(),
+                    cube.countries[position].tolist(),
+                    values[year_i, position].astype(float).tolist(),
+                ),
+            )
+        con.executescript(INDEXES)
+        con.commit()
+    except BaseException:
+        con.close()
+        os.remove(tmp)
+        raise
+    con.close()
+    os.replace(tmp, path)
+
+
+def _column(values, dtype):
+    # SQL NULLs come back as None; NaN keeps them missing, as in the frames
+    return np.array([np.nan if v is None else v for v in values], dtype=dtype)
+
+
+class SQLiteBackend:
+    """Queries pushed down to an embedded SQLite database built once per snapshot version."""
+
+    name = "sqlite"
+
+    def __init__(self, snapshot, path=None):
+        self.path = path or database_path(snapshot)
+        if not os.path.exists(self.path):
+            build_database(self.path, snapshot.datasets)
+        # sqlite3 connections can't be shared between threads, so the event
+        # loop and the render pool threads each open their own
+        self._local = threading.local()
+        # The snapshot never changes, and finding its years scans every row
+        # of the indicators, so they are looked up once
+        self._years = {}
+
+    def _query(self, sql, params):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = self._local.con = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        return con.execute(sql, params).fetchall()
+
+    def country(self, country):
+        rows = self._query(
+            "SELECT year, new_cases, deaths, art FROM country_panel WHERE country = ? ORDER BY year",
+            (country,),
+        )
+        columns = list(zip(*rows)) or [()] * (len(METRICS) + 1)
+        years = np.array(columns[0], dtype=np.int64)
+        values = {metric: _column(v, np.float32) for metric, v in zip(METRICS, columns[1:])}
+        latest = latest_record(years, values, -1) if rows else None
+        return CountrySeries(country if rows else None, years, values, latest)
+
+    def country_series(self, country, start_year, end_year, metrics=METRICS):
+        columns = ", ".join(METRIC_COLUMNS[metric] for metric in metrics)
+        rows = self._query(
+            f"SELECT year, {columns} FROM country_panel"
+            " WHERE country = ? AND year BETWEEN ? AND ? ORDER BY year",
+            (country, int(start_year), int(end_year)),
+        )
+        columns = list(zip(*rows)) or [()] * (len(metrics) + 1)
+        years = np.array(columns[0], dtype=np.int64)
+        return years, {
+            metric: _column(values, np.float32) for metric, values in zip(metrics, columns[1:])
+        }
+
+    def latest(self, country):
+        rows = self._query(
+            "SELECT year, new_cases, deaths, art FROM country_panel"
+            " WHERE country = ? ORDER BY year DESC LIMIT 1",
+            (country,),
+        )
+        if not rows:
+            return None
+        year, *values = rows[0]
+        record = {"Year": int(year)}
+        for metric, value in zip(METRICS, values):
+            record[metric] = np.nan if value is None else value
+        return record
+
+    @staticmethod
+    def _join(indicators):
+        # One self-join per extra indicator, on the same country and year
+        joins = "".join(
+            f" JOIN indicator_values v{i} ON v{i}.indicator = ?"
+            f" AND v{i}.year = v0.year AND v{i}.position = v0.position"
+            for i in range(1, len(indicators))
+        )
+        return f"FROM indicator_values v0{joins}", list(indicators[1:])
+
+    def aligned(self, year, *indicators):
+        tables, params = self._join(indicators)
+        values = ", ".join(f"v{i}.value" for i in range(len(indicators)))
+        rows = self._query(
+            f"SELECT v0.code, v0.country, {values} {tables}"
+            " WHERE v0.indicator = ? AND v0.year = ? ORDER BY v0.position",
+            (*params, indicators[0], int(year)),
+        )
+        columns = list(zip(*rows)) or [()] * (len(indicators) + 2)
+        return (
+            np.array(columns[0], dtype=object),
+            np.array(columns[1], dtype=object),
+            *[np.array(values, dtype=np.float32) for values in columns[2:]],
+        )
+
+    def years_with_data(self, *indicators):
+        if indicators not in self._years:
+            tables, params = self._join(indicators)
+            rows = self._query(
+                f"SELECT DISTINCT v0.year {tables} WHERE v0.indicator = ? ORDER BY v0.year",
+                (*params, indicators[0]),
+            )
+            self._years[indicators] = np.array([year for year, in rows], dtype=int)
+        return self._years[indicators]
+
+
+BACKENDS = {"pandas": PandasBackend, "sqlite": SQLiteBackend}
+
+
+def make_backend(snapshot, kind=BACKEND):
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown data backend: {kind!r}")
+    return BACKENDS[kind](snapshot)
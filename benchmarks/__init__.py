@@ -0,0 +1,16 @@
+"""Performance benchmarks for the dashboard.
+
+The bench_*.py scripts each measure one change in isolation and print a
+short report. The modules below make up the regression suite; they write
+their results as JSON (see results.py), and startup also fails when the
+time to first byte is over its budget, and data_backends when the backends'
+query results differ:
+
+    python -m benchmarks.micro --json results/micro.json
+    python -m benchmarks.load --sessions 1 10 50 --json results/load.json
+    python -m benchmarks.startup --json results/startup.json
+    python -m benchmarks.data_backends --json results/backends.json
+
+All accept --scale N (data_backends a list, --scales) to run against
+data/ scaled up N times by synthetic_data.py. Run everything from the repository root.
+"""
@@ -0,0 +1,126 @@
+"""Server CPU and bytes per interaction: PNG charts vs. client-side charts.
+
+Starts the app once per chart mode (HIV_CHART_MODE=png, the cached
+matplotlib images, and HIV_CHART_MODE=client, see client_charts.py) and
+replays the same interactions in one session, with random values so the
+PNG renders miss the plot cache:
+
+  country     switch country (summary cards and the three line charts)
+  year_range  move a line chart's year range slider
+  year        step the gender scatter to another year
+  highlight   highlight another country in the scatter
+
+For each, it reports the bytes the server sent and the CPU time the server
+(and its render processes) spent, from sending the input until every output
+it affects has its new value. In client mode the year range and highlight
+are applied in the browser and never sent, so they cost the server nothing.
+Run from the repository root:
+
+    python benchmarks/bench_chart_modes.py [--steps 10]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from shiny_session import ShinySession, start_server  # noqa: E402
+
+LINE_OUTPUTS = ["new_cases_line", "deaths_line", "art_coverage_line"]
+COUNTRIES = ["Kenya", "Vietnam", "Brazil", "India", "South Africa", "Thailand",
+             "Nigeria", "France", "Mexico", "Uganda", "Chile", "Ghana"]
+SCATTER_COUNTRIES = ["Kenya", "Viet Nam", "Brazil", "India", "South Africa", "Thailand",
+                     "Nigeria", "Mexico", "Uganda", "Chile", "Ghana", "Zambia"]
+# Interactions that client mode handles in the browser
+CLIENT_SIDE = {"year_range", "highlight"}
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+
+def cpu_seconds(pid):
+    """User + system CPU time of a process and all of its descendants."""
+    total, stack = 0, [pid]
+    while stack:
+        pid = stack.pop()
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12])
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children") as f:
+                    stack.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return total / CLK_TCK
+
+
+def interactions(rng, steps):
+    for _ in range(steps):
+        start = rng.randint(1990, 2005)
+        yield "country", {"country": rng.choice(COUNTRIES)}, ["summary_cards", *LINE_OUTPUTS]
+        yield "year_range", {"new_cases_years": [start, rng.randint(start + 1, 2021)]}, ["new_cases_line"]
+        yield "year", {"year": rng.randint(1990, 2022)}, ["gender_scatter"]
+        yield "highlight", {"country_scatter": rng.choice(SCATTER_COUNTRIES)}, ["gender_scatter"]
+
+
+async def replay(url, pid, mode, steps, seed):
+    session = ShinySession(url)
+    await session.connect(wait_for=[*LINE_OUTPUTS, "gender_scatter"])
+    results = {}
+    for name, inputs, outputs in interactions(random.Random(seed), steps):
+        if mode == "client" and name in CLIENT_SIDE:
+            results.setdefault(name, []).append((0, 0.0))
+            continue
+        await asyncio.sleep(0.2)
+        received, cpu = session.bytes_received, cpu_seconds(pid)
+        await session.update(inputs, wait_for=outputs)
+        # Let the ticks of the last render land
+        await asyncio.sleep(0.05)
+        results.setdefault(name, []).append(
+            (session.bytes_received - received, cpu_seconds(pid) - cpu)
+        )
+    await session.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--steps", type=int, default=10, help="rounds of the four interactions")
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    totals = {}
+    for mode in ("png", "client"):
+        server = start_server(args.port, {"HIV_CHART_MODE": mode, "HIV_WATCH_DATA": "0"})
+        try:
+            time.sleep(1)
+            results = asyncio.run(replay(
+                f"ws://127.0.0.1:{args.port}/websocket/", server.pid, mode, args.steps, args.seed
+            ))
+        finally:
+            server.terminate()
+            server.wait()
+
+        print(f"{mode}")
+        totals[mode] = [0, 0.0]
+        for name, samples in results.items():
+            sizes = [size for size, _ in samples]
+            # Mean: /proc counts CPU time in clock ticks (usually 10 ms)
+            cpus = [cpu for _, cpu in samples]
+            totals[mode][0] += sum(sizes)
+            totals[mode][1] += sum(cpus)
+            where = "  (in the browser)" if mode == "client" and name in CLIENT_SIDE else ""
+            print(f"  {name:<11} median {statistics.median(sizes):8.0f} bytes   "
+                  f"server CPU mean {statistics.mean(cpus) * 1000:6.1f} ms{where}")
+
+    (png_bytes, png_cpu), (client_bytes, client_cpu) = totals["png"], totals["client"]
+    print(f"total: png {png_bytes / 1024:.0f} KiB, {png_cpu:.2f} s CPU; "
+          f"client {client_bytes / 1024:.0f} KiB, {client_cpu:.2f} s CPU")
+
+
+if __name__ == "__main__":
+    main()
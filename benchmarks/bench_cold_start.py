@@ -0,0 +1,68 @@
+"""Cold-start time of the dataset layer: CSV pipeline vs. snapshot load.
+
+Each measurement runs in a fresh interpreter so nothing is shared between
+runs except the OS page cache. Run from the repository root:
+
+    python benchmarks/bench_cold_start.py --repeat 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# pandas/numpy are imported before the clock starts: both paths pay for
+# them and they would otherwise dominate the measurement.
+CSV_PATH = """
+import time
+import pandas
+t = time.perf_counter()
+from preprocess import build_datasets
+build_datasets("data")
+print(time.perf_counter() - t)
+"""
+
+SNAPSHOT_PATH = """
+import time
+import pandas
+t = time.perf_counter()
+from snapshot import load_datasets
+load_datasets("data", snapshot_dir={snapshot_dir!r})
+print(time.perf_counter() - t)
+"""
+
+
+def run(code, repeat):
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", code], cwd=ROOT, check=True,
+            capture_output=True, text=True,
+        )
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    return times
+
+
+def report(label, times):
+    print(f"{label:<22} median {statistics.median(times) * 1000:8.1f} ms"
+          f"   min {min(times) * 1000:8.1f} ms   (n={len(times)})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        code = SNAPSHOT_PATH.format(snapshot_dir=snapshot_dir)
+        # First run builds the snapshot; measure it separately
+        report("snapshot (rebuild)", run(code, 1))
+        report("snapshot (valid)", run(code, args.repeat))
+    report("csv pipeline", run(CSV_PATH, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
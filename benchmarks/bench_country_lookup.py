@@ -0,0 +1,55 @@
+"""Country lookup for the deaths/new cases/ART panel: boolean masks vs. index.
+
+Times what one country switch costs the four panel outputs (summary cards and
+three line charts) with the old full-frame scans and with CountryIndex.
+Run from the repository root:
+
+    python benchmarks/bench_country_lookup.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from country_index import CountryIndex  # noqa: E402
+from snapshot import load_datasets  # noqa: E402
+
+df = load_datasets("data")["df_deaths_new_cases"]
+index = CountryIndex(df)
+COUNTRY = "Vietnam"
+YEARS = (2000, 2015)
+
+
+def mask_lookup():
+    # summary_cards
+    d = df[df["Country"] == COUNTRY]
+    d[d["Year"] == d["Year"].max()]
+    # three line charts
+    for metric in ("New Cases", "Deaths", "ART"):
+        d = df[df["Country"] == COUNTRY]
+        d = d[(d["Year"] >= YEARS[0]) & (d["Year"] <= YEARS[1])]
+        d[metric].to_numpy()
+
+
+def index_lookup():
+    series = index.get(COUNTRY)
+    series.latest()
+    for metric in ("New Cases", "Deaths", "ART"):
+        series.between(*YEARS)[1][metric]
+
+
+def main():
+    # Same answer from both paths
+    d = df[(df["Country"] == COUNTRY) & df["Year"].between(*YEARS)].sort_values("Year")
+    years, values = index.get(COUNTRY).between(*YEARS)
+    assert (d["Year"].to_numpy() == years).all()
+    assert (d["Deaths"].to_numpy() == values["Deaths"]).all()
+
+    for label, fn in [("boolean masks", mask_lookup), ("CountryIndex", index_lookup)]:
+        n, total = timeit.Timer(fn).autorange()
+        print(f"{label:<15} {total / n * 1e6:10.1f} us per country switch")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Latency and bytes of the data API: first request, cached, and 304 polls.
+
+Starts the app and, for a few queries (a whole dataset, one country, one
+country's year range and indicator), times the first request (which encodes
+the body), the same request again (served from the response cache) and a
+poll with If-None-Match (answered 304 without touching the data), over one
+keep-alive connection. Run from the repository root:
+
+    python benchmarks/bench_data_api.py [--repeat 200]
+"""
+import argparse
+import http.client
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from shiny_session import percentile, start_server  # noqa: E402
+
+QUERIES = [
+    "/api/datasets/deaths_new_cases",
+    "/api/datasets/prevalence_female",
+    "/api/datasets/deaths_new_cases?country=Kenya",
+    "/api/datasets/deaths_new_cases?country=Kenya&start=2010&end=2019&indicator=ART",
+]
+
+
+def request(connection, path, headers=None):
+    start = time.perf_counter()
+    connection.request("GET", path, headers=headers or {})
+    response = connection.getresponse()
+    body = response.read()
+    return time.perf_counter() - start, response.status, len(body), response.getheader("ETag")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200, help="requests per cached / 304 sample")
+    parser.add_argument("--port", type=int, default=8798)
+    args = parser.parse_args()
+
+    server = start_server(args.port, {"HIV_WATCH_DATA": "0"})
+    try:
+        connection = http.client.HTTPConnection("127.0.0.1", args.port)
+        for path in QUERIES:
+            first, status, size, tag = request(connection, path)
+            if status != 200:
+                sys.exit(f"{path}: HTTP {status}")
+            cached = [request(connection, path)[0] for _ in range(args.repeat)]
+            polls = [request(connection, path, {"If-None-Match": tag}) for _ in range(args.repeat)]
+            assert all(status == 304 and size == 0 for _, status, size, _ in polls)
+            polls = [seconds for seconds, *_ in polls]
+            print(path)
+            print(f"  first   {first * 1000:7.2f} ms  {size:8d} bytes")
+            print(f"  cached  {statistics.median(cached) * 1000:7.2f} ms median, "
+                  f"p95 {percentile(cached, 95) * 1000:.2f} ms")
+            print(f"  304     {statistics.median(polls) * 1000:7.2f} ms median, "
+                  f"p95 {percentile(polls, 95) * 1000:.2f} ms, 0 bytes")
+        connection.close()
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Cost of one geo_map year slider step: full rebuild vs. in-place patch.
+
+In-process mode compares the old per-step path (filter the reshaped frame,
+build a px.choropleth, serialize the whole figure) with the patch path
+(look up the precomputed arrays, serialize only the trace update). The
+full-figure size is a lower bound for the old path: it also re-sent the
+plotly widget bundle with every new widget.
+
+--live starts the app with uvicorn, opens a Shiny websocket session and
+records the bytes received and the time until the last message for each
+slider step. Run from the repository root:
+
+    python benchmarks/bench_geo_map.py [--live]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def in_process(years):
+    import plotly.express as px
+    import plotly.io as pio
+
+    from geo_payloads import payload_for, year_payloads
+    from snapshot import load_datasets
+
+    datasets = load_datasets("data")
+    df = datasets["df_adult_newly_infected_reshaped"]
+    payloads = year_payloads(datasets["cube"], "adult_newly_infected")
+
+    def rebuild(year):
+        fig = px.choropleth(
+            df[df["Year"] == year], locations="Code", color="Adult",
+            hover_name="Country", color_continuous_scale=px.colors.sequential.Plasma,
+            title=f"Adult Newly Infected - {year}",
+        )
+        return pio.to_json(fig)
+
+    def patch(year):
+        payload = payload_for(payloads, year)
+        return json.dumps({
+            "locations": payload["locations"].tolist(),
+            "z": payload["z"].tolist(),
+            "hovertext": payload["hovertext"].tolist(),
+            "title": f"Adult Newly Infected - {year}",
+        })
+
+    for label, fn in [("full rebuild", rebuild), ("patch", patch)]:
+        times, sizes = [], []
+        for year in years:
+            t = time.perf_counter()
+            sizes.append(len(fn(year)))
+            times.append(time.perf_counter() - t)
+        print(f"{label:<14} {statistics.median(times) * 1000:8.2f} ms/step"
+              f"   {statistics.median(sizes) / 1024:8.1f} KiB/step")
+
+
+async def live_session(port, years):
+    import websockets
+
+    async def drain(ws, timeout):
+        received, last = 0, None
+        while True:
+            try:
+                msg = await asyncio.wait_for(ws.recv(), timeout=timeout)
+            except asyncio.TimeoutError:
+                return received, last
+            received += len(msg)
+            last = time.perf_counter()
+
+    init = {
+        "country": "Vietnam", "new_cases_years": [1990, 2021], "deaths_years": [1990, 2021],
+        "art_years": [1990, 2021], "year": 1990, "country_scatter": "Viet Nam",
+        "year_slider": years[0], ".clientdata_pixelratio": 1,
+        ".clientdata_output_geo_map_hidden": False,
+    }
+    async with websockets.connect(f"ws://127.0.0.1:{port}/websocket/", max_size=None) as ws:
+        await ws.send(json.dumps({"method": "init", "data": init}))
+        await drain(ws, 2)
+        await ws.send(json.dumps({"method": "update", "data": {"dataset_type": "adult"}}))
+        received, _ = await drain(ws, 2)
+        print(f"{'dataset toggle':<14} {received / 1024:10.1f} KiB")
+
+        sizes, times = [], []
+        for year in years[1:]:
+            start = time.perf_counter()
+            await ws.send(json.dumps({"method": "update", "data": {"year_slider": year}}))
+            received, last = await drain(ws, 0.5)
+            sizes.append(received)
+            times.append((last or start) - start)
+        print(f"{'slider step':<14} {statistics.median(times) * 1000:8.2f} ms/step"
+              f"   {statistics.median(sizes) / 1024:8.1f} KiB/step")
+
+
+def live(years, port=8799):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+    )
+    try:
+        time.sleep(5)
+        asyncio.run(live_session(port, years))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--live", action="store_true", help="measure a running app over websockets")
+    args = parser.parse_args()
+
+    years = list(range(2000, 2024))
+    if args.live:
+        live(years)
+    else:
+        in_process(years)
+
+
+if __name__ == "__main__":
+    main()
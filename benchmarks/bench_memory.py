@@ -0,0 +1,80 @@
+"""Peak RSS after `import app`: compact ingestion vs. default pandas dtypes.
+
+Each measurement imports the app in a fresh interpreter, once with the
+snapshot being rebuilt from the CSVs and once loading the valid snapshot.
+The dependencies are imported first and their peak RSS is subtracted, so
+the numbers are what the datasets (and the derived indexes) add on top.
+Exits with status 1 if compact ingestion doesn't lower the peak. Run from
+the repository root:
+
+    python benchmarks/bench_memory.py --repeat 3
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_APP = """
+import json, resource
+import matplotlib.figure, pandas, plotly.express, shiny, shinywidgets
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+import app
+from preprocess import memory_report
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"peak_kib": after - before, "frames": memory_report(app.store.snapshot.datasets)["total"]}))
+"""
+
+
+def run(compact, snapshot_dir):
+    env = dict(
+        os.environ,
+        HIV_COMPACT_INGEST="1" if compact else "0",
+        HIV_SNAPSHOT_DIR=snapshot_dir,
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", IMPORT_APP], cwd=ROOT, env=env, check=True,
+        capture_output=True, text=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def measure(compact, repeat):
+    """Median peak RSS delta (KiB) for the rebuild and the valid-snapshot paths."""
+    rebuild, valid = [], []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            rebuild.append(run(compact, snapshot_dir))
+            valid.append(run(compact, snapshot_dir))
+    return {
+        "rebuild": statistics.median(r["peak_kib"] for r in rebuild),
+        "valid": statistics.median(r["peak_kib"] for r in valid),
+        "frames_kib": valid[-1]["frames"] / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    results = {"default": measure(False, args.repeat), "compact": measure(True, args.repeat)}
+    for label, r in results.items():
+        print(f"{label:<8} peak +{r['rebuild']:8.0f} KiB (rebuild)   "
+              f"+{r['valid']:8.0f} KiB (snapshot)   frames {r['frames_kib']:6.0f} KiB")
+
+    regressed = [
+        path for path in ("rebuild", "valid")
+        if results["compact"][path] >= results["default"][path]
+    ]
+    if regressed:
+        print(f"FAIL: compact ingestion doesn't lower peak RSS ({', '.join(regressed)})")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Output latency under concurrent sessions (p50/p99).
+
+Starts the app under uvicorn, connects 1, 10 and 50 simulated sessions and
+runs two cases, reporting per-output latency percentiles from sending the
+input to receiving the new value:
+
+  lines    each session switches country and line chart year ranges a few
+           times, with random values so most renders miss the plot cache
+  geo_map  half of the sessions toggle the geo map's dataset, rebuilding the
+           choropleth, while the other half switch country; the summary
+           cards of the latter show whether a map render in the pool holds
+           up other sessions
+
+Run from the repository root:
+
+    python benchmarks/bench_render_concurrency.py [--pool thread|process] [--workers 4]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from shiny_session import ShinySession, default_inputs, percentile, start_server  # noqa: E402
+
+LINE_OUTPUTS = ["new_cases_line", "deaths_line", "art_coverage_line"]
+COUNTRIES = ["Kenya", "Vietnam", "Brazil", "India", "South Africa", "Thailand",
+             "Nigeria", "France", "Mexico", "Uganda"]
+
+
+async def run_session(url, steps, rng, latencies):
+    session = ShinySession(url)
+    await session.connect(wait_for=LINE_OUTPUTS)
+    for _ in range(steps):
+        start = rng.randint(1990, 2005)
+        end = rng.randint(start + 1, 2021)
+        result = await session.update({
+            "country": rng.choice(COUNTRIES),
+            "new_cases_years": [start, end],
+            "deaths_years": [start, end],
+            "art_years": [start, end],
+        }, wait_for=LINE_OUTPUTS)
+        for name, latency in result.items():
+            latencies.setdefault(name, []).append(latency)
+    await session.close()
+
+
+async def geo_map_session(url, steps, rng, latencies):
+    session = ShinySession(url)
+    dataset = "adult"
+    await session.connect({**default_inputs(), "dataset_type": dataset}, wait_for=["geo_map"])
+    for _ in range(steps):
+        dataset = "children" if dataset == "adult" else "adult"
+        result = await session.update({"dataset_type": dataset}, wait_for=["geo_map"])
+        latencies.setdefault("geo_map", []).append(result["geo_map"])
+    await session.close()
+
+
+async def country_session(url, steps, rng, latencies):
+    session = ShinySession(url)
+    await session.connect(wait_for=["summary_cards"])
+    country = None
+    for _ in range(steps):
+        country = rng.choice([c for c in COUNTRIES if c != country])
+        result = await session.update({"country": country}, wait_for=["summary_cards"])
+        latencies.setdefault("summary_cards", []).append(result["summary_cards"])
+    await session.close()
+
+
+CASES = {
+    "lines": [run_session],
+    "geo_map": [geo_map_session, country_session],
+}
+
+
+async def run(url, case, sessions, steps, seed):
+    rng = random.Random(seed)
+    latencies = {}
+    kinds = CASES[case]
+    await asyncio.gather(*[
+        kinds[i % len(kinds)](url, steps, random.Random(rng.random()), latencies)
+        for i in range(max(sessions, len(kinds)))
+    ])
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pool", default="thread", choices=["thread", "process"])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=list(CASES))
+    parser.add_argument("--port", type=int, default=8798)
+    args = parser.parse_args()
+
+    server = start_server(args.port, env={
+        "HIV_RENDER_POOL": args.pool, "HIV_RENDER_WORKERS": str(args.workers),
+    })
+    try:
+        url = f"ws://127.0.0.1:{args.port}/websocket/"
+        for case in args.cases:
+            print(f"{case}:")
+            for n in args.sessions:
+                latencies = asyncio.run(run(url, case, n, args.steps, seed=n))
+                merged = [v for values in latencies.values() for v in values]
+                print(f"{n:>3} sessions   p50 {percentile(merged, 50) * 1000:8.1f} ms"
+                      f"   p99 {percentile(merged, 99) * 1000:8.1f} ms   ({len(merged)} renders)")
+                for name, values in sorted(latencies.items()):
+                    print(f"      {name:<18} p50 {percentile(values, 50) * 1000:8.1f} ms"
+                          f"   p99 {percentile(values, 99) * 1000:8.1f} ms")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Regional and income group rollups: computing them, region vs. country lookup.
+
+Times appending every group's rows to the deaths/new cases/ART panel (as a
+reload does after any panel file changed) next to re-reading the panel
+CSV, and one switch of the `country` selector to a region and to a country.
+Run from the repository root, optionally on scaled-up data
+(benchmarks/synthetic_data.py):
+
+    python benchmarks/bench_rollups.py [--data-dir /tmp/data-100x] [--country Kenya]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from country_index import CountryIndex  # noqa: E402
+from preprocess import DEATHS_COLUMNS, read_owid  # noqa: E402
+from rollups import GROUPS, read_country_groups, with_rollups  # noqa: E402
+from snapshot import load_datasets  # noqa: E402
+
+REGION = "Sub-Saharan Africa"
+
+
+def per_call(fn):
+    n, total = timeit.Timer(fn).autorange()
+    return total / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--country", default="Kenya", help="the country to switch to")
+    args = parser.parse_args()
+
+    loaded = load_datasets(args.data_dir)["df_deaths_new_cases"]
+    membership = read_country_groups(args.data_dir)
+    path = os.path.join(args.data_dir, "deaths-and-new-cases-of-hiv.csv")
+    # The country rows as build_deaths_new_cases() has them before filling ART
+    panel = loaded[~loaded["Code"].isin(list(GROUPS))].reset_index(drop=True)
+    panel["ART"] = panel["ART"].mask(panel["ART"] == 0)
+    rolled_up = with_rollups(panel, membership)
+
+    print(f"{len(panel)} country rows, {len(GROUPS)} groups")
+    print(f"read panel    {per_call(lambda: read_owid(path, DEATHS_COLUMNS)) * 1000:8.2f} ms")
+    print(f"rollups       {per_call(lambda: with_rollups(panel, membership)) * 1000:8.2f} ms")
+
+    index = CountryIndex(rolled_up.fillna({"ART": 0}))
+    for name in (REGION, args.country):
+        def switch():
+            series = index.get(name)
+            series.latest()
+            for metric in ("New Cases", "Deaths", "ART"):
+                series.between(2000, 2015)[1][metric]
+        print(f"{name:<22} {per_call(switch) * 1e6:8.1f} us per selector switch")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Combined dataset memory of N workers: shared snapshot vs. private copies.
+
+Starts N worker processes that import the app the way uvicorn workers do,
+either attached to one published snapshot (HIV_SNAPSHOT_PATH, as serve.py
+does) or each parsing its own copy of the CSVs. Memory is measured as PSS
+(proportional set size), which splits every shared page between the
+processes mapping it, so the sum over workers is their real footprint. The
+dependencies are imported before the first measurement; the reported
+numbers are what importing the app adds across all workers, split into
+file-backed pages (the mapped snapshot) and anonymous memory (per-worker
+state such as the rendered UI and lookup tables).
+
+Exits with status 1 if the file-backed part grows with the worker count, or
+if adding a worker costs as much as with private copies. The bundled data
+is small next to the app itself, so --scale replicates every country to
+make the dataset dominate (the country selectors grow with it). Run from
+the repository root:
+
+    python benchmarks/bench_shared_workers.py --workers 1 2 4 8 --scale 50
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+
+from synthetic_data import scale_data
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def pss_kib():
+    """(total, file-backed, anonymous) PSS of this process in KiB."""
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Pss", "Pss_File", "Pss_Anon"):
+                fields[key] = int(rest.split()[0])
+    return fields["Pss"], fields["Pss_File"], fields["Pss_Anon"]
+
+
+def worker(barrier, results):
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    sys.stderr = open(os.devnull, "w")  # the app's startup memory report
+    import matplotlib.figure, pandas, plotly.express, shiny, shinywidgets  # noqa: F401,E401
+    import country_index, figures, geo_payloads, plot_cache, scatter_frames, snapshot  # noqa: F401,E401
+
+    barrier.wait()
+    before = pss_kib()
+    barrier.wait()
+    import app  # noqa: F401
+    barrier.wait()  # every worker has its data before anyone measures
+    results.put([after - b for after, b in zip(pss_kib(), before)])
+    barrier.wait()
+
+
+def combined_growth(n, env):
+    os.environ.update(env)
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(n)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(barrier, results)) for _ in range(n)]
+    for p in procs:
+        p.start()
+    growth = [sum(column) for column in zip(*[results.get(timeout=300) for _ in procs])]
+    for p in procs:
+        p.join()
+    return growth
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--scale", type=int, default=1)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    from serve import publish_snapshot
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = "data"
+        if args.scale > 1:
+            data_dir = scale_data("data", os.path.join(tmp, "data"), args.scale)
+        os.environ["HIV_DATA_DIR"] = data_dir
+        shared = {"HIV_SNAPSHOT_PATH": publish_snapshot(data_dir, os.path.join(tmp, "snapshots"))}
+        # An unwritable snapshot directory makes every worker parse the CSVs
+        private = {"HIV_SNAPSHOT_PATH": "", "HIV_SNAPSHOT_DIR": "/proc/no-snapshots"}
+
+        results = {}
+        print(f"{'':>7} {'shared (file + anon)':>30} {'private (file + anon)':>30}")
+        for n in args.workers:
+            results[n] = (combined_growth(n, shared), combined_growth(n, private))
+            print(f"{n:>2} workers" + "".join(
+                f" {total:>9} KiB ({file:>7} + {anon:>7})" for total, file, anon in results[n]
+            ))
+
+    lo, hi = min(args.workers), max(args.workers)
+    if hi > lo:
+        shared_slope = (results[hi][0][0] - results[lo][0][0]) / (hi - lo)
+        private_slope = (results[hi][1][0] - results[lo][1][0]) / (hi - lo)
+        print(f"per extra worker: shared {shared_slope:.0f} KiB, private {private_slope:.0f} KiB")
+        # The mapped snapshot pages are counted once however many workers map them
+        shared_file = results[hi][0][1], results[lo][0][1]
+        if shared_file[0] > 1.25 * shared_file[1] + 1024 or shared_slope >= private_slope:
+            print("FAIL: the shared snapshot doesn't stay flat as workers are added")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
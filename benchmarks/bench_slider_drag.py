@@ -0,0 +1,132 @@
+"""Server work for a scripted slider drag, with and without input coalescing.
+
+Starts the app under uvicorn twice, with HIV_INPUT_COALESCE=off and with the
+default settings (see coalesce.py), and has one session drag every slider
+one step at a time without waiting for the outputs, like a browser does:
+the three line chart year ranges, the scatter year and the geo map year.
+After each drag it waits until the server has been quiet for --settle
+seconds. Reports, per run and drag, the server's CPU time (process tree),
+the plots rendered in the pool, the slider values dropped by coalescing and
+the renders held back behind a running one, and the time from the last step
+until the last message. Run from the repository root:
+
+    python -m benchmarks.bench_slider_drag [--interval 0.02] [--settle 1]
+"""
+import argparse
+import asyncio
+import os
+import time
+import urllib.request
+
+from .load import _process_tree
+from .shiny_session import ShinySession, start_server
+
+DRAGS = [
+    # (name, slider, values)
+    ("new cases range", "new_cases_years", [[1990, end] for end in range(1991, 2022)]),
+    ("deaths range", "deaths_years", [[1990, end] for end in range(1991, 2022)]),
+    ("ART range", "art_years", [[start, 2021] for start in range(1990, 2021)]),
+    ("scatter year", "year", list(range(1990, 2020))),
+    ("geo map year", "year_slider", list(range(2000, 2024))),
+]
+COUNTERS = {
+    "rendered": ("hiv_render_pool", {"stat": "completed"}),
+    "coalesced": ("hiv_input_values_total", {"outcome": "coalesced"}),
+    "deferred": ("hiv_output_renders_deferred_total", {}),
+}
+
+
+def cpu_seconds(pid):
+    """User + system CPU time of a process and all of its descendants."""
+    ticks = 0
+    for p in _process_tree(pid):
+        try:
+            with open(f"/proc/{p}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            ticks += int(fields[11]) + int(fields[12])
+        except OSError:
+            pass
+    return ticks / os.sysconf("SC_CLK_TCK")
+
+
+def scrape(port):
+    """Sum of the samples of each of COUNTERS on /metrics."""
+    text = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics").read().decode()
+    totals = dict.fromkeys(COUNTERS, 0.0)
+    for line in text.splitlines():
+        if line.startswith("#") or not line:
+            continue
+        sample, value = line.rsplit(" ", 1)
+        name, _, labels = sample.partition("{")
+        for counter, (metric, wanted) in COUNTERS.items():
+            if name == metric and all(f'{k}="{v}"' in labels for k, v in wanted.items()):
+                totals[counter] += float(value)
+    return totals
+
+
+async def wait_quiet(session, settle):
+    while time.perf_counter() - session.last_received < settle:
+        await asyncio.sleep(0.05)
+
+
+async def drag_all(port, pid, interval, settle):
+    session = ShinySession(f"ws://127.0.0.1:{port}/websocket/")
+    await session.connect(wait_for=["new_cases_line", "deaths_line", "art_coverage_line", "gender_scatter"])
+    await session.update({"dataset_type": "adult"}, wait_for=["geo_map"])
+    await wait_quiet(session, settle)
+
+    results = []
+    for label, slider, values in DRAGS:
+        before, cpu = scrape(port), cpu_seconds(pid)
+        for value in values:
+            await session.update({slider: value})
+            last_step = time.perf_counter()
+            await asyncio.sleep(interval)
+        await wait_quiet(session, settle)
+        after = scrape(port)
+        results.append({
+            "drag": label,
+            "steps": len(values),
+            "cpu_s": cpu_seconds(pid) - cpu,
+            **{name: after[name] - before[name] for name in COUNTERS},
+            "tail_ms": max(session.last_received - last_step, 0.0) * 1000,
+        })
+    await session.close()
+    return results
+
+
+def run(label, env, port, interval, settle):
+    server = start_server(port, env=env)
+    try:
+        results = asyncio.run(drag_all(port, server.pid, interval, settle))
+    finally:
+        server.terminate()
+        server.wait()
+    print(f"{label}:")
+    for r in results:
+        print(f"  {r['drag']:<16} {r['steps']:3d} steps  {r['cpu_s']:6.2f} s CPU"
+              f"  {r['rendered']:4.0f} rendered  {r['coalesced']:4.0f} coalesced"
+              f"  {r['deferred']:4.0f} deferred  {r['tail_ms']:7.1f} ms tail")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--interval", type=float, default=0.02, help="seconds between slider steps")
+    parser.add_argument("--settle", type=float, default=1.0, help="quiet seconds that end a drag")
+    parser.add_argument("--port", type=int, default=8797)
+    args = parser.parse_args()
+
+    off = run("HIV_INPUT_COALESCE=off", {"HIV_INPUT_COALESCE": "off"}, args.port, args.interval, args.settle)
+    on = run("coalescing (defaults)", {"HIV_INPUT_COALESCE": ""}, args.port, args.interval, args.settle)
+
+    cpu_off = sum(r["cpu_s"] for r in off)
+    cpu_on = sum(r["cpu_s"] for r in on)
+    renders_off = sum(r["rendered"] for r in off)
+    renders_on = sum(r["rendered"] for r in on)
+    print(f"server CPU {cpu_off:.2f} s -> {cpu_on:.2f} s"
+          f" ({1 - cpu_on / cpu_off:.0%} less), pool renders {renders_off:.0f} -> {renders_on:.0f}")
+
+
+if __name__ == "__main__":
+    main()
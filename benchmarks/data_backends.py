@@ -0,0 +1,156 @@
+"""Data backends (see backends.py) compared at growing data sizes.
+
+For each --scales factor, data/ is scaled up by synthetic_data.py and its
+snapshot built once. Then, in a fresh interpreter per backend and run:
+
+    ingest  the first open, which for sqlite also builds the database
+    open    a cold open of the same snapshot afterwards
+    peak    peak RSS of the process after the queries, in MiB
+
+and the latency of each query the dashboard makes, first call and median
+of --repeat calls, with the number of rows it returned. The results of
+every query are compared across backends and the script exits with status
+1 if they differ. Usage, from the repository root:
+
+    python -m benchmarks.data_backends [--scales 1 100 1000] [--json results/backends.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from .results import write_results
+from .shiny_session import ROOT
+from .synthetic_data import scale_data
+
+COUNTRY = "Vietnam"
+YEAR = 2015
+
+# Runs in the child: {name: query} over `backend`
+QUERIES = f"""
+QUERIES = {{
+    "country_series": lambda: backend.country_series({COUNTRY!r}, 2000, 2020, ["New Cases"]),
+    "latest": lambda: backend.latest({COUNTRY!r}),
+    "aligned": lambda: backend.aligned({YEAR}, "adult_newly_infected"),
+    "aligned_pair": lambda: backend.aligned({YEAR}, "prevalence_male", "prevalence_female"),
+    "years_with_data": lambda: backend.years_with_data("prevalence_male", "prevalence_female"),
+}}
+"""
+
+RUN = """
+import hashlib, json, resource, statistics, time
+import numpy as np
+from backends import make_backend
+from data_store import DataSnapshot
+from snapshot import open_datasets
+
+def digest(result):
+    parts = result.values() if isinstance(result, dict) else result
+    if isinstance(result, tuple) and isinstance(result[1], dict):
+        parts = [result[0], *result[1].values()]
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(repr(np.asarray(part).tolist()).encode())
+    return h.hexdigest()
+
+def rows(result):
+    if isinstance(result, dict):
+        return 1
+    return len(result if isinstance(result, np.ndarray) else result[0])
+
+t = time.perf_counter()
+snapshot = DataSnapshot(open_datasets({data_dir!r}))
+backend = make_backend(snapshot, {kind!r})
+if {kind!r} == "pandas":
+    snapshot.country_index, snapshot["cube"]
+opened = time.perf_counter() - t
+{queries}
+out = {{"open_s": opened, "queries": {{}}}}
+for name, query in QUERIES.items():
+    t = time.perf_counter()
+    result = query()
+    first = time.perf_counter() - t
+    times = []
+    for _ in range({repeat}):
+        t = time.perf_counter()
+        query()
+        times.append(time.perf_counter() - t)
+    out["queries"][name] = {{
+        "first_ms": first * 1000,
+        "median_ms": statistics.median(times) * 1000,
+        "rows": rows(result),
+        "digest": digest(result),
+    }}
+out["peak_mib"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps(out))
+"""
+
+
+def run(kind, data_dir, env, repeat):
+    code = RUN.format(data_dir=data_dir, kind=kind, repeat=repeat, queries=QUERIES)
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, env={**os.environ, **env},
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--backends", nargs="+", default=["pandas", "sqlite"])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", default=None, help="write results to this file ('-' for stdout)")
+    args = parser.parse_args()
+
+    results = {}
+    mismatches = []
+    for scale in args.scales:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {"HIV_SNAPSHOT_DIR": os.path.join(tmp, "snapshots")}
+            data_dir = "data"
+            if scale > 1:
+                data_dir = scale_data("data", os.path.join(tmp, "data"), scale)
+            # The snapshot is shared: only the backends' own work is measured
+            subprocess.run(
+                [sys.executable, "-c", f"from snapshot import open_datasets; open_datasets({data_dir!r})"],
+                cwd=ROOT, env={**os.environ, **env}, check=True,
+            )
+
+            print(f"{scale}x")
+            by_backend = {}
+            for kind in args.backends:
+                ingest = run(kind, data_dir, env, args.repeat)
+                cold = run(kind, data_dir, env, args.repeat)
+                by_backend[kind] = {
+                    "ingest_s": ingest["open_s"],
+                    "open_s": cold["open_s"],
+                    "peak_mib": cold["peak_mib"],
+                    "queries": cold["queries"],
+                }
+                print(f"  {kind:<7} ingest {ingest['open_s'] * 1000:9.0f} ms   "
+                      f"open {cold['open_s'] * 1000:9.0f} ms   peak {cold['peak_mib']:7.0f} MiB")
+                for name, query in cold["queries"].items():
+                    print(f"    {name:<16} first {query['first_ms']:9.2f} ms   "
+                          f"median {query['median_ms']:9.3f} ms   rows {query['rows']:6d}")
+
+            reference = by_backend[args.backends[0]]["queries"]
+            for kind in args.backends[1:]:
+                for name, query in by_backend[kind]["queries"].items():
+                    if query["digest"] != reference[name]["digest"]:
+                        mismatches.append(f"{scale}x {kind} {name}")
+            results[f"{scale}x"] = by_backend
+
+    if args.json:
+        config = {key: getattr(args, key) for key in ("scales", "backends", "repeat")}
+        write_results(args.json, "data_backends", config, results)
+
+    if mismatches:
+        print(f"FAIL: results differ from {args.backends[0]}: {', '.join(mismatches)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""Headless load generator: many Shiny sessions replaying realistic input sequences.
+
+Starts the app under uvicorn (optionally on synthetic data scaled up with
+--scale) and, for each session count, connects that many websocket sessions
+at once. Every session replays a seeded random mix of scenarios:
+
+  country   switch country (summary cards and the three line charts)
+  drag      drag a line chart year range one year at a time
+  animate   play the gender scatter animation for a few years
+  dataset   toggle the geo map dataset, then move its year slider
+
+Latency is the time from sending an input to receiving the output's new
+value (for the geo map slider, its widget update message); an output that
+doesn't arrive within a minute counts as an error. For drags and
+animation steps, intermediate values are sent without waiting, like a
+browser does, and only the last step is timed. Server memory is the RSS
+of the server and its child processes, sampled while the sessions run.
+Usage, from the repository root:
+
+    python -m benchmarks.load --sessions 1 10 50 --json results/load.json
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from .results import summarize, write_results
+from .shiny_session import ShinySession, default_inputs, start_server
+from .synthetic_data import scale_data
+
+LINE_OUTPUTS = ["new_cases_line", "deaths_line", "art_coverage_line"]
+COUNTRIES = ["Kenya", "Vietnam", "Brazil", "India", "South Africa", "Thailand",
+             "Nigeria", "France", "Mexico", "Uganda"]
+SCATTER_COUNTRIES = ["Kenya", "Viet Nam", "Brazil", "India", "South Africa", "Thailand"]
+SCENARIOS = ["country", "drag", "animate", "dataset"]
+INITIAL_OUTPUTS = ["summary_cards", *LINE_OUTPUTS, "gender_scatter", "geo_map"]
+GEO_UPDATE = "custom:shinywidgets_comm_msg"
+
+
+def _process_tree(pid):
+    pids, stack = [], [pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        try:
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children") as f:
+                    stack.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def rss_bytes(pid):
+    """RSS of a process and all of its descendants."""
+    total = 0
+    for p in _process_tree(pid):
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.updates = 0
+        # Scenarios whose output never arrived, by scenario
+        self.timeouts = {}
+
+    def add(self, result):
+        self.updates += 1
+        for name, latency in result.items():
+            self.latencies.setdefault(name, []).append(latency)
+
+    def timeout(self, scenario):
+        self.timeouts[scenario] = self.timeouts.get(scenario, 0) + 1
+
+
+async def country_switch(session, rng, recorder):
+    recorder.add(await session.update(
+        {"country": rng.choice(COUNTRIES)}, wait_for=["summary_cards", *LINE_OUTPUTS]
+    ))
+
+
+async def slider_drag(session, rng, recorder, interval):
+    name, output = rng.choice([
+        ("new_cases_years", "new_cases_line"),
+        ("deaths_years", "deaths_line"),
+        ("art_years", "art_coverage_line"),
+    ])
+    start = rng.randint(1990, 2005)
+    ends = list(range(start + 1, rng.randint(start + 2, 2021) + 1))
+    for end in ends[:-1]:
+        await session.update({name: [start, end]})
+        await asyncio.sleep(interval)
+    recorder.add(await session.update({name: [start, ends[-1]]}, wait_for=[output]))
+
+
+async def animate(session, rng, recorder, interval):
+    await session.update({"country_scatter": rng.choice(SCATTER_COUNTRIES)})
+    first = rng.randint(1990, 2015)
+    for year in range(first, first + 5):
+        await session.update({"year": year})
+        await asyncio.sleep(interval)
+    recorder.add(await session.update({"year": first + 5}, wait_for=["gender_scatter"]))
+
+
+async def dataset_toggle(session, rng, recorder, state):
+    state["dataset"] = "children" if state["dataset"] == "adult" else "adult"
+    recorder.add(await session.update(
+        {"dataset_type": state["dataset"]}, wait_for=["geo_map"]
+    ))
+    # Let the new widget's setup messages arrive before timing the slider
+    await asyncio.sleep(0.5)
+    # Shiny sends nothing for an unchanged value, so always move the slider
+    year = rng.choice([y for y in range(2000, 2024) if y != state["year"]])
+    state["year"] = year
+    result = await session.update({"year_slider": year}, wait_for=[GEO_UPDATE])
+    recorder.add({"geo_map.year_slider": result[GEO_UPDATE]})
+
+
+async def run_session(url, iterations, rng, recorder, interval):
+    session = ShinySession(url)
+    initial = await session.connect(wait_for=INITIAL_OUTPUTS)
+    recorder.add({f"connect.{name}": latency for name, latency in initial.items()})
+    state = {"dataset": "adult", "year": default_inputs()["year_slider"]}
+    for _ in range(iterations):
+        scenario = rng.choice(SCENARIOS)
+        try:
+            if scenario == "country":
+                await country_switch(session, rng, recorder)
+            elif scenario == "drag":
+                await slider_drag(session, rng, recorder, interval)
+            elif scenario == "animate":
+                await animate(session, rng, recorder, interval)
+            else:
+                await dataset_toggle(session, rng, recorder, state)
+        except asyncio.TimeoutError:
+            # Counted as an error; the session goes on with its next scenario
+            recorder.timeout(scenario)
+    await session.close()
+    return session
+
+
+async def run_level(url, sessions, iterations, seed, interval, server_pid):
+    rng = random.Random(seed)
+    recorder = Recorder()
+    memory = []
+
+    async def sample_memory():
+        while True:
+            memory.append(rss_bytes(server_pid))
+            await asyncio.sleep(0.5)
+
+    sampler = asyncio.create_task(sample_memory())
+    start = time.perf_counter()
+    clients = await asyncio.gather(*[
+        run_session(url, iterations, random.Random(rng.random()), recorder, interval)
+        for _ in range(sessions)
+    ])
+    elapsed = time.perf_counter() - start
+    sampler.cancel()
+    memory.append(rss_bytes(server_pid))
+
+    renders = sum(client.values_received for client in clients)
+    return {
+        "sessions": sessions,
+        "elapsed_s": elapsed,
+        "throughput": {
+            "updates_per_s": recorder.updates / elapsed,
+            "renders_per_s": renders / elapsed,
+            "kib_per_s": sum(client.bytes_received for client in clients) / 1024 / elapsed,
+        },
+        "memory": {"peak_rss_mb": max(memory) / 2**20, "end_rss_mb": memory[-1] / 2**20},
+        "errors": sum(len(client.errors) for client in clients) + sum(recorder.timeouts.values()),
+        "timeouts": recorder.timeouts,
+        "outputs": {name: summarize(values) for name, values in sorted(recorder.latencies.items())},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--iterations", type=int, default=5, help="scenarios per session")
+    parser.add_argument("--interval", type=float, default=0.1,
+                        help="seconds between intermediate drag/animation steps")
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="write results to this file ('-' for stdout)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {"HIV_SNAPSHOT_DIR": os.path.join(tmp, "snapshots")}
+        if args.scale > 1:
+            env["HIV_DATA_DIR"] = scale_data("data", os.path.join(tmp, "data"), args.scale)
+
+        started = time.perf_counter()
+        server = start_server(args.port, env=env)
+        startup = time.perf_counter() - started
+        try:
+            url = f"ws://127.0.0.1:{args.port}/websocket/"
+            idle = rss_bytes(server.pid) / 2**20
+            levels = []
+            for n in args.sessions:
+                level = asyncio.run(run_level(url, n, args.iterations, args.seed + n, args.interval, server.pid))
+                levels.append(level)
+                worst = max(r["p99_ms"] for r in level["outputs"].values())
+                print(f"{n:>3} sessions   {level['throughput']['updates_per_s']:7.1f} updates/s"
+                      f"   peak RSS {level['memory']['peak_rss_mb']:7.1f} MB"
+                      f"   worst output p99 {worst:8.1f} ms   errors {level['errors']}")
+                for name, r in level["outputs"].items():
+                    print(f"      {name:<22} p50 {r['median_ms']:8.1f} ms   p99 {r['p99_ms']:8.1f} ms   (n={r['n']})")
+        finally:
+            server.terminate()
+            server.wait()
+
+    if args.json:
+        config = {key: getattr(args, key) for key in ("sessions", "iterations", "interval", "scale", "seed")}
+        results = {"startup_s": startup, "idle_rss_mb": idle, "levels": levels}
+        write_results(args.json, "load", config, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Micro-benchmarks of the data pipeline stages and of every output's render work.
+
+Stages are timed on a scratch snapshot directory, so the repository's own
+snapshot is left alone. Renders call the same builders the server uses,
+outside of a session: the value boxes of summary_cards, the three line
+charts and the gender scatter rasterized the way cached_plot does (the
+scatter both drawn in full and composed over a pre-rendered base frame),
+and the geo map both built as a full figure and as a slider patch.
+Usage, from the repository root:
+
+    python -m benchmarks.micro [--scale 10] [--repeat 20] [--json results/micro.json]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from functools import partial
+
+from .results import summarize, write_results
+from .synthetic_data import scale_data
+
+COUNTRY = "Vietnam"
+SCATTER_COUNTRY = "Viet Nam"
+SCATTER_YEAR = 2010
+GEO_YEAR = 2015
+
+
+def timed(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    return times
+
+
+def stage_benchmarks(data_dir, snapshot_dir, repeat):
+    from country_index import CountryIndex
+    from indicators import load_cube
+    from preprocess import build_datasets
+    from snapshot import load_snapshot, save_snapshot, source_hash
+
+    datasets = build_datasets(data_dir)
+    path = os.path.join(snapshot_dir, "bench")
+    save_snapshot(datasets, path)
+    saves = iter(range(repeat + 1))
+
+    return {
+        "stage.source_hash": timed(lambda: source_hash(data_dir), repeat),
+        "stage.load_cube": timed(lambda: load_cube(data_dir), repeat),
+        "stage.build_datasets": timed(lambda: build_datasets(data_dir), repeat),
+        "stage.save_snapshot": timed(
+            lambda: save_snapshot(datasets, os.path.join(snapshot_dir, f"save-{next(saves)}")), repeat
+        ),
+        "stage.load_snapshot": timed(lambda: load_snapshot(path), repeat),
+        "stage.country_index": timed(
+            lambda: CountryIndex(datasets["df_deaths_new_cases"]), repeat
+        ),
+    }
+
+
+def render_benchmarks(repeat, width, height):
+    import pandas as pd
+    import plotly.io as pio
+
+    import app
+    from figures import choropleth_figure, gender_scatter_figure, line_figure
+    from geo_payloads import payload_for
+    from geometry import geometry_url
+    from plot_cache import render_png
+    from scatter_frames import compose_frame, render_base_frame
+
+    data = app.store.snapshot
+    years, values = data.backend.country_series(COUNTRY, 1990, 2021)
+
+    def line(metric, color, ylabel):
+        build = partial(line_figure, years, values[metric], color=color, ylabel=ylabel)
+        return lambda: render_png(build, width, height, 1)
+
+    _, male, female = app.scatter_frames.points[SCATTER_YEAR]
+    point = app.scatter_frames.highlight_point(SCATTER_YEAR, SCATTER_COUNTRY)
+    frame = render_base_frame(SCATTER_YEAR, male, female, width, height, 1)
+
+    payloads = data.geo_payloads["adult"]
+
+    def geo_figure():
+        payload = payload_for(payloads, GEO_YEAR)
+        df_year = pd.DataFrame({
+            "Code": payload["locations"], "Adult": payload["z"], "Country": payload["hovertext"],
+        })
+        fig = choropleth_figure(
+            df_year, "Adult", f"Adult Newly Infected - {GEO_YEAR}", "Adult Newly Infected",
+            geometry_url(),
+        )
+        return pio.to_json(fig)
+
+    def geo_patch():
+        payload = payload_for(payloads, GEO_YEAR)
+        return json.dumps({key: payload[key].tolist() for key in ("locations", "z", "hovertext")})
+
+    return {
+        "render.summary_cards": timed(
+            lambda: str(app.summary_cards_ui(data.backend.latest(COUNTRY))), repeat
+        ),
+        "render.new_cases_line": timed(line("New Cases", "#dc3545", "New Cases"), repeat),
+        "render.deaths_line": timed(line("Deaths", "#6c757d", "Deaths"), repeat),
+        "render.art_coverage_line": timed(line("ART", "#28a745", "ART (%)"), repeat),
+        "render.gender_scatter.full": timed(lambda: render_png(
+            partial(gender_scatter_figure, SCATTER_YEAR, male, female, SCATTER_COUNTRY, point),
+            width, height, 1,
+        ), repeat),
+        "render.gender_scatter.base_frame": timed(
+            lambda: render_base_frame(SCATTER_YEAR, male, female, width, height, 1), repeat
+        ),
+        "render.gender_scatter.composed": timed(
+            lambda: compose_frame(frame, SCATTER_COUNTRY, point), repeat
+        ),
+        "render.geo_map.figure": timed(geo_figure, repeat),
+        "render.geo_map.patch": timed(geo_patch, repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--stage-repeat", type=int, default=5)
+    parser.add_argument("--width", type=int, default=600)
+    parser.add_argument("--height", type=int, default=400)
+    parser.add_argument("--json", default=None, help="write results to this file ('-' for stdout)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = "data"
+        if args.scale > 1:
+            data_dir = scale_data("data", os.path.join(tmp, "data"), args.scale)
+        # Before anything imports snapshot.py or app.py
+        os.environ["HIV_DATA_DIR"] = data_dir
+        os.environ["HIV_SNAPSHOT_DIR"] = os.path.join(tmp, "snapshots")
+
+        timings = stage_benchmarks(data_dir, os.path.join(tmp, "stages"), args.stage_repeat)
+        timings.update(render_benchmarks(args.repeat, args.width, args.height))
+
+    results = {name: summarize(times) for name, times in timings.items()}
+    for name, r in results.items():
+        print(f"{name:<36} median {r['median_ms']:9.2f} ms   p90 {r['p90_ms']:9.2f} ms")
+    if args.json:
+        config = {key: getattr(args, key) for key in ("scale", "repeat", "stage_repeat", "width", "height")}
+        write_results(args.json, "micro", config, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Machine-readable benchmark results.
+
+Every run is written as one JSON document:
+
+    {"benchmark": "micro" | "load", "meta": {...}, "config": {...}, "results": {...}}
+
+`meta` identifies the code and machine (git commit, Python, CPU count,
+HIV_* settings) so runs can be compared across commits.
+"""
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+from .shiny_session import ROOT, percentile
+
+
+def summarize(seconds):
+    """Millisecond summary of a list of timings in seconds."""
+    return {
+        "n": len(seconds),
+        "min_ms": min(seconds) * 1000,
+        "median_ms": statistics.median(seconds) * 1000,
+        "p90_ms": percentile(seconds, 90) * 1000,
+        "p99_ms": percentile(seconds, 99) * 1000,
+        "max_ms": max(seconds) * 1000,
+    }
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            capture_output=True, text=True, check=True,
+        )
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata():
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "env": {k: v for k, v in sorted(os.environ.items()) if k.startswith("HIV_")},
+    }
+
+
+def write_results(path, benchmark, config, results):
+    document = {"benchmark": benchmark, "meta": metadata(), "config": config, "results": results}
+    if path == "-":
+        json.dump(document, sys.stdout, indent=2)
+        print()
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2)
@@ -0,0 +1,115 @@
+"""Minimal headless Shiny websocket client used by the load benchmarks."""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PLOT_OUTPUTS = ["new_cases_line", "deaths_line", "art_coverage_line", "gender_scatter"]
+
+
+def default_inputs(width=600, height=400):
+    inputs = {
+        "country": "Vietnam",
+        "new_cases_years": [1990, 2021],
+        "deaths_years": [1990, 2021],
+        "art_years": [1990, 2021],
+        "year": 1990,
+        "country_scatter": "Viet Nam",
+        "year_slider": 2023,
+        ".clientdata_pixelratio": 1,
+        ".clientdata_allowDataUriScheme": True,
+    }
+    for name in PLOT_OUTPUTS + ["summary_cards", "geo_map"]:
+        inputs[f".clientdata_output_{name}_width"] = width
+        inputs[f".clientdata_output_{name}_height"] = height
+        inputs[f".clientdata_output_{name}_hidden"] = False
+    return inputs
+
+
+class ShinySession:
+    """One simulated browser session.
+
+    `update()` sends input values and waits until every output named in
+    `wait_for` has received a new value, returning each output's latency.
+    "custom:<type>" in `wait_for` waits for a custom message of that type
+    instead (e.g. the geo map's widget updates).
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.bytes_received = 0
+        self.values_received = 0
+        self.last_received = None
+        self.errors = {}
+        self._ws = None
+        self._reader = None
+        self._waiters = {}
+
+    async def connect(self, inputs=None, wait_for=()):
+        import websockets
+
+        self._ws = await websockets.connect(self.url, max_size=None)
+        self._reader = asyncio.create_task(self._read())
+        return await self._send("init", inputs or default_inputs(), wait_for)
+
+    async def update(self, inputs, wait_for=(), timeout=60):
+        return await self._send("update", inputs, wait_for, timeout)
+
+    async def _send(self, method, inputs, wait_for, timeout=60):
+        start = time.perf_counter()
+        waiters = {name: asyncio.get_running_loop().create_future() for name in wait_for}
+        self._waiters.update(waiters)
+        await self._ws.send(json.dumps({"method": method, "data": inputs}))
+        latencies = {}
+        for name, waiter in waiters.items():
+            latencies[name] = await asyncio.wait_for(waiter, timeout) - start
+        return latencies
+
+    async def _read(self):
+        async for message in self._ws:
+            now = time.perf_counter()
+            self.last_received = now
+            self.bytes_received += len(message)
+            data = json.loads(message)
+            self.errors.update(data.get("errors", {}))
+            self.values_received += len(data.get("values", {}))
+            names = list(data.get("values", {})) + list(data.get("errors", {}))
+            names += [f"custom:{kind}" for kind in data.get("custom", {})]
+            for name in names:
+                waiter = self._waiters.pop(name, None)
+                if waiter is not None and not waiter.done():
+                    waiter.set_result(now)
+
+    async def close(self):
+        await self._ws.close()
+        self._reader.cancel()
+
+
+def start_server(port, env=None, app="app:app"):
+    """Start the dashboard under uvicorn and wait until it accepts requests."""
+    import urllib.request
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env={**os.environ, **(env or {})},
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1)
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("server did not start")
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
@@ -0,0 +1,137 @@
+"""Soak test of the matplotlib render path: memory must reach a steady state.
+
+Drives tens of thousands of renders through the builders the server uses,
+on render threads like the render pool's: the three line charts for random
+countries and year ranges, the gender scatter drawn in full, and animation
+playback composed over pre-rendered base frames. Resident memory and the
+number of objects tracked by the garbage collector are sampled as it goes.
+After the warm-up (the first fifth of the renders), the peak RSS of the
+second half of the rest may exceed that of the first half by at most
+--tolerance-mb, or the script exits with status 1. Run from the repository root:
+
+    python benchmarks/soak_figures.py [--renders 30000] [--workers 4]
+
+HIV_FIGURE_TEMPLATE_RENDERS=1 soaks the path that builds a new figure for
+every render instead of reusing the figure templates.
+"""
+import argparse
+import gc
+import os
+import random
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from figure_templates import FIGURE_TEMPLATE_RENDERS, template_stats  # noqa: E402
+from figures import gender_scatter_figure, line_figure  # noqa: E402
+from plot_cache import render_png  # noqa: E402
+from scatter_frames import compose_frame, render_base_frame, year_points  # noqa: E402
+
+LINES = [("New Cases", "#dc3545", "New Cases"), ("Deaths", "#6c757d", "Deaths"), ("ART", "#28a745", "ART (%)")]
+SIZES = [(600, 400), (500, 400)]
+
+
+def rss_mib():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        # Peak rather than current RSS where /proc isn't available
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+def render_jobs(data, rng):
+    """An endless mix of line chart, full scatter and composed frame renders."""
+    countries = list(data["countries"])
+    points = year_points(data["cube"])
+    years = list(points)
+    # Base frames for a few years, as the frame pool would have them
+    frames = {
+        (year, size): render_base_frame(year, *points[year][1:], *size, 1)
+        for year in years[::6] for size in SIZES
+    }
+    frame_keys = list(frames)
+
+    def highlight(year):
+        countries_year, male, female = points[year]
+        i = rng.randrange(len(countries_year))
+        return countries_year[i], (male[i], female[i])
+
+    while True:
+        kind = rng.random()
+        size = rng.choice(SIZES)
+        if kind < 0.5:
+            start = rng.randint(1990, 2015)
+            metric, color, ylabel = rng.choice(LINES)
+            series_years, values = data.backend.country_series(
+                rng.choice(countries), start, rng.randint(start, 2021), [metric]
+            )
+            build = partial(line_figure, series_years, values[metric], color=color, ylabel=ylabel)
+            yield "line", partial(render_png, build, *size, 1)
+        elif kind < 0.7:
+            year = rng.choice(years)
+            name, point = highlight(year)
+            build = partial(gender_scatter_figure, year, *points[year][1:], name, point)
+            yield "scatter", partial(render_png, build, *size, 1)
+        else:
+            year, size = rng.choice(frame_keys)
+            name, point = highlight(year)
+            yield "composed", partial(compose_frame, frames[year, size], name, point)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--renders", type=int, default=30000)
+    parser.add_argument("--workers", type=int, default=4, help="render threads")
+    parser.add_argument("--samples", type=int, default=40, help="memory samples over the run")
+    parser.add_argument("--tolerance-mb", type=float, default=8.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import app
+
+    jobs = render_jobs(app.store.snapshot, random.Random(args.seed))
+    every = max(1, args.renders // args.samples)
+    samples, counts = [], {}
+    lock = threading.Lock()
+
+    def run(kind, job):
+        job()
+        with lock:
+            counts[kind] = counts.get(kind, 0) + 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.workers, thread_name_prefix="render") as pool:
+        for done in range(0, args.renders, every):
+            batch = [pool.submit(run, *next(jobs)) for _ in range(min(every, args.renders - done))]
+            for future in batch:
+                future.result()
+            samples.append((done + len(batch), rss_mib(), len(gc.get_objects())))
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.renders} renders in {elapsed:.0f} s ({args.renders / elapsed:.0f}/s), "
+          f"{args.workers} threads, template reuse {FIGURE_TEMPLATE_RENDERS}: "
+          + ", ".join(f"{kind} {n}" for kind, n in sorted(counts.items())))
+    print(f"templates: {template_stats()}")
+    for renders, rss, objects in samples[::max(1, len(samples) // 10)] + samples[-1:]:
+        print(f"  {renders:7d} renders  {rss:8.1f} MiB RSS  {objects:9d} gc objects")
+
+    # Peak RSS of the second half of the run after the warm-up vs. the first
+    warm = [sample for sample in samples if sample[0] > args.renders / 5]
+    first, last = warm[:len(warm) // 2], warm[len(warm) // 2:]
+    growth = max(rss for _, rss, _ in last) - max(rss for _, rss, _ in first)
+    objects = last[-1][2] - first[0][2]
+    print(f"after warm-up: RSS {growth:+.1f} MiB, gc objects {objects:+d}")
+    if growth > args.tolerance_mb:
+        print(f"FAIL: RSS still growing ({growth:.1f} MiB > {args.tolerance_mb} MiB)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
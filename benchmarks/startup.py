@@ -0,0 +1,164 @@
+"""Cold start: an -X importtime report and a time-to-first-byte budget check.
+
+For each start mode (fast: HIV_FAST_START=1, eager: the default), the
+report imports app.py under `python -X importtime` and lists the slowest
+modules by cumulative import time, plus the import time of the heavy
+libraries that a fast start defers (pandas, matplotlib, plotly,
+shinywidgets). The wall time of the whole import is measured separately,
+since it also covers opening the dataset snapshot.
+
+The budget check then starts uvicorn from scratch --repeat times per mode
+and measures the time from spawning the process to the first byte of
+`GET /`, and to a first session with every output rendered. The snapshot
+is built once beforehand, as a deployment would ship it. The script exits
+with status 1 when the median time to first byte of the fast start is over
+budget (1000 ms by default), so it can gate CI:
+
+    python -m benchmarks.startup [--budget-ms 1000] [--json results/startup.json]
+"""
+import argparse
+import asyncio
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from .results import summarize, write_results
+from .shiny_session import ROOT, ShinySession
+from .synthetic_data import scale_data
+
+MODES = {"fast": {"HIV_FAST_START": "1"}, "eager": {"HIV_FAST_START": "0"}}
+DEFERRED = ["pandas", "matplotlib", "plotly", "shinywidgets"]
+OUTPUTS = ["summary_cards", "new_cases_line", "deaths_line", "art_coverage_line", "gender_scatter", "geo_map"]
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_report(env, top):
+    """Per-module import times of `import app`, as -X importtime reports them."""
+    code = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, env={**os.environ, **env}, capture_output=True, text=True, check=True,
+    )
+    modules = []
+    for line in out.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules.append({
+                "module": name,
+                "depth": len(indent) // 2,
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+            })
+    # A package's cost is its cumulative time where it was first imported
+    first = {}
+    for entry in modules:
+        first.setdefault(entry["module"], entry["cumulative_ms"])
+    return {
+        "import_app_ms": float(out.stdout.strip().splitlines()[-1]) * 1000,
+        "slowest": sorted(modules, key=lambda m: -m["cumulative_ms"])[:top],
+        "deferred": {name: first.get(name) for name in DEFERRED},
+    }
+
+
+def time_to_first_byte(port, env):
+    """(seconds to the first byte of GET /, seconds to a fully rendered session)."""
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env={**os.environ, **env},
+    )
+    try:
+        deadline = started + 60
+        while True:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=5) as response:
+                    response.read(1)
+                    ttfb = time.perf_counter() - started
+                    break
+            except OSError:
+                if time.perf_counter() > deadline:
+                    raise RuntimeError("server did not start")
+                time.sleep(0.01)
+
+        async def first_session():
+            session = ShinySession(f"ws://127.0.0.1:{port}/websocket/")
+            await session.connect(wait_for=OUTPUTS)
+            await session.close()
+
+        asyncio.run(first_session())
+        return ttfb, time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--repeat", type=int, default=5, help="server starts per mode")
+    parser.add_argument("--top", type=int, default=15, help="modules listed in the import report")
+    parser.add_argument("--budget-ms", type=float, default=1000,
+                        help="fail if the fast start's median time to first byte is over this (0: no check)")
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8798)
+    parser.add_argument("--json", default=None, help="write results to this file ('-' for stdout)")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {"HIV_SNAPSHOT_DIR": os.path.join(tmp, "snapshots"), "HIV_WATCH_DATA": "0"}
+        data_dir = "data"
+        if args.scale > 1:
+            data_dir = scale_data("data", os.path.join(tmp, "data"), args.scale)
+            env["HIV_DATA_DIR"] = data_dir
+        # Publish the snapshot first: a cold start of a deployed worker finds it
+        subprocess.run(
+            [sys.executable, "-c", f"from snapshot import open_datasets; open_datasets({data_dir!r})"],
+            cwd=ROOT, env={**os.environ, **env}, check=True,
+        )
+
+        for mode in args.modes:
+            mode_env = {**env, **MODES[mode]}
+            report = import_report(mode_env, args.top)
+            print(f"{mode} start: import app {report['import_app_ms']:.0f} ms")
+            for entry in report["slowest"]:
+                print(f"    {entry['cumulative_ms']:8.1f} ms  {'  ' * entry['depth']}{entry['module']}")
+            loaded = ", ".join(
+                f"{name} {ms:.0f} ms" for name, ms in report["deferred"].items() if ms is not None
+            )
+            print(f"    heavy libraries imported with app: {loaded or 'none'}")
+
+            ttfb, rendered = [], []
+            for _ in range(args.repeat):
+                first_byte, first_render = time_to_first_byte(args.port, mode_env)
+                ttfb.append(first_byte)
+                rendered.append(first_render)
+            report["ttfb"] = summarize(ttfb)
+            report["first_render"] = summarize(rendered)
+            print(f"    time to first byte   median {report['ttfb']['median_ms']:7.0f} ms"
+                  f"   max {report['ttfb']['max_ms']:7.0f} ms")
+            print(f"    time to first render median {report['first_render']['median_ms']:7.0f} ms"
+                  f"   max {report['first_render']['max_ms']:7.0f} ms")
+            results[mode] = report
+
+    if args.json:
+        config = {key: getattr(args, key) for key in ("modes", "repeat", "budget_ms", "scale")}
+        write_results(args.json, "startup", config, results)
+
+    if args.budget_ms and "fast" in results:
+        median = results["fast"]["ttfb"]["median_ms"]
+        if median > args.budget_ms:
+            print(f"FAIL: fast start time to first byte {median:.0f} ms is over the "
+                  f"{args.budget_ms:.0f} ms budget")
+            sys.exit(1)
+        print(f"OK: fast start time to first byte {median:.0f} ms is within the "
+              f"{args.budget_ms:.0f} ms budget")
+
+
+if __name__ == "__main__":
+    main()
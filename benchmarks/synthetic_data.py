@@ -0,0 +1,57 @@
+"""Synthetic data: every CSV in data/ scaled up by repeating its countries.
+
+Copy 0 is the original data; copy i renames every country to "<name> i"
+(code "<code>i") and scales its values by a random factor, so the years,
+the gaps and the file layouts match the real files. Usage:
+
+    python -m benchmarks.synthetic_data --scale 100 --out /tmp/data-100x
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def _country_columns(df):
+    # Our World in Data files use Entity/Code, World Bank files Country Name/Code
+    if "Entity" in df:
+        return "Entity", "Code", [col for col in df.columns if col not in ("Entity", "Code", "Year")]
+    if "Region" in df:
+        # The country groups table: the copies keep their country's groups
+        return "Country", "Code", []
+    return "Country Name", "Country Code", [col for col in df.columns if col.isnumeric()]
+
+
+def scale_data(data_dir, out_dir, scale, seed=0):
+    """Write a copy of every CSV in data_dir with each country repeated `scale` times."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    for name in sorted(os.listdir(data_dir)):
+        if not name.endswith(".csv"):
+            continue
+        df = pd.read_csv(os.path.join(data_dir, name))
+        name_col, code_col, value_cols = _country_columns(df)
+        path = os.path.join(out_dir, name)
+        df.to_csv(path, index=False)
+        for i in range(1, scale):
+            copy = df.copy()
+            copy[name_col] = copy[name_col] + f" {i}"
+            copy[code_col] = copy[code_col] + f"{i}"
+            copy[value_cols] = copy[value_cols] * rng.uniform(0.8, 1.2)
+            copy.to_csv(path, mode="a", header=False, index=False)
+    return out_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=int, required=True)
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    scale_data(args.data_dir, args.out, args.scale, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import json
+import math
+import os
+
+import numpy as np
+from htmltools import HTMLDependency, tags
+from shiny.render.renderer import Renderer
+
+###############################################################################
+# Client-side charts
+#
+# HIV_CHART_MODE=client draws the line charts and the gender scatter in the
+# browser (www/client_charts.js: plain SVG with hover and drag-to-zoom)
+# instead of sending matplotlib images. The server only sends the data: the
+# selected country's whole series for a line chart, and the male / female
+# prevalences with the country names for one scatter year. The year range
+# sliders and the highlighted country are applied in the browser, so moving
+# them never reaches the server. The default, HIV_CHART_MODE=png, keeps the
+# cached PNG charts (see plot_cache.py).
+
+CHART_MODE = os.environ.get("HIV_CHART_MODE", "png")
+WWW_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "www")
+
+client_charts_dependency = HTMLDependency(
+    "hiv-client-charts",
+    "1.0.0",
+    source={"subdir": WWW_DIR},
+    script={"src": "client_charts.js"},
+    all_files=False,
+)
+
+
+def output_chart(id, kind, **options):
+    """Container of a client-side chart ("line" or "scatter").
+
+    `options` go to the browser once, with the page: axis labels, color and
+    the ids of the inputs the chart applies itself (`range_input`, the year
+    range slider of a line chart, and `highlight_input`, the highlighted
+    country of the scatter).
+    """
+    return tags.div(
+        client_charts_dependency,
+        id=id,
+        class_="hiv-client-chart",
+        data_kind=kind,
+        data_options=json.dumps(options),
+        style="width: 100%; height: 400px;",
+    )
+
+
+def _values(values, digits):
+    # JSON has no NaN: missing values are sent as null
+    return [
+        None if math.isnan(v) else (int(v) if v.is_integer() else round(v, digits))
+        for v in np.asarray(values, dtype=float).tolist()
+    ]
+
+
+def line_payload(years, values, digits=2):
+    """{"x": years, "y": values} of one country's series."""
+    return {"x": np.asarray(years).tolist(), "y": _values(values, digits)}
+
+
+def scatter_payload(year, countries, male, female, digits=3):
+    """{"year", "labels", "x", "y"} of the gender scatter in one year."""
+    return {
+        "year": int(year),
+        "labels": list(countries),
+        "x": _values(male, digits),
+        "y": _values(female, digits),
+    }
+
+
+class render_chart(Renderer[dict]):
+    """Render the data of a client-side chart (see output_chart)."""
+
+    def auto_output_ui(self):
+        return output_chart(self.output_id, "line")
+
+    async def transform(self, value):
+        return value
@@ -0,0 +1,143 @@
+import asyncio
+import os
+
+from shiny import reactive
+from shiny.session import require_active_session
+
+from instrumentation import record_input
+
+###############################################################################
+# Input coalescing
+#
+# A slider sends a value for every position it passes while it's dragged
+# (or animated), and each value re-renders the outputs that read it, only
+# for the result to be replaced by the next one. coalesced(input, name) is a
+# stand-in for input[name] that passes values on at the pace set for it:
+#
+#   debounce:<ms>  once the input has been still for <ms>
+#   throttle:<ms>  at most one value every <ms> while it keeps changing
+#
+# Either way the last value is always passed on; values replaced before
+# that are dropped and counted as "coalesced" on /metrics. Outputs rendered
+# in the render pool also hold a new render back while their previous one
+# is still running, and then render the latest inputs (see cached_plot).
+#
+# HIV_INPUT_COALESCE changes the settings per input, e.g.
+# "year=throttle:100,art_years=debounce:250,year_slider=off"; "off" alone
+# passes every value on as it arrives and renders every one of them.
+
+INPUT_COALESCE_DEFAULTS = {
+    # Line charts: only the range the drag stops at matters
+    "new_cases_years": ("debounce", 150),
+    "deaths_years": ("debounce", 150),
+    "art_years": ("debounce", 150),
+    # The scatter and the map follow the slider; the scatter's animation
+    # steps (500 ms) are slower than the throttle and all pass through
+    "year": ("throttle", 100),
+    "year_slider": ("throttle", 150),
+}
+
+
+def parse_coalesce(spec, defaults=INPUT_COALESCE_DEFAULTS):
+    """{input: (mode, ms)} from a HIV_INPUT_COALESCE value."""
+    if spec.strip() == "off":
+        return {}
+    settings = dict(defaults)
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, setting = item.partition("=")
+        mode, _, ms = setting.partition(":")
+        if mode == "off":
+            settings.pop(name, None)
+        elif mode in ("debounce", "throttle"):
+            settings[name] = (mode, float(ms))
+        else:
+            raise ValueError(f"Unknown coalesce setting for {name!r}: {setting!r}")
+    return settings
+
+
+COALESCE_ENABLED = os.environ.get("HIV_INPUT_COALESCE", "").strip() != "off"
+INPUT_COALESCE = parse_coalesce(os.environ.get("HIV_INPUT_COALESCE", ""))
+
+_NO_VALUE = object()
+
+
+class Coalesced:
+    """Reads like input[name]() but only sees the values `mode` lets through.
+
+    Created in a session's server function. The first value is passed on
+    right away, so outputs don't wait for the initial render.
+    """
+
+    def __init__(self, input, name, mode, ms):
+        if mode not in ("debounce", "throttle"):
+            raise ValueError(f"Unknown coalesce mode: {mode!r}")
+        self.name = name
+        self.mode = mode
+        self.delay = ms / 1000
+        self._source = input[name]
+        self._value = reactive.value()
+        self._pending = _NO_VALUE
+        self._applied = None
+        self._timer = None
+        self._flush_task = None
+        # Before the outputs, so they find a value in the first flush
+        self._effect = reactive.effect(priority=1)(self._watch)
+        require_active_session(None).on_ended(self._cancel)
+
+    def __call__(self):
+        return self._value()
+
+    def _watch(self):
+        value = self._source()
+        if self._applied is None:
+            self._apply(value)
+            return
+        if self._pending is not _NO_VALUE:
+            record_input(self.name, "coalesced")
+        self._pending = value
+        if self.mode == "debounce":
+            self._schedule(self.delay)
+        elif self._timer is None:
+            wait = self._applied + self.delay - asyncio.get_running_loop().time()
+            if wait > 0:
+                self._schedule(wait)
+            else:
+                self._apply_pending()
+
+    def _schedule(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(delay, self._fire)
+
+    def _fire(self):
+        self._timer = None
+        self._flush_task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        async with reactive.lock():
+            self._apply_pending()
+            await reactive.flush()
+
+    def _apply_pending(self):
+        if self._pending is _NO_VALUE:
+            return
+        value, self._pending = self._pending, _NO_VALUE
+        self._apply(value)
+
+    def _apply(self, value):
+        self._applied = asyncio.get_running_loop().time()
+        record_input(self.name, "applied")
+        self._value.set(value)
+
+    def _cancel(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+def coalesced(input, name, settings=INPUT_COALESCE):
+    """input[name], coalesced as `settings` says (unchanged for inputs not in it)."""
+    setting = settings.get(name)
+    if setting is None:
+        return input[name]
+    return Coalesced(input, name, *setting)
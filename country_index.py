@@ -0,0 +1,88 @@
+import numpy as np
+
+###############################################################################
+# Per-country index for the deaths / new cases / ART panel
+#
+# The panel frame is sorted once by (Country, Year) and its columns are kept
+# as contiguous NumPy arrays. Every country then owns a [start, stop) range of
+# the sorted category codes, found with np.searchsorted, and every slice
+# below is a view, not a copy. Year ranges are resolved the same way on the
+# sorted Year views. The only thing stored per country is its latest-year
+# record, which the summary cards read on every country switch, so a worker
+# attached to a shared snapshot holds little more than the lookup table.
+
+METRICS = ["New Cases", "Deaths", "ART"]
+
+
+def latest_record(years, values, i):
+    """Row `i` of year-sorted series as a {"Year", metric...} dict."""
+    record = {"Year": int(years[i])}
+    for metric in METRICS:
+        record[metric] = values[metric][i]
+    return record
+
+
+class CountrySeries:
+    """Year-sorted views of one country's New Cases, Deaths and ART."""
+
+    def __init__(self, country, years, values, latest=None):
+        self.country = country
+        self.years = years
+        self.values = values
+        self._latest = latest
+
+    def __len__(self):
+        return len(self.years)
+
+    def latest(self):
+        """The most recent year as a dict, or None when there is no data."""
+        return self._latest
+
+    def between(self, start_year, end_year):
+        """(years, values) views for start_year <= Year <= end_year."""
+        lo = np.searchsorted(self.years, start_year, side="left")
+        hi = np.searchsorted(self.years, end_year, side="right")
+        return self.years[lo:hi], {m: v[lo:hi] for m, v in self.values.items()}
+
+
+class CountryIndex:
+    def __init__(self, df):
+        import pandas as pd
+
+        country = pd.Categorical(df["Country"])
+        if not country.categories.is_monotonic_increasing:
+            country = country.reorder_categories(country.categories.sort_values())
+        codes = country.codes
+        # Snapshot frames are usually stored in this order already; skipping
+        # the sort keeps the columns as views over the shared snapshot.
+        order = np.lexsort((df["Year"].to_numpy(), codes))
+        if not (order == np.arange(len(order))).all():
+            df = df.take(order)
+            codes = codes[order]
+        self.categories = country.categories
+        self.codes = codes
+        self.years = np.ascontiguousarray(df["Year"].to_numpy())
+        self.values = {m: np.ascontiguousarray(df[m].to_numpy()) for m in METRICS}
+        # The last row of each country's run is its latest year
+        last = np.flatnonzero(np.r_[codes[1:] != codes[:-1], True]) if len(codes) else []
+        self._latest = {int(codes[i]): latest_record(self.years, self.values, i) for i in last}
+        self._empty = CountrySeries(None, self.years[:0], {m: v[:0] for m, v in self.values.items()})
+
+    def __contains__(self, country):
+        return country in self.categories
+
+    def get(self, country):
+        """CountrySeries for `country` (empty if the country is unknown)."""
+        try:
+            code = self.categories.get_loc(country)
+        except KeyError:
+            return self._empty
+        # Each country owns the [lo, hi) run of its code in the sorted codes
+        lo = np.searchsorted(self.codes, code, side="left")
+        hi = np.searchsorted(self.codes, code, side="right")
+        if lo == hi:
+            return self._empty
+        return CountrySeries(
+            country, self.years[lo:hi], {m: v[lo:hi] for m, v in self.values.items()},
+            self._latest[code],
+        )
@@ -0,0 +1,267 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import PlainTextResponse, Response
+from starlette.routing import Route
+
+from metrics import registry
+from plot_cache import PlotCache
+
+###############################################################################
+# Read-only data API
+#
+# The cleaned series behind the dashboard, served next to it (see app.py):
+#
+#   /api/datasets          the datasets, their indicators, countries and years
+#   /api/datasets/<name>   one dataset's rows, filtered by ?country= (or
+#                          ?code=, ISO3), ?start= / ?end= years and
+#                          ?indicator=, as columnar JSON or, with
+#                          ?format=arrow (or Accept: the Arrow stream type),
+#                          as an Arrow IPC stream
+#
+# Every response has a strong ETag made of the data snapshot version and
+# the normalized query, so a poll with If-None-Match is answered 304 before
+# any data is touched. Responses are revalidated (no-cache) unless the
+# request pins the snapshot with ?version=, which makes them immutable.
+# Encoded bodies are kept in an LRU bounded by HIV_API_CACHE_MB.
+#
+# Arrow needs pyarrow (in requirements.txt); an install without it answers
+# Arrow requests with 406 rather than failing to start. The Arrow stream
+# keeps the float32 columns and the country names as dictionary columns, so
+# readers map the buffers as is.
+
+DATA_API = os.environ.get("HIV_DATA_API", "1") != "0"
+API_CACHE_MB = float(os.environ.get("HIV_API_CACHE_MB", "16"))
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "public, no-cache"
+# Decimals kept in JSON, about the precision of the float32 columns
+JSON_DECIMALS = 6
+
+# API name -> (dataset, indicator columns)
+API_DATASETS = {
+    "deaths_new_cases": ("df_deaths_new_cases", ["Deaths", "New Cases", "ART", "PLHIV"]),
+    "prevalence_male": ("df_prevalence_male_reshaped", ["Prevalence_male"]),
+    "prevalence_female": ("df_prevalence_female_reshaped", ["Prevalence_female"]),
+    "children_newly_infected": ("df_children_newly_infected_reshaped", ["Children"]),
+    "adult_newly_infected": ("df_adult_newly_infected_reshaped", ["Adult"]),
+}
+KEY_COLUMNS = ["Country", "Code", "Year"]
+
+response_cache = PlotCache(int(API_CACHE_MB * 1024 * 1024))
+api_requests_total = registry.counter(
+    "hiv_api_requests_total", "Data API requests by dataset and status.", ["dataset", "status"])
+
+
+class QueryError(ValueError):
+    pass
+
+
+def _arrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def _year(params, name):
+    value = params.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise QueryError(f"{name} must be a year, not {value!r}") from None
+
+
+def parse_query(name, request):
+    """The normalized query of a dataset request; raises QueryError."""
+    params = request.query_params
+    indicators = params.getlist("indicator") or API_DATASETS[name][1]
+    unknown = [indicator for indicator in indicators if indicator not in API_DATASETS[name][1]]
+    if unknown:
+        raise QueryError(f"Unknown indicators for {name}: {', '.join(unknown)}")
+
+    fmt = params.get("format")
+    if fmt is None:
+        fmt = "arrow" if ARROW_STREAM in request.headers.get("accept", "") else "json"
+    if fmt not in ("json", "arrow"):
+        raise QueryError(f"format must be json or arrow, not {fmt!r}")
+
+    codes = [code.upper() for value in params.getlist("code") for code in value.split(",") if code]
+    return {
+        "dataset": name,
+        "countries": sorted(set(params.getlist("country"))),
+        "codes": sorted(set(codes)),
+        "start": _year(params, "start"),
+        "end": _year(params, "end"),
+        # In the dataset's order, so equivalent queries share an ETag
+        "indicators": [column for column in API_DATASETS[name][1] if column in indicators],
+        "format": fmt,
+    }
+
+
+def etag(version, query):
+    digest = hashlib.sha256(json.dumps(query, sort_keys=True).encode()).hexdigest()
+    return f'"{version}-{digest[:16]}"'
+
+
+def not_modified(request, tag):
+    """Whether If-None-Match matches `tag` (weak comparison, as for GET)."""
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    tags = [value.strip().removeprefix("W/") for value in header.split(",")]
+    return "*" in tags or tag in tags
+
+
+def select_rows(frame, query):
+    """The rows and columns of `frame` the query asks for."""
+    mask = np.ones(len(frame), dtype=bool)
+    if query["countries"]:
+        # unique() rather than .cat: HIV_COMPACT_INGEST=0 keeps object columns
+        known = set(frame["Country"].unique())
+        unknown = [country for country in query["countries"] if country not in known]
+        if unknown:
+            raise QueryError(f"Unknown countries: {', '.join(unknown)}")
+        mask &= frame["Country"].isin(query["countries"]).to_numpy()
+    if query["codes"]:
+        mask &= frame["Code"].isin(query["codes"]).to_numpy()
+    years = frame["Year"].to_numpy()
+    if query["start"] is not None:
+        mask &= years >= query["start"]
+    if query["end"] is not None:
+        mask &= years <= query["end"]
+    columns = KEY_COLUMNS + query["indicators"]
+    return frame.loc[mask, columns] if not mask.all() else frame[columns]
+
+
+def _json_column(series):
+    if isinstance(series.dtype, np.dtype) and series.dtype.kind == "f":
+        values = np.round(series.to_numpy(dtype=np.float64), JSON_DECIMALS)
+        # JSON has no NaN: missing values are sent as null
+        return np.where(np.isnan(values), None, values).tolist()
+    if series.dtype == "category":
+        return series.astype(str).tolist()
+    return series.tolist()
+
+
+def encode_json(rows, query, version):
+    return json.dumps({
+        "dataset": query["dataset"],
+        "version": version,
+        "rows": len(rows),
+        "columns": {column: _json_column(rows[column]) for column in rows.columns},
+    }, separators=(",", ":")).encode()
+
+
+def encode_arrow(rows, pa):
+    table = pa.Table.from_pandas(rows, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def dataset_index(snapshot):
+    datasets = {}
+    for name, (dataset, indicators) in API_DATASETS.items():
+        frame = snapshot[dataset]
+        years = frame["Year"].to_numpy()
+        datasets[name] = {
+            "indicators": indicators,
+            "rows": len(frame),
+            "years": [int(years.min()), int(years.max())] if len(years) else None,
+            "countries": sorted(map(str, frame["Country"].unique())),
+        }
+    return {"version": snapshot.version, "datasets": datasets}
+
+
+def data_routes(store):
+    def headers(tag, pinned):
+        return {"ETag": tag, "Cache-Control": IMMUTABLE if pinned else REVALIDATE}
+
+    def check_version(request, snapshot):
+        pinned = request.query_params.get("version")
+        if pinned is not None and pinned != snapshot.version:
+            raise QueryError(
+                f"Snapshot {pinned} is no longer served; the current one is {snapshot.version}"
+            )
+        return pinned is not None
+
+    async def index(request):
+        snapshot = store.snapshot
+        try:
+            pinned = check_version(request, snapshot)
+        except QueryError as e:
+            return PlainTextResponse(str(e), status_code=404)
+        tag = etag(snapshot.version, {"index": True})
+        if not_modified(request, tag):
+            return Response(status_code=304, headers=headers(tag, pinned))
+        body = response_cache.get((snapshot.version, "index"))
+        if body is None:
+            body = json.dumps(dataset_index(snapshot), separators=(",", ":")).encode()
+            response_cache.put((snapshot.version, "index"), body)
+        return Response(body, media_type="application/json", headers=headers(tag, pinned))
+
+    async def dataset(request):
+        name = request.path_params["name"]
+        if name not in API_DATASETS:
+            return PlainTextResponse(f"Unknown dataset: {name}", status_code=404)
+        response = await _dataset(request, name)
+        api_requests_total.inc(dataset=name, status=str(response.status_code))
+        return response
+
+    async def _dataset(request, name):
+        # One snapshot for the whole request, even if the data is reloaded
+        snapshot = store.snapshot
+        try:
+            pinned = check_version(request, snapshot)
+        except QueryError as e:
+            return PlainTextResponse(str(e), status_code=404)
+        try:
+            query = parse_query(name, request)
+        except QueryError as e:
+            return PlainTextResponse(str(e), status_code=400)
+
+        tag = etag(snapshot.version, query)
+        response_headers = headers(tag, pinned)
+        if request.query_params.get("format") is None:
+            response_headers["Vary"] = "Accept"
+        if not_modified(request, tag):
+            return Response(status_code=304, headers=response_headers)
+
+        pa = None
+        if query["format"] == "arrow":
+            pa = _arrow()
+            if pa is None:
+                return PlainTextResponse("Arrow responses need pyarrow", status_code=406)
+        media_type = ARROW_STREAM if pa is not None else "application/json"
+
+        key = (snapshot.version, tag)
+        body = response_cache.get(key)
+        if body is None:
+            def build():
+                rows = select_rows(snapshot[API_DATASETS[name][0]], query)
+                if pa is not None:
+                    return encode_arrow(rows, pa)
+                return encode_json(rows, query, snapshot.version)
+
+            try:
+                body = await run_in_threadpool(build)
+            except QueryError as e:
+                return PlainTextResponse(str(e), status_code=400)
+            response_cache.put(key, body)
+        return Response(body, media_type=media_type, headers=response_headers)
+
+    if not DATA_API:
+        return []
+    return [
+        Route("/api/datasets", index),
+        Route("/api/datasets/{name}", dataset),
+    ]
@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import os
+import threading
+from contextlib import asynccontextmanager
+from types import MappingProxyType
+
+from shiny import reactive
+
+from backends import make_backend
+from country_index import CountryIndex
+from geo_payloads import year_payloads
+from geometry import mapped_codes
+from preprocess import COMPACT_INGEST, CUBE, FRAMES, LISTS, source_files
+from scatter_frames import year_points
+from snapshot import publish_dir, reload_datasets, source_hash
+
+###############################################################################
+# Live datasets with hot reload
+#
+# The app reads its data through `store.snapshot`, an immutable DataSnapshot
+# of the datasets and the lookups built on them. A watcher on the data
+# directory re-ingests a changed CSV, rebuilds only the frames and lists
+# derived from it (see preprocess.DERIVED), and swaps the new snapshot in
+# with one assignment, so a render never sees half of an update.
+#
+# Each frame and list has a reactive signal. Calcs and outputs declare what
+# they read with `store.use(name, ...)`, and a swap only sets the signals of
+# the rebuilt names: a new prevalence file re-renders the gender scatter in
+# every session, while the line charts and the geo map stay as they are.
+# Plot cache keys include the revision of the data they were drawn from, so
+# stale images are never served and age out of the LRU.
+#
+# Outputs query the snapshot's data backend (see backends.py). The backend
+# and the lookups of each panel (country index, scatter points, geo
+# payloads) are built on first access, behind a thread-safe
+# once-initializer, and the datasets of a snapshot are loaded by name on
+# first access too (see snapshot.SnapshotDatasets), so a fast start only
+# reads the manifest. A reloaded snapshot is built in full in a thread
+# before it is swapped in, so no render after a swap builds them on the
+# event loop.
+#
+# HIV_WATCH_DATA=0 turns the watcher off.
+
+WATCH_DATA = os.environ.get("HIV_WATCH_DATA", "1") != "0"
+
+reload_log = logging.getLogger("hiv_dashboard.reload")
+
+
+class Once:
+    """Thread-safe once-initializer: calls `fn` on first use and keeps its result."""
+
+    def __init__(self, fn):
+        self._fn = fn
+        self._lock = threading.Lock()
+        self._done = False
+        self._value = None
+
+    def __call__(self):
+        if not self._done:
+            with self._lock:
+                if not self._done:
+                    self._value = self._fn()
+                    self._done = True
+                    self._fn = None
+        return self._value
+
+
+class DataSnapshot:
+    """One immutable version of the datasets and the lookups built on them."""
+
+    def __init__(self, datasets, previous=None, changed=()):
+        self.datasets = MappingProxyType(datasets) if isinstance(datasets, dict) else datasets
+        self.version = datasets["version"]
+        # Bumped every time a name is rebuilt; part of the plot cache keys
+        revisions = previous.revisions if previous is not None else {}
+        self.revisions = MappingProxyType({
+            name: revisions.get(name, 0) + (name in changed) for name in (*FRAMES, *LISTS, CUBE)
+        })
+
+        # Country -> year-sorted arrays for the summary cards and the three line charts
+        if previous is None or "df_deaths_new_cases" in changed:
+            self._country_index = Once(lambda: CountryIndex(self.datasets["df_deaths_new_cases"]))
+        else:
+            self._country_index = previous._country_index
+
+        self._backend = Once(lambda: make_backend(self))
+
+        # Year -> choropleth arrays for the geo map, per dataset, filtered
+        # to the codes the map can draw when first used. Recreated with
+        # every backend, like the scatter points.
+        self._geo_payloads = Once(lambda: {
+            "children": year_payloads(self.backend, "children_newly_infected", mapped_codes),
+            "adult": year_payloads(self.backend, "adult_newly_infected", mapped_codes),
+        })
+        # Year -> (countries, male, female) for the gender scatter
+        self._scatter_points = Once(lambda: year_points(self.backend))
+
+    @property
+    def backend(self):
+        return self._backend()
+
+    @property
+    def country_index(self):
+        return self._country_index()
+
+    @property
+    def geo_payloads(self):
+        return self._geo_payloads()
+
+    @property
+    def scatter_points(self):
+        return self._scatter_points()
+
+    def load(self):
+        """Build the backend and every panel's lookups now instead of on first access."""
+        backend = self.backend
+        # Only the pandas backend answers country queries from the index
+        country_index = self.country_index if backend.name == "pandas" else None
+        return backend, country_index, self.geo_payloads, self.scatter_points
+
+    def __getitem__(self, name):
+        return self.datasets[name]
+
+
+class DataStore:
+    """The current DataSnapshot, its per-name change signals and the data directory watcher."""
+
+    def __init__(self, datasets, data_dir="data", compact=COMPACT_INGEST):
+        self.data_dir = data_dir
+        self.compact = compact
+        self.snapshot = DataSnapshot(datasets)
+        self._signals = {name: reactive.value(0) for name in self.snapshot.revisions}
+        self._swap_callbacks = []
+        self._lock = asyncio.Lock()
+
+    def use(self, *names):
+        """The current snapshot, making the calling reactive context depend on `names`."""
+        for name in names:
+            self._signals[name]()
+        return self.snapshot
+
+    def changed(self, name):
+        """Reactive value bumped when `name` is rebuilt (e.g. for @reactive.event)."""
+        return self._signals[name]
+
+    def on_swap(self, fn):
+        """Call fn(snapshot, changed_names) after every swap, before outputs re-render."""
+        self._swap_callbacks.append(fn)
+        return fn
+
+    async def reload(self, changed):
+        """Rebuild what depends on the `changed` source files and swap it in."""
+        async with self._lock:
+            previous = self.snapshot
+
+            def rebuild():
+                datasets, names = reload_datasets(
+                    previous.datasets, changed, self.data_dir, publish_dir(), self.compact,
+                )
+                snapshot = DataSnapshot(datasets, previous, names)
+                # Here rather than in the first render after the swap, which
+                # runs on the event loop (with HIV_BACKEND=sqlite this
+                # ingests the new snapshot's database)
+                snapshot.load()
+                return snapshot, names
+
+            try:
+                snapshot, names = await asyncio.to_thread(rebuild)
+            except Exception:
+                # e.g. a file caught halfway through being written; the next
+                # change event retries and the current data stays in place
+                reload_log.exception("Could not reload %s", ", ".join(sorted(changed)))
+                return set()
+
+            async with reactive.lock():
+                self.snapshot = snapshot
+                for fn in self._swap_callbacks:
+                    fn(snapshot, names)
+                for name in names:
+                    self._signals[name].set(snapshot.revisions[name])
+                await reactive.flush()
+            reload_log.info(
+                "Reloaded %s: rebuilt %s (version %s)",
+                ", ".join(sorted(changed)), ", ".join(sorted(names)), snapshot.version,
+            )
+            return names
+
+    async def watch(self):
+        from watchfiles import awatch
+
+        sources = {os.path.abspath(os.path.join(self.data_dir, name)): name for name in source_files()}
+        # Edits made before the watcher started, e.g. while a worker restarted
+        # against an older launcher snapshot
+        current = await asyncio.to_thread(source_hash, self.data_dir, self.compact)
+        if current != self.snapshot.version:
+            await self.reload(set(sources.values()))
+
+        async for changes in awatch(self.data_dir):
+            changed = {sources[path] for _, path in changes if os.path.abspath(path) in sources}
+            if changed:
+                await self.reload(changed)
+
+    @asynccontextmanager
+    async def lifespan(self, app):
+        """Starlette lifespan running the watcher while the server is up."""
+        task = asyncio.create_task(self.watch()) if WATCH_DATA else None
+        try:
+            yield
+        finally:
+            if task is not None:
+                task.cancel()
@@ -0,0 +1,39 @@
+import os
+import resource
+
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from preprocess import memory_report
+
+###############################################################################
+# Debug endpoints
+#
+# Mounted next to the Shiny app (see app.py) only when HIV_DEBUG_ENDPOINTS=1,
+# since they expose process internals.
+
+DEBUG_ENDPOINTS = os.environ.get("HIV_DEBUG_ENDPOINTS", "0") == "1"
+
+
+def peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def format_memory_report(report):
+    parts = [f"{name} {size / 1024:.0f} KiB" for name, size in report.items() if name != "total"]
+    return f"Dataset memory: {', '.join(parts)} (total {report['total'] / 1024:.0f} KiB)"
+
+
+def debug_routes(store):
+    async def memory(request):
+        datasets = store.snapshot.datasets
+        return JSONResponse({
+            "datasets": memory_report(datasets),
+            "version": datasets.get("version"),
+            "peak_rss_bytes": peak_rss_bytes(),
+        })
+
+    if not DEBUG_ENDPOINTS:
+        return []
+    return [Route("/debug/memory", memory)]
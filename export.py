@@ -0,0 +1,478 @@
+"""Render every country's dashboard and the yearly geo maps to static files.
+
+Builds the same figures as the app's server (see figures.py) without a
+Shiny session, in a process pool:
+
+  countries/<country>/   the three line charts and the gender scatter (PNG
+                         and / or SVG), and index.html with the summary
+                         cards, those charts and links to the maps
+  maps/<dataset>-<year>.html
+                         the geo map of every year in available_years, for
+                         the children and adult datasets (plus PNG / SVG
+                         when kaleido is installed)
+
+manifest.json records every artifact with a hash of its inputs. A later run
+against the same directory only renders the artifacts whose inputs changed
+(the data, the size or the formats), so refreshing an export after a data
+update is cheap. Pointing the app's HIV_EXPORT_DIR at an export of the same
+data preloads its PNG charts into the plot cache (see app.py); render them at
+the size the charts have in the browser for the cache to hit. Run from the
+repository root:
+
+    python export.py --out export [--formats png svg html] [--workers 4]
+"""
+import argparse
+import hashlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from data_store import DataSnapshot
+from render_pool import exit_with_parent
+from snapshot import open_datasets
+
+# Bump when the rendered output changes for the same inputs
+EXPORT_VERSION = 1
+FORMATS = ("png", "svg", "html")
+
+# Output name -> (metric, color, y label), as in the app's server
+LINE_CHARTS = {
+    "new_cases_line": ("New Cases", "#dc3545", "New Cases"),
+    "deaths_line": ("Deaths", "#6c757d", "Deaths"),
+    "art_coverage_line": ("ART", "#28a745", "ART (%)"),
+}
+# Geo map dataset -> (value column, color bar title)
+MAPS = {
+    "children": ("Children", "Children Newly Infected"),
+    "adult": ("Adult", "Adult Newly Infected"),
+}
+# Dependencies of the report pages, out of those of a Shiny page with value
+# boxes (the rest are Shiny's own and the inputs')
+REPORT_DEPENDENCIES = {"jquery", "bootstrap", "bslib-components", "htmltools-fill"}
+
+
+def slugify(name):
+    ascii_name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z0-9]+", "-", ascii_name.lower()).strip("-")
+
+
+def input_key(*parts):
+    """Hash of an artifact's inputs: JSON values and numpy arrays."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, np.ndarray) and part.dtype != object:
+            digest.update(str(part.dtype).encode())
+            digest.update(np.ascontiguousarray(part).tobytes())
+        else:
+            if isinstance(part, np.ndarray):
+                part = part.tolist()
+            digest.update(json.dumps(part, sort_keys=True, default=str).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _save_figure(fig, path, fmt, width, height, pixelratio):
+    if fmt == "png":
+        from plot_cache import figure_to_png
+
+        with open(path, "wb") as f:
+            f.write(figure_to_png(fig, width, height, pixelratio))
+    else:
+        dpi = fig.get_dpi()
+        fig.set_size_inches(width / dpi, height / dpi)
+        fig.set_layout_engine(layout="tight")
+        fig.savefig(path, format=fmt)
+
+
+def render_country(job):
+    """Render the charts and the report page of one country (in a pool process)."""
+    from figures import gender_scatter_figure, line_figure
+
+    out, size, timings = job["out"], job["size"], {}
+    os.makedirs(os.path.join(out, job["dir"]), exist_ok=True)
+
+    for name, chart in job["charts"].items():
+        start = time.perf_counter()
+        if name == "gender_scatter":
+            fig = gender_scatter_figure(*chart["args"])
+        else:
+            fig = line_figure(*chart["args"])
+        for fmt, path in chart["files"].items():
+            _save_figure(fig, os.path.join(out, path), fmt, *size)
+        kind = "scatter" if name == "gender_scatter" else "line"
+        timings.setdefault(kind, []).append(time.perf_counter() - start)
+
+    if job["page"] is not None:
+        start = time.perf_counter()
+        with open(os.path.join(out, job["page"]["file"]), "w", encoding="utf-8") as f:
+            f.write(report_page(**job["page"]["args"]))
+        timings["page"] = [time.perf_counter() - start]
+    return timings
+
+
+def render_map(job):
+    """Render one geo map (in a pool process)."""
+    import pandas as pd
+
+    from figures import choropleth_figure
+
+    start = time.perf_counter()
+    value_col, title, colorbar_title, geojson = job["args"]
+    df_year = pd.DataFrame({
+        "Code": job["payload"]["locations"],
+        value_col: job["payload"]["z"],
+        "Country": job["payload"]["hovertext"],
+    })
+    fig = choropleth_figure(df_year, value_col, title, colorbar_title, geojson)
+    for fmt, path in job["files"].items():
+        path = os.path.join(job["out"], path)
+        if fmt == "html":
+            # plotly.js is written once to maps/ by the parent process
+            fig.write_html(path, include_plotlyjs="directory", full_html=True)
+        else:
+            width, height, pixelratio = job["size"]
+            fig.write_image(path, format=fmt, width=width, height=height, scale=pixelratio)
+    return {"map": [time.perf_counter() - start]}
+
+
+def report_dependencies():
+    from shiny import ui
+
+    page = ui.page_fluid(ui.value_box("", ""))
+    return [dep for dep in page.get_dependencies() if dep.name in REPORT_DEPENDENCIES]
+
+
+def report_page(country, latest, charts, maps, lib_prefix):
+    """The HTML of a country's report: summary cards, charts and map links."""
+    from htmltools import HTMLDocument, tags
+
+    from figures import summary_cards_ui
+
+    body = tags.div(
+        tags.h2(country),
+        summary_cards_ui(latest),
+        tags.div(
+            *[
+                tags.div(tags.img(src=src, alt=name, style="width: 100%;"), class_="col-lg-6")
+                for name, src in charts.items()
+            ],
+            class_="row g-3 my-3",
+        ),
+        tags.p(
+            "Geo maps: ",
+            *[tags.a(label, href=href, class_="me-3") for label, href in maps.items()],
+        ),
+        class_="container-fluid py-3",
+    )
+    document = HTMLDocument(tags.html(
+        tags.head(tags.title(f"HIV Dashboard: {country}")),
+        tags.body(body, *report_dependencies()),
+    ))
+    return document.render(lib_prefix=lib_prefix)["html"]
+
+
+def copy_report_dependencies(out):
+    """Copy the report pages' CSS and JS to out/lib once."""
+    for dep in report_dependencies():
+        dep.copy_to(os.path.join(out, "lib"))
+
+
+def write_plotlyjs(directory):
+    from plotly.offline import get_plotlyjs
+
+    path = os.path.join(directory, "plotly.min.js")
+    if not os.path.exists(path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(get_plotlyjs())
+
+
+def copy_geometry(out):
+    """Copy the bundled geometry next to the maps; returns the maps' geojson URL."""
+    from geometry import GEO_DIR, geometry_url, load_manifest
+
+    url = geometry_url()
+    os.makedirs(os.path.join(out, "geo"), exist_ok=True)
+    for entry in load_manifest()["levels"].values():
+        target = os.path.join(out, "geo", entry["file"])
+        if not os.path.exists(target):
+            shutil.copyfile(os.path.join(GEO_DIR, entry["file"]), target)
+    return f"../{url}"
+
+
+def load_export_manifest(out):
+    try:
+        with open(os.path.join(out, "manifest.json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"artifacts": {}}
+
+
+def up_to_date(previous, artifact, out):
+    """Whether `artifact` was rendered with the same inputs and its files are still there."""
+    entry = previous["artifacts"].get(artifact["id"])
+    return (
+        entry is not None
+        and entry["key"] == artifact["key"]
+        and all(os.path.exists(os.path.join(out, path)) for path in entry["files"].values())
+    )
+
+
+def plan(data, args, image_formats, map_formats, geojson):
+    """The country and map jobs, with every artifact they produce."""
+    backend = data.backend
+    size = (args.width, args.height, args.pixelratio)
+    year_range = tuple(int(year) for year in data["year_range"])
+
+    # The scatter highlights World Bank names; the countries are OWID names
+    cube = data["cube"]
+    codes = data["df_deaths_new_cases"][["Country", "Code"]].drop_duplicates("Country")
+    code_of = dict(zip(codes["Country"].astype(str), codes["Code"].astype(str)))
+    scatter_name_of = dict(zip(cube.codes, cube.countries))
+    scatter_year = max(data.scatter_points)
+    scatter_countries, male, female = data.scatter_points[scatter_year]
+
+    latest_year = max(int(year) for year in data["available_years"])
+    map_links = {
+        f"{dataset.capitalize()} {latest_year}": f"../../maps/{dataset}-{latest_year}.html"
+        for dataset in MAPS
+    }
+
+    countries = args.countries or list(data["countries"])
+    unknown = sorted(set(countries) - set(data["countries"]))
+    if unknown:
+        sys.exit(f"Unknown countries: {', '.join(unknown)}")
+    country_jobs = []
+    for country in countries:
+        directory = f"countries/{slugify(country)}"
+        job = {"out": args.out, "size": size, "dir": directory, "charts": {}, "page": None,
+               "artifacts": []}
+        years, values = backend.country_series(country, *year_range)
+
+        charts = {}
+        for name, (metric, color, ylabel) in LINE_CHARTS.items():
+            charts[name] = {
+                "args": (years, values[metric], color, ylabel),
+                "key": input_key(EXPORT_VERSION, size, name, years, values[metric]),
+                "cache": {"output": name, "country": country, "year_range": list(year_range)},
+            }
+
+        highlight = scatter_name_of.get(code_of.get(country))
+        matches = (scatter_countries == highlight).nonzero()[0] if highlight else []
+        point = (male[matches[0]], female[matches[0]]) if len(matches) else None
+        charts["gender_scatter"] = {
+            "args": (scatter_year, male, female, highlight, point),
+            "key": input_key(EXPORT_VERSION, size, scatter_year, male, female, highlight),
+            "cache": {"output": "gender_scatter", "year": int(scatter_year), "highlight": highlight},
+        }
+
+        for name, chart in charts.items():
+            files = {fmt: f"{directory}/{name}.{fmt}" for fmt in image_formats}
+            artifact = {"id": f"{directory}/{name}", "kind": "chart", "key": chart["key"],
+                        "files": files, **chart["cache"]}
+            job["artifacts"].append(artifact)
+            job["charts"][name] = {"args": chart["args"], "files": files, "artifact": artifact}
+
+        if "html" in args.formats:
+            # JSON has no NaN: missing values are recorded as null
+            latest = {
+                key: int(value) if key == "Year" else (None if np.isnan(value) else float(value))
+                for key, value in backend.latest(country).items()
+            }
+            images = {name: f"{name}.{image_formats[0]}" for name in charts}
+            page_args = {"country": country, "latest": latest, "charts": images,
+                         "maps": map_links, "lib_prefix": "../../lib"}
+            artifact = {"id": f"{directory}/index", "kind": "page",
+                        "key": input_key(EXPORT_VERSION, page_args),
+                        "files": {"html": f"{directory}/index.html"}, "country": country,
+                        "latest": latest}
+            job["artifacts"].append(artifact)
+            job["page"] = {"file": artifact["files"]["html"], "args": page_args,
+                           "artifact": artifact}
+        country_jobs.append(job)
+
+    # The HTML maps fill the page whatever the size
+    map_size = size if set(map_formats) - {"html"} else None
+    map_jobs = []
+    for dataset, (value_col, colorbar_title) in MAPS.items():
+        payloads = data.geo_payloads[dataset]
+        for year in data["available_years"]:
+            year = int(year)
+            if year not in payloads:
+                continue
+            payload = {key: np.asarray(array) for key, array in payloads[year].items()}
+            title = f"{dataset.capitalize()} Newly Infected - {year}"
+            map_args = (value_col, title, colorbar_title, geojson)
+            files = {fmt: f"maps/{dataset}-{year}.{fmt}" for fmt in map_formats}
+            artifact = {
+                "id": f"maps/{dataset}-{year}", "kind": "map", "files": files,
+                "key": input_key(EXPORT_VERSION, map_size, map_args, *payload.values(), map_formats),
+            }
+            map_jobs.append({"out": args.out, "size": size, "args": map_args,
+                             "payload": payload, "files": files, "artifacts": [artifact]})
+    return country_jobs, map_jobs
+
+
+def skip_unchanged(country_jobs, map_jobs, previous, out):
+    """Drop the artifacts that are up to date from the jobs.
+
+    Returns the (function, job, ids of the artifacts it renders) to run and
+    the number of artifacts skipped.
+    """
+    jobs, skipped = [], 0
+    for job in country_jobs:
+        for name, chart in list(job["charts"].items()):
+            if up_to_date(previous, chart["artifact"], out):
+                del job["charts"][name]
+                skipped += 1
+        if job["page"] is not None and up_to_date(previous, job["page"]["artifact"], out):
+            job["page"] = None
+            skipped += 1
+        pending = [chart["artifact"]["id"] for chart in job["charts"].values()]
+        if job["page"] is not None:
+            pending.append(job["page"]["artifact"]["id"])
+        if pending:
+            jobs.append((render_country, job, pending))
+    for job in map_jobs:
+        if up_to_date(previous, job["artifacts"][0], out):
+            skipped += 1
+        else:
+            jobs.append((render_map, job, [job["artifacts"][0]["id"]]))
+    return jobs, skipped
+
+
+def remove_stale(previous, artifacts, out):
+    """Delete the files of artifacts that an earlier export had and this one doesn't."""
+    current = {path for artifact in artifacts for path in artifact["files"].values()}
+    for entry in previous["artifacts"].values():
+        for path in entry["files"].values():
+            if path not in current and os.path.exists(os.path.join(out, path)):
+                os.remove(os.path.join(out, path))
+
+
+def export(args):
+    data = DataSnapshot(open_datasets(args.data_dir))
+    image_formats = [fmt for fmt in args.formats if fmt in ("png", "svg")] or ["svg"]
+    map_formats = [fmt for fmt in args.formats if fmt == "html"]
+    if importlib.util.find_spec("kaleido") is not None:
+        map_formats += [fmt for fmt in args.formats if fmt in ("png", "svg")]
+    elif map_formats != list(args.formats):
+        print("kaleido is not installed: the geo maps are exported as HTML only", file=sys.stderr)
+        map_formats = map_formats or ["html"]
+
+    os.makedirs(os.path.join(args.out, "maps"), exist_ok=True)
+    geojson = copy_geometry(args.out)
+    if "html" in map_formats:
+        write_plotlyjs(os.path.join(args.out, "maps"))
+    if "html" in args.formats:
+        copy_report_dependencies(args.out)
+
+    country_jobs, map_jobs = plan(data, args, image_formats, map_formats, geojson)
+    artifacts = [a for job in country_jobs + map_jobs for a in job["artifacts"]]
+    previous = load_export_manifest(args.out)
+    jobs, skipped = skip_unchanged(country_jobs, map_jobs, previous, args.out)
+    rendered = len(artifacts) - skipped
+    print(f"{len(artifacts)} artifacts: {rendered} to render, {skipped} up to date", file=sys.stderr)
+
+    timings, failed = {}, set()
+    start = time.perf_counter()
+    if jobs:
+        # spawn rather than fork, as in the render pool
+        with ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=exit_with_parent,
+            initargs=(os.getpid(),),
+        ) as executor:
+            futures = {executor.submit(fn, job): pending for fn, job, pending in jobs}
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # Left out of the manifest, so the next run retries them
+                    failed.update(futures[future])
+                    print(f"  failed: {', '.join(futures[future])}: {e!r}", file=sys.stderr)
+                    continue
+                for kind, seconds in result.items():
+                    timings.setdefault(kind, []).extend(seconds)
+                if done % 20 == 0 or done == len(futures):
+                    print(f"  {done}/{len(futures)} jobs", file=sys.stderr)
+    elapsed = time.perf_counter() - start
+
+    size = {"width": args.width, "height": args.height, "pixelratio": args.pixelratio}
+    # A partial export (--countries) keeps the other countries' entries when
+    # they are of the same data and size
+    kept = {}
+    if not args.countries:
+        remove_stale(previous, artifacts, args.out)
+    elif previous.get("version") == data.version and previous.get("size") == size:
+        kept = previous["artifacts"]
+    manifest = {
+        "export_version": EXPORT_VERSION,
+        "version": data.version,
+        "size": size,
+        "artifacts": {
+            **kept,
+            **{artifact["id"]: artifact for artifact in artifacts if artifact["id"] not in failed},
+        },
+    }
+    path = os.path.join(args.out, "manifest.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+    rendered -= len(failed)
+    print(f"rendered {rendered} artifacts in {elapsed:.1f} s "
+          f"({rendered / elapsed if elapsed else 0:.1f} artifacts/s, {args.workers} workers), "
+          f"skipped {skipped}" + (f", {len(failed)} failed" if failed else ""))
+    for kind, seconds in sorted(timings.items()):
+        print(f"  {kind:<8} {len(seconds):5d}  mean {np.mean(seconds) * 1000:7.1f} ms")
+    return manifest
+
+
+def exported_images(export_dir, version):
+    """(cache info, PNG bytes) of the charts of an export of data `version`.
+
+    Yields nothing when the export is missing or of other data. The cache
+    info has the chart's output name, its inputs and the size it was
+    rendered at.
+    """
+    manifest = load_export_manifest(export_dir)
+    if manifest.get("version") != version or manifest.get("export_version") != EXPORT_VERSION:
+        return
+    size = manifest["size"]
+    for artifact in manifest["artifacts"].values():
+        if artifact["kind"] != "chart" or "png" not in artifact["files"]:
+            continue
+        try:
+            with open(os.path.join(export_dir, artifact["files"]["png"]), "rb") as f:
+                png = f.read()
+        except FileNotFoundError:
+            continue
+        yield {**artifact, **size}, png
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", default="export")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--width", type=int, default=560, help="chart width in CSS pixels")
+    parser.add_argument("--height", type=int, default=400, help="chart height in CSS pixels")
+    parser.add_argument("--pixelratio", type=float, default=1)
+    parser.add_argument("--countries", nargs="+", help="only these countries (and the maps)")
+    args = parser.parse_args()
+    export(args)
+
+
+if __name__ == "__main__":
+    main()
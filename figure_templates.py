@@ -0,0 +1,70 @@
+import os
+import threading
+
+###############################################################################
+# Reusable figure templates
+#
+# Building a matplotlib figure creates the Figure, its axes, tick machinery
+# and every artist, and a long-running worker allocates that again for each
+# render. Instead, each render thread (or process) keeps one template per
+# kind of chart: a Figure on its own Agg canvas plus the artists a builder
+# updates in place (set_data, set_offsets, set_text). Memory per worker is
+# then bounded by the number of templates, not by the number of renders.
+#
+# A builder's figure is only valid until the same thread builds another
+# figure of that kind, so it must be rasterized first (render_png_timed()
+# and the export do so). A template is discarded and rebuilt after
+# HIV_FIGURE_TEMPLATE_RENDERS uses, so anything matplotlib accumulates on
+# a figure stays bounded too; 1 builds a fresh figure for every render.
+
+FIGURE_TEMPLATE_RENDERS = int(os.environ.get("HIV_FIGURE_TEMPLATE_RENDERS", "1000"))
+
+_local = threading.local()
+_lock = threading.Lock()
+_stats = {"created": 0, "reused": 0, "recycled": 0}
+
+
+def agg_figure(**kwargs):
+    """A Figure attached to an Agg canvas, so savefig doesn't swap canvases."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(**kwargs)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def figure_template(kind, setup):
+    """This thread's template of `kind`, created by `setup()` when needed.
+
+    `setup` returns the figure and its artists, e.g. as a SimpleNamespace.
+    """
+    templates = getattr(_local, "templates", None)
+    if templates is None:
+        templates = _local.templates = {}
+    entry = templates.get(kind)
+    if entry is not None and entry[1] < FIGURE_TEMPLATE_RENDERS:
+        template, _, layout = entry
+        entry[1] += 1
+        # The tight layout starts from the figure's subplot parameters, so
+        # they go back to their initial values for the same result as a
+        # fresh figure
+        template.fig.subplots_adjust(**layout)
+        _count("reused")
+        return template
+    _count("recycled" if entry is not None else "created")
+    template = setup()
+    params = template.fig.subplotpars
+    layout = {name: getattr(params, name) for name in ("left", "bottom", "right", "top", "wspace", "hspace")}
+    templates[kind] = [template, 1, layout]
+    return template
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def template_stats():
+    with _lock:
+        return {**_stats, "max_renders": FIGURE_TEMPLATE_RENDERS}
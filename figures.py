@@ -0,0 +1,169 @@
+###############################################################################
+# Figure builders
+# Pure functions of their arguments so the rendered images can be cached and
+# shared between sessions (see plot_cache.py). The matplotlib builders update
+# this thread's figure template in place (see figure_templates.py) instead of
+# going through pyplot, whose global figure registry isn't safe to use from
+# the render pool's threads and keeps every figure alive until it is closed.
+# matplotlib and plotly are imported by the builders, so they are only loaded
+# by the render pool (or the fast start warm-up, see app.py) rather than when
+# the app starts.
+import math
+from types import SimpleNamespace
+
+import numpy as np
+
+from figure_templates import agg_figure, figure_template
+
+
+def hide_spines(ax):
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.spines['bottom'].set_visible(False)
+    ax.spines['left'].set_visible(False)
+
+
+def _line_template():
+    fig = agg_figure()
+    ax = fig.subplots()
+    line, = ax.plot([], [], marker='o', linestyle='-')
+    ax.set_xlabel("Year")
+    ax.grid(True)
+    hide_spines(ax)
+    return SimpleNamespace(fig=fig, ax=ax, line=line)
+
+
+def line_figure(years, values, color, ylabel):
+    t = figure_template("line", _line_template)
+    t.line.set_data(years, values)
+    t.line.set_color(color)
+    t.ax.set_ylabel(ylabel)
+    # Limits as a fresh plot of this data would have them
+    t.ax.relim()
+    if not np.isfinite(t.ax.dataLim.get_points()).all():
+        # No data points: scaled around 0, rather than kept from the last render
+        t.ax.update_datalim([(0, 0)])
+    t.ax.autoscale_view()
+    return t.fig
+
+
+def _scatter_template():
+    fig = agg_figure()
+    ax = fig.subplots()
+    points = ax.scatter([], [], s=30, alpha=0.7, label="Countries")
+    highlight = ax.scatter([], [], color="red", s=100)
+    # Annotate with (x, y) value
+    annotation = ax.annotate(
+        "",
+        (0, 0),
+        textcoords="offset points",
+        xytext=(-10, 20),  # offset to avoid overlapping the point
+        ha='left',
+        fontsize=12,
+        color='red'
+    )
+    ax.set_xlabel("Male Prevalence")
+    ax.set_ylabel("Female Prevalence")
+    ax.grid(True)
+    hide_spines(ax)
+    return SimpleNamespace(fig=fig, ax=ax, points=points, highlight=highlight, annotation=annotation)
+
+
+def gender_scatter_figure(year, male, female, highlight=None, point=None):
+    from matplotlib.transforms import Bbox
+
+    t = figure_template("gender_scatter", _scatter_template)
+    ax = t.ax
+    offsets = np.column_stack([male, female]) if len(male) else np.empty((0, 2))
+    t.points.set_offsets(offsets)
+    ax.set_title(f"HIV Prevalence by Gender in {year}")
+
+    # Highlight selected country
+    handles = [t.points]
+    if point is not None:
+        x_val, y_val = point
+        t.highlight.set_offsets([[x_val, y_val]])
+        t.highlight.set_label(highlight)
+        t.annotation.set_text(f"({x_val:.2f}, {y_val:.2f})")
+        t.annotation.xy = (x_val, y_val)
+        handles.append(t.highlight)
+    t.highlight.set_visible(point is not None)
+    t.annotation.set_visible(point is not None)
+
+    # Collections aren't covered by relim(): rebuild the data limits from
+    # the points, as adding them to a fresh axes would
+    ax.dataLim.set_points(Bbox.null().get_points())
+    ax.ignore_existing_data_limits = True
+    ax.update_datalim(offsets)
+    if point is not None:
+        ax.update_datalim([point])
+    if not np.isfinite(ax.dataLim.get_points()).all():
+        ax.update_datalim([(0, 0)])
+    ax.autoscale_view()
+
+    ax.legend(handles=handles)
+    return t.fig
+
+
+def choropleth_figure(df_year, value_col, title, colorbar_title, geojson):
+    """Choropleth of df_year by ISO3 "Code".
+
+    `geojson` is the URL of the bundled country geometry (see geometry.py).
+    """
+    import plotly.express as px
+
+    fig = px.choropleth(
+        df_year,
+        locations="Code",
+        color=value_col,
+        hover_name="Country",
+        # color_continuous_scale="Reds",
+        color_continuous_scale=px.colors.sequential.Plasma,
+        title=title,
+        geojson=geojson,
+        featureidkey="id",
+    )
+    # The base map layers would still be fetched from plotly's CDN
+    fig.update_geos(visible=False)
+    fig.update_layout(
+        margin={"r":0,"t":30,"l":0,"b":0},
+        coloraxis_colorbar=dict(
+            title=colorbar_title
+        )
+    )
+    return fig
+
+
+def _card_value(value, template):
+    # Some countries have no value for a metric in their latest year
+    if value is None or math.isnan(value):
+        return "n/a"
+    return template.format(int(value))
+
+
+def summary_cards_ui(latest):
+    """Value boxes for the latest year of one country's series."""
+    from shiny import ui
+
+    year = latest["Year"]
+    new_cases = _card_value(latest["New Cases"], "{:,} cases")
+    deaths = _card_value(latest["Deaths"], "{:,} cases")
+    coverage = _card_value(latest["ART"], "{}%")
+
+    return ui.layout_column_wrap(
+        ui.value_box(
+            title="New HIV Cases",
+            value=f"{new_cases} | {year}",
+            theme="danger"
+        ),
+        ui.value_box(
+            title="HIV-related Deaths",
+            value=f"{deaths} | {year}",
+            theme="secondary"
+        ),
+        ui.value_box(
+            title="ART Coverage",
+            value=f"{coverage} | {year}",
+            theme="success"
+        ),
+    )
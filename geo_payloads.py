@@ -0,0 +1,42 @@
+import numpy as np
+
+###############################################################################
+# Per-year choropleth payloads
+# geo_map builds its figure once per dataset; moving the year slider only
+# swaps the trace arrays below into the existing widget.
+
+
+def year_payloads(source, name, mapped=None):
+    """{year: {"locations", "z", "hovertext"}} arrays for one cube indicator.
+
+    `source` is the IndicatorCube or a data backend (see backends.py).
+    `mapped(codes)` is a mask of the codes the map can draw (see
+    geometry.mapped_codes); the others are left out of the payloads.
+
+    Unlike the scatter's YearMap, the payloads are built once, up front, so
+    a render or a slider step only looks up arrays that are already
+    filtered. They are small: a few hundred values per year.
+    """
+    payloads = {}
+    for year in source.years_with_data(name):
+        codes, countries, values = source.aligned(year, name)
+        if mapped is not None:
+            keep = mapped(codes)
+            codes, countries, values = codes[keep], countries[keep], values[keep]
+        payloads[int(year)] = {
+            "locations": codes,
+            "z": values,
+            "hovertext": countries,
+        }
+    return payloads
+
+
+EMPTY_PAYLOAD = {
+    "locations": np.array([], dtype=object),
+    "z": np.array([], dtype=float),
+    "hovertext": np.array([], dtype=object),
+}
+
+
+def payload_for(payloads, year):
+    return payloads.get(int(year), EMPTY_PAYLOAD)
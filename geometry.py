@@ -0,0 +1,274 @@
+import argparse
+import functools
+import hashlib
+import json
+import os
+
+import numpy as np
+from starlette.responses import FileResponse, PlainTextResponse
+from starlette.routing import Route
+
+###############################################################################
+# Bundled country geometry for the geo map
+#
+# The choropleth draws countries from GeoJSON that ships with the app,
+# instead of plotly's world topology, which plotly.js downloads from a CDN
+# at full resolution. Build the bundle from a country boundaries file keyed
+# by ISO3 code (e.g. Natural Earth's admin 0 countries):
+#
+#     python geometry.py build ne_50m_admin_0_countries.geojson
+#
+# This simplifies the boundaries at every level of detail in LEVELS and
+# writes one file per level to www/geo/, plus their manifest. The files are
+# named by content hash and served from /geo/ with long-lived cache headers,
+# so a browser downloads each level once. geo_map picks the level from the
+# width of its output.
+#
+# The committed bundle is built from Natural Earth's public domain 1:10m
+# admin 0 countries, as packaged by datahub.io's geo-countries dataset (the
+# countries.geojson shipped with pycristoforo 2.0.0). The 1:110m scale of
+# plotly's own topology has no detail beyond the medium level and leaves
+# out small states such as Singapore, Malta or the Maldives.
+#
+# Codes without geometry, such as the World Bank aggregates (AFE, WLD, ...),
+# are dropped from the geo payloads when those are built, instead of being
+# sent with every render. There is no fallback to plotly's topology, which
+# would be fetched from the CDN: without a bundle the geo map fails with
+# GeometryMissing.
+
+GEO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "www", "geo")
+MANIFEST = os.path.join(GEO_DIR, "manifest.json")
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Level -> (simplification tolerance in degrees, decimals kept, widest
+# output in CSS pixels it is used for)
+LEVELS = {
+    "low": (0.2, 2, 600),
+    "medium": (0.05, 3, 1200),
+    "high": (0.01, 3, None),
+}
+
+# World Bank regional, income and lending group aggregates
+WB_AGGREGATES = frozenset({
+    "AFE", "AFW", "ARB", "CEB", "CSS", "EAP", "EAR", "EAS", "ECA", "ECS",
+    "EMU", "EUU", "FCS", "HIC", "HPC", "IBD", "IBT", "IDA", "IDB", "IDX",
+    "INX", "LAC", "LCN", "LDC", "LIC", "LMC", "LMY", "LTE", "MEA", "MIC",
+    "MNA", "NAC", "OED", "OSS", "PRE", "PSS", "PST", "SAS", "SSA", "SSF",
+    "SST", "TEA", "TEC", "TLA", "TMN", "TSA", "TSS", "UMC", "WLD",
+})
+
+# Properties holding a feature's ISO3 code, in order of preference. Natural
+# Earth sets ISO_A3 to "-99" for a few countries (France, Norway) and has
+# their code in ADM0_A3.
+CODE_PROPERTIES = ["ISO_A3", "iso_a3", "ADM0_A3", "adm0_a3", "ISO3", "iso3"]
+# Natural Earth has no ISO code for Kosovo ("-99", or KOS in ADM0_A3); the
+# World Bank data uses XKX. It also has Jersey and Guernsey, which the World
+# Bank reports together as the Channel Islands.
+CODE_ALIASES = {"KOS": "XKX", "JEY": "CHI", "GGY": "CHI"}
+NAME_PROPERTIES = ["NAME", "name", "ADMIN", "admin"]
+NAME_CODES = {"Kosovo": "XKX"}
+
+
+class GeometryMissing(RuntimeError):
+    pass
+
+
+def _simplify_ring(ring, tolerance):
+    """Douglas-Peucker simplification of one closed ring (an (n, 2) array)."""
+    if len(ring) <= 4:
+        return ring
+    keep = np.zeros(len(ring), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(ring) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = ring[first], ring[last]
+        inner = ring[first + 1:last]
+        segment = end - start
+        length = np.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(*(inner - start).T)
+        else:
+            offsets = inner - start
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance:
+            split = first + 1 + i
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return ring[keep]
+
+
+def _simplify_polygon(polygon, tolerance, decimals):
+    rings = []
+    for i, ring in enumerate(polygon):
+        ring = np.round(_simplify_ring(np.asarray(ring, dtype=float), tolerance), decimals)
+        # Drop consecutive duplicates left by the rounding
+        ring = ring[np.r_[True, np.any(np.diff(ring, axis=0) != 0, axis=1)]]
+        if len(ring) < 4:
+            if i == 0:
+                # The exterior collapsed: the whole polygon goes
+                return None
+            continue
+        rings.append(ring.tolist())
+    return rings
+
+
+def simplify_geometry(geometry, tolerance, decimals):
+    """A simplified copy of a Polygon or MultiPolygon as a MultiPolygon.
+
+    Polygons that collapse below the tolerance are dropped. When all of them
+    do, the largest is kept unsimplified, so small island states stay on the
+    map.
+    """
+    if geometry["type"] == "Polygon":
+        polygons = [geometry["coordinates"]]
+    elif geometry["type"] == "MultiPolygon":
+        polygons = geometry["coordinates"]
+    else:
+        return None
+    simplified = [_simplify_polygon(polygon, tolerance, decimals) for polygon in polygons]
+    simplified = [polygon for polygon in simplified if polygon]
+    if not simplified:
+        largest = max(polygons, key=lambda polygon: len(polygon[0]))
+        simplified = [[np.round(np.asarray(largest[0], dtype=float), decimals).tolist()]]
+    return {"type": "MultiPolygon", "coordinates": simplified}
+
+
+def feature_code(properties):
+    for key in CODE_PROPERTIES:
+        code = properties.get(key)
+        if isinstance(code, str) and len(code) == 3 and code != "-99":
+            return CODE_ALIASES.get(code.upper(), code.upper())
+    for key in NAME_PROPERTIES:
+        code = NAME_CODES.get(properties.get(key))
+        if code is not None:
+            return code
+    return None
+
+
+def build_geometry(source, out_dir=GEO_DIR):
+    """Write the simplified levels of `source` (a GeoJSON FeatureCollection) and their manifest."""
+    with open(source) as f:
+        features = json.load(f)["features"]
+
+    countries = {}
+    for feature in features:
+        code = feature.get("id") if isinstance(feature.get("id"), str) else None
+        code = feature_code(feature.get("properties") or {}) or code
+        if code and code not in WB_AGGREGATES and feature.get("geometry"):
+            countries.setdefault(code, []).append(feature["geometry"])
+
+    os.makedirs(out_dir, exist_ok=True)
+    previous = [name for name in os.listdir(out_dir) if name.startswith("countries-")]
+    manifest = {"codes": sorted(countries), "levels": {}}
+    for level, (tolerance, decimals, max_width) in LEVELS.items():
+        collection = {"type": "FeatureCollection", "features": []}
+        for code, geometries in sorted(countries.items()):
+            polygons = []
+            for geometry in geometries:
+                simplified = simplify_geometry(geometry, tolerance, decimals)
+                if simplified is not None:
+                    polygons.extend(simplified["coordinates"])
+            if polygons:
+                collection["features"].append({
+                    "type": "Feature",
+                    "id": code,
+                    "properties": {},
+                    "geometry": {"type": "MultiPolygon", "coordinates": polygons},
+                })
+        content = json.dumps(collection, separators=(",", ":")).encode()
+        name = f"countries-{level}-{hashlib.sha256(content).hexdigest()[:12]}.json"
+        with open(os.path.join(out_dir, name), "wb") as f:
+            f.write(content)
+        manifest["levels"][level] = {"file": name, "bytes": len(content), "max_width": max_width}
+
+    with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    # Files of an earlier build that the new manifest no longer points to
+    current = {entry["file"] for entry in manifest["levels"].values()}
+    for name in previous:
+        if name not in current:
+            os.remove(os.path.join(out_dir, name))
+    return manifest
+
+
+@functools.cache
+def load_manifest():
+    """The bundle's manifest, or None when no geometry has been built."""
+    try:
+        with open(MANIFEST) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    manifest["codes"] = frozenset(manifest["codes"])
+    return manifest
+
+
+def mapped_codes(codes):
+    """Boolean mask of the `codes` the geo map can draw."""
+    manifest = load_manifest()
+    codes = np.asarray(codes, dtype=object)
+    if manifest is None:
+        return np.array([code not in WB_AGGREGATES for code in codes], dtype=bool)
+    return np.array([code in manifest["codes"] for code in codes], dtype=bool)
+
+
+def geometry_url(width=None, pixelratio=1):
+    """URL of the level of detail for an output `width` CSS pixels wide.
+
+    An unknown width gets the most detailed level. Raises GeometryMissing
+    when no bundle has been built.
+    """
+    manifest = load_manifest()
+    if manifest is None:
+        raise GeometryMissing(
+            f"No country geometry in {GEO_DIR}; build it with"
+            " `python geometry.py build <countries.geojson>`"
+        )
+    levels = list(manifest["levels"].values())
+    chosen = levels[-1]
+    if width:
+        pixels = width * (pixelratio or 1)
+        chosen = next(
+            entry for entry in levels if entry["max_width"] is None or pixels <= entry["max_width"]
+        )
+    # Relative, so it resolves against wherever the app is mounted
+    return f"geo/{chosen['file']}"
+
+
+def geometry_routes():
+    """/geo/<file>: the bundled levels of detail, cacheable for a year."""
+    async def geometry_file(request):
+        name = request.path_params["name"]
+        manifest = load_manifest()
+        if manifest is None or name not in {entry["file"] for entry in manifest["levels"].values()}:
+            return PlainTextResponse("Not found", status_code=404)
+        return FileResponse(
+            os.path.join(GEO_DIR, name),
+            media_type="application/geo+json",
+            headers={"Cache-Control": CACHE_CONTROL},
+        )
+
+    return [Route("/geo/{name}", geometry_file)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the geo map's bundled country geometry.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="simplify a GeoJSON file of countries into www/geo/")
+    build.add_argument("source")
+    build.add_argument("--out", default=GEO_DIR)
+    args = parser.parse_args()
+
+    manifest = build_geometry(args.source, args.out)
+    print(f"{len(manifest['codes'])} countries")
+    for level, entry in manifest["levels"].items():
+        print(f"  {level:<7} {entry['bytes'] / 1024:8.0f} KiB  {entry['file']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import os
+from collections.abc import Mapping
+
+import numpy as np
+
+###############################################################################
+# World Bank indicator cube
+#
+# Every World Bank indicator file has the same wide layout: one row per
+# country (Country Name, Country Code, Indicator Name, Indicator Code) and
+# one column per year. All registered files are parsed into a single dense
+# float32 array of shape (indicator, country, year), with NaN where a value
+# is missing, plus shared country and year index arrays. One year of one
+# indicator is then a column view, and two indicators for the same year are
+# already aligned by country.
+
+WORLD_BANK_INDICATORS = {}
+
+
+def register_indicator(name, filename):
+    """Add a World Bank layout CSV (relative to the data directory) to the cube."""
+    WORLD_BANK_INDICATORS[name] = filename
+
+
+register_indicator("prevalence_male", "prevalence-of-hiv-male-teenager.csv")
+register_indicator("prevalence_female", "prevalence-of-hiv-female-teenager.csv")
+register_indicator("children_newly_infected", "children-newly-infected-with-hiv.csv")
+register_indicator("adult_newly_infected", "adults-newly-infected-with-hiv.csv")
+# The World Bank ART coverage files (overall and for PMTCT) in data/ aren't
+# registered: no output reads them, and the line chart's ART coverage comes
+# from the Our World in Data panel.
+
+
+def read_world_bank(path, compact=True):
+    """(codes, countries, years, values) of one World Bank layout CSV.
+
+    With `compact`, only the country and year columns are parsed (as float32)
+    and years without a single value are dropped.
+    """
+    import pandas as pd
+
+    if compact:
+        header = pd.read_csv(path, nrows=0).columns
+        year_columns = [col for col in header if col.isnumeric()]
+        df = pd.read_csv(
+            path,
+            usecols=['Country Name', 'Country Code', *year_columns],
+            dtype={col: np.float32 for col in year_columns},
+        )
+        df = df[df['Country Code'].notna()]
+        year_columns = [col for col in year_columns if df[col].notna().any()]
+    else:
+        df = pd.read_csv(path)
+        df = df[df['Country Code'].notna()]
+        year_columns = [col for col in df.columns if col.isnumeric()]
+    return (
+        df['Country Code'].to_numpy(),
+        df['Country Name'].to_numpy(),
+        np.array(year_columns, dtype=int),
+        df[year_columns].to_numpy(dtype=np.float32),
+    )
+
+
+class IndicatorCube:
+    def __init__(self, names, codes, countries, years, values):
+        self.names = list(names)
+        self.codes = codes
+        self.countries = countries
+        self.years = years
+        self.values = values
+        self._index = {name: i for i, name in enumerate(self.names)}
+        self._year_index = {int(year): i for i, year in enumerate(years)}
+
+    @classmethod
+    def empty(cls):
+        return cls([], np.array([], dtype=object), np.array([], dtype=object),
+                   np.array([], dtype=int), np.empty((0, 0, 0), dtype=np.float32))
+
+    def with_indicators(self, parsed):
+        """New cube with the {name: read_world_bank(...)} indicators added or replaced.
+
+        Existing countries and years keep their positions; the country and
+        year axes are extended with whatever the parsed files add. Countries
+        a replaced file no longer has stay on the axis with missing values.
+        """
+        names = self.names + [name for name in parsed if name not in self._index]
+
+        # Shared country and year axes across all files
+        country_names = dict(zip(self.codes, self.countries))
+        for codes, countries, _, _ in parsed.values():
+            for code, country in zip(codes, countries):
+                country_names.setdefault(code, country)
+        codes = np.array(list(country_names), dtype=object)
+        countries = np.array(list(country_names.values()), dtype=object)
+        years = np.array(sorted(set(self.years.tolist()).union(
+            *[y.tolist() for _, _, y, _ in parsed.values()]
+        )), dtype=int)
+        code_position = {code: i for i, code in enumerate(codes)}
+
+        values = np.full((len(names), len(codes), len(years)), np.nan, dtype=np.float32)
+        if len(self.names):
+            cols = np.searchsorted(years, self.years)
+            values[:len(self.names), :len(self.codes), :][..., cols] = self.values
+        for name, (file_codes, _, file_years, file_values) in parsed.items():
+            i = names.index(name)
+            rows = np.array([code_position[code] for code in file_codes], dtype=int)
+            cols = np.searchsorted(years, file_years)
+            values[i] = np.nan
+            values[i][np.ix_(rows, cols)] = file_values
+
+        return IndicatorCube(names, codes, countries, years, values)
+
+    def indicator(self, name):
+        """(country, year) view of one indicator."""
+        return self.values[self._index[name]]
+
+    def year_column(self, name, year):
+        """Values of one indicator for every country in `year` (a view)."""
+        j = self._year_index.get(int(year))
+        if j is None:
+            return np.full(len(self.codes), np.nan, dtype=self.values.dtype)
+        return self.values[self._index[name], :, j]
+
+    def aligned(self, year, *names):
+        """(codes, countries, values...) for countries that have every indicator in `year`."""
+        columns = [self.year_column(name, year) for name in names]
+        mask = np.ones(len(self.codes), dtype=bool)
+        for column in columns:
+            mask &= ~np.isnan(column)
+        return (self.codes[mask], self.countries[mask], *[column[mask] for column in columns])
+
+    def years_with_data(self, *names):
+        """Years in which at least one country has every indicator in `names`."""
+        present = np.ones(self.values.shape[1:], dtype=bool)
+        for name in names:
+            present &= ~np.isnan(self.indicator(name))
+        return self.years[present.any(axis=0)]
+
+    def to_long(self, name, value_name, compact=True):
+        """Long (Country, Code, Year, value) frame of one indicator, without missing values.
+
+        `compact` selects categorical Country/Code, int16 Year and float32
+        values; otherwise object, int64 and float64.
+        """
+        import pandas as pd
+
+        values = self.indicator(name).T  # year-major, like DataFrame.melt
+        year_i, country_i = np.nonzero(~np.isnan(values))
+        if compact:
+            return pd.DataFrame({
+                'Country': pd.Categorical(self.countries[country_i]),
+                'Code': pd.Categorical(self.codes[country_i]),
+                'Year': self.years[year_i].astype(np.int16),
+                value_name: values[year_i, country_i],
+            })
+        return pd.DataFrame({
+            'Country': self.countries[country_i],
+            'Code': self.codes[country_i],
+            'Year': self.years[year_i].astype(np.int64),
+            value_name: values[year_i, country_i].astype(np.float64),
+        })
+
+
+class YearMap(Mapping):
+    """Read-only year -> value mapping whose values are computed on access.
+
+    Per-year slices of the cube are cheap to take, so they aren't stored:
+    every worker attached to a shared snapshot would otherwise hold its own
+    copy of them.
+    """
+
+    def __init__(self, years, build):
+        self._years = [int(year) for year in years]
+        self._year_set = set(self._years)
+        self._build = build
+
+    def __getitem__(self, year):
+        if year not in self._year_set:
+            raise KeyError(year)
+        return self._build(year)
+
+    def __contains__(self, year):
+        return year in self._year_set
+
+    def __iter__(self):
+        return iter(self._years)
+
+    def __len__(self):
+        return len(self._years)
+
+
+def load_cube(data_dir="data", indicators=None, compact=True):
+    """Parse every registered indicator file into one IndicatorCube."""
+    indicators = indicators or WORLD_BANK_INDICATORS
+    return IndicatorCube.empty().with_indicators(
+        read_indicators(data_dir, indicators, compact)
+    )
+
+
+def read_indicators(data_dir, indicators, compact=True):
+    """{name: read_world_bank(...)} for the given {name: filename} indicators."""
+    return {
+        name: read_world_bank(os.path.join(data_dir, filename), compact)
+        for name, filename in indicators.items()
+    }
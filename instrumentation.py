@@ -0,0 +1,333 @@
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from shiny import reactive
+from shiny.render.renderer import Renderer
+from shiny.session import get_current_session
+from shiny.types import SilentException, SilentOperationInProgressException
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from metrics import SIZE_BUCKETS, registry
+
+###############################################################################
+# Render and reactive instrumentation
+#
+# `instrument` wraps an output renderer (between @output and @render.*) or a
+# reactive calc's function (under @reactive.Calc) and records wall time,
+# CPU time, payload size and invalidations per output. Each render is split
+# into phases:
+#
+#   data       the value function (slicing the data for the output)
+#   figure     building the figure (in the render pool for plots)
+#   rasterize  encoding the figure as PNG (in the render pool)
+#   serialize  turning the value into the JSON sent to the browser
+#
+# Plots rendered in the pool are also timed as jobs, from submission until
+# the image is ready, since their render() itself only submits the job.
+# Renders skipped by input coalescing (see coalesce.py) are counted per input
+# for slider values that were replaced before any output saw them, and per
+# output for renders held back while the previous one was still running.
+#
+# Value functions that do more than slice data mark their own phases with
+# `phase()`. Everything is exposed on /metrics in the Prometheus text format,
+# together with session counts and the plot cache and render pool stats.
+#
+# HIV_SLOW_RENDER_MS turns on the slow-render log: renders slower than that
+# are logged (as a warning on the "hiv_dashboard.slow_render" logger) with
+# their phases and the session's input values (see track_session).
+#
+# The payload size of a plot is that of its data URI, which the plot cache
+# (or the pooled result) already holds, so it is recorded for every render.
+# Other values have to be encoded a second time on the event loop to be
+# measured, so they are sampled: HIV_PAYLOAD_SAMPLE=N measures one render in
+# N per output (20 by default, 0 turns it off).
+
+METRICS_ENABLED = os.environ.get("HIV_METRICS", "1") != "0"
+SLOW_RENDER_MS = float(os.environ.get("HIV_SLOW_RENDER_MS", "0"))
+PAYLOAD_SAMPLE = int(os.environ.get("HIV_PAYLOAD_SAMPLE", "20"))
+
+slow_render_log = logging.getLogger("hiv_dashboard.slow_render")
+
+render_seconds = registry.histogram(
+    "hiv_output_render_seconds", "Wall time of one output render.", ["output"])
+render_cpu_seconds = registry.histogram(
+    "hiv_output_render_cpu_seconds", "CPU time of one output render on the event loop thread.", ["output"])
+phase_seconds = registry.histogram(
+    "hiv_output_phase_seconds", "Wall time of one render phase.", ["output", "phase"])
+phase_cpu_seconds = registry.histogram(
+    "hiv_output_phase_cpu_seconds", "CPU time of one render phase, in the thread that ran it.", ["output", "phase"])
+payload_bytes = registry.histogram(
+    "hiv_output_payload_bytes",
+    "Size of the value sent for one render (JSON values sampled, see HIV_PAYLOAD_SAMPLE).",
+    ["output"], SIZE_BUCKETS)
+renders_total = registry.counter(
+    "hiv_output_renders_total",
+    "Output renders by outcome (ok, pending, silent, error).", ["output", "outcome"])
+invalidations_total = registry.counter(
+    "hiv_output_invalidations_total", "Output invalidations.", ["output"])
+calc_seconds = registry.histogram(
+    "hiv_calc_seconds", "Wall time of one reactive calc execution.", ["calc"])
+calc_cpu_seconds = registry.histogram(
+    "hiv_calc_cpu_seconds", "CPU time of one reactive calc execution.", ["calc"])
+calc_invalidations_total = registry.counter(
+    "hiv_calc_invalidations_total", "Reactive calc invalidations.", ["calc"])
+sessions_active = registry.gauge("hiv_sessions_active", "Connected sessions.")
+sessions_total = registry.counter("hiv_sessions_total", "Sessions started.")
+render_job_seconds = registry.histogram(
+    "hiv_output_render_job_seconds",
+    "Time from submitting a render to the pool until its result is ready.", ["output"])
+input_values_total = registry.counter(
+    "hiv_input_values_total",
+    "Values of coalesced inputs by outcome (applied, coalesced).", ["input", "outcome"])
+renders_deferred_total = registry.counter(
+    "hiv_output_renders_deferred_total",
+    "Renders held back until the output's running render finished.", ["output"])
+
+
+def stats_gauge(name, documentation, stats):
+    """Expose the numeric fields of stats() as gauge `name`, read at scrape time."""
+    def read():
+        return {
+            (field,): value for field, value in stats().items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)
+        }
+    registry.gauge(name, documentation, ["stat"], callback=read)
+
+
+# Phases recorded by the value function currently running, if any
+_current_phases = contextvars.ContextVar("current_phases", default=None)
+# Input ids reported by the slow-render log, per session id
+_session_inputs = {}
+
+
+@contextmanager
+def phase(output, name):
+    """Time a block of a value function as one phase of `output`'s render."""
+    phases = _current_phases.get()
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+        record_phase(output, name, wall, cpu)
+        if phases is not None:
+            phases[name] = phases.get(name, 0.0) + wall
+
+
+def record_phase(output, name, wall, cpu=None):
+    if not METRICS_ENABLED:
+        return
+    phase_seconds.observe(wall, output=output, phase=name)
+    if cpu is not None:
+        phase_cpu_seconds.observe(cpu, output=output, phase=name)
+
+
+def track_session(session, inputs=()):
+    """Count `session` and remember which input values the slow-render log reports."""
+    sessions_active.inc()
+    sessions_total.inc()
+    _session_inputs[session.id] = list(inputs)
+
+    def ended():
+        sessions_active.dec()
+        _session_inputs.pop(session.id, None)
+
+    session.on_ended(ended)
+
+
+def input_values(session):
+    values = {}
+    with reactive.isolate():
+        for name in _session_inputs.get(session.id, ()):
+            try:
+                values[name] = session.input[name]()
+            except SilentException:
+                pass
+    return values
+
+
+def is_slow(wall):
+    return bool(SLOW_RENDER_MS) and wall * 1000 >= SLOW_RENDER_MS
+
+
+def log_slow_render(output, wall, cpu, phases, session, inputs=None):
+    if inputs is None and session is not None:
+        inputs = input_values(session)
+    slow_render_log.warning(json.dumps({
+        "output": output,
+        "wall_ms": round(wall * 1000, 1),
+        "cpu_ms": round(cpu * 1000, 1),
+        "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in phases.items()},
+        "session": session.id if session is not None else None,
+        "inputs": inputs or {},
+    }, default=str))
+
+
+def record_job(output, wall, phases, session=None, inputs=None):
+    """Record a finished pool render: `phases` maps phase -> (wall, cpu)."""
+    if not METRICS_ENABLED:
+        return
+    render_job_seconds.observe(wall, output=output)
+    for name, (phase_wall, phase_cpu) in phases.items():
+        record_phase(output, name, phase_wall, phase_cpu)
+    if is_slow(wall):
+        cpu = sum(phase_cpu for _, phase_cpu in phases.values())
+        walls = {name: phase_wall for name, (phase_wall, _) in phases.items()}
+        walls["queue"] = max(wall - sum(walls.values()), 0.0)
+        log_slow_render(output, wall, cpu, walls, session, inputs)
+
+
+def record_input(name, outcome):
+    """Count one value of a coalesced input as "applied" or "coalesced"."""
+    if METRICS_ENABLED:
+        input_values_total.inc(input=name, outcome=outcome)
+
+
+def record_deferred(output):
+    if METRICS_ENABLED:
+        renders_deferred_total.inc(output=output)
+
+
+class _TimedValueFn:
+    """Wraps a renderer's value function to time it as the data phase."""
+
+    def __init__(self, fn, output):
+        self._fn = fn
+        self._output = output
+
+    def __getattr__(self, name):
+        return getattr(self._fn, name)
+
+    async def __call__(self):
+        phases = _current_phases.get()
+        explicit = {}
+        token = _current_phases.set(explicit)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            return await self._fn()
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+            _current_phases.reset(token)
+            if phases is not None:
+                phases.update(explicit)
+            # A value function that marks its own phases isn't just slicing data
+            if not explicit:
+                record_phase(self._output, "data", wall, cpu)
+                if phases is not None:
+                    phases["data"] = wall
+
+
+def known_payload_size(value):
+    """Size of a value made of one encoded string (a plot's data URI, text), else None."""
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, dict) and isinstance(value.get("src"), str):
+        return len(value["src"])
+    return None
+
+
+def _instrument_renderer(renderer):
+    output = renderer.output_id
+    renderer.fn = _TimedValueFn(renderer.fn, output)
+    render = renderer.render
+    sample = itertools.count() if PAYLOAD_SAMPLE else None
+
+    async def timed_render():
+        reactive.get_current_context().on_invalidate(
+            lambda: invalidations_total.inc(output=output)
+        )
+        phases = {}
+        token = _current_phases.set(phases)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        outcome = "error"
+        try:
+            value = await render()
+            outcome = "ok"
+            return value
+        except SilentOperationInProgressException:
+            outcome = "pending"
+            raise
+        except SilentException:
+            outcome = "silent"
+            raise
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+            _current_phases.reset(token)
+            renders_total.inc(output=output, outcome=outcome)
+            if outcome == "ok":
+                render_seconds.observe(wall, output=output)
+                render_cpu_seconds.observe(cpu, output=output)
+                size = known_payload_size(value)
+                if size is None and sample is not None and next(sample) % PAYLOAD_SAMPLE == 0:
+                    size = len(json.dumps(value, default=str))
+                if size is not None:
+                    payload_bytes.observe(size, output=output)
+                phases["serialize"] = max(wall - sum(phases.values()), 0.0)
+                record_phase(output, "serialize", phases["serialize"])
+                if is_slow(wall):
+                    log_slow_render(output, wall, cpu, phases, get_current_session())
+
+    renderer.render = timed_render
+    return renderer
+
+
+def _instrument_calc(fn):
+    name = fn.__name__
+
+    def observe(wall, cpu):
+        reactive.get_current_context().on_invalidate(
+            lambda: calc_invalidations_total.inc(calc=name)
+        )
+        calc_seconds.observe(wall, calc=name)
+        calc_cpu_seconds.observe(cpu, calc=name)
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def timed_async():
+            wall, cpu = time.perf_counter(), time.thread_time()
+            try:
+                return await fn()
+            finally:
+                observe(time.perf_counter() - wall, time.thread_time() - cpu)
+        return timed_async
+
+    @functools.wraps(fn)
+    def timed():
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            return fn()
+        finally:
+            observe(time.perf_counter() - wall, time.thread_time() - cpu)
+    return timed
+
+
+def instrument(target):
+    """Record metrics for an output renderer or a reactive calc function.
+
+    Place it between @output and @render.* for outputs, and directly under
+    @reactive.Calc for calcs. A no-op when HIV_METRICS=0.
+    """
+    if not METRICS_ENABLED:
+        return target
+    if isinstance(target, Renderer):
+        return _instrument_renderer(target)
+    return _instrument_calc(target)
+
+
+def metrics_routes():
+    async def metrics(request):
+        return PlainTextResponse(registry.expose(), media_type="text/plain; version=0.0.4")
+
+    if not METRICS_ENABLED:
+        return []
+    return [Route("/metrics", metrics)]
@@ -0,0 +1,263 @@
+import asyncio
+import base64
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from shiny import reactive, render
+from shiny.session import require_active_session
+from shiny.types import SilentOperationInProgressException
+
+from coalesce import COALESCE_ENABLED
+from instrumentation import SLOW_RENDER_MS, input_values, record_deferred, record_job
+from render_pool import render_pool
+
+###############################################################################
+# Process-wide cache of rendered plots
+#
+# The line charts and the gender scatter are pure functions of their inputs,
+# so the encoded PNG for one (output, inputs, size, pixel ratio) combination
+# can be shared by every session in the worker. A cache hit never touches
+# matplotlib.
+
+PLOT_CACHE_MB = float(os.environ.get("HIV_PLOT_CACHE_MB", "64"))
+
+
+class PlotCache:
+    """Thread-safe LRU of encoded images, bounded by total size in bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = value
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+plot_cache = PlotCache(int(PLOT_CACHE_MB * 1024 * 1024))
+
+
+def figure_to_png(fig, width, height, pixelratio):
+    """Rasterize a matplotlib figure the same way @render.plot does."""
+    dpi = fig.get_dpi()
+    fig.set_size_inches(width / dpi, height / dpi)
+    fig.set_layout_engine(layout="tight")
+    with io.BytesIO() as buf:
+        fig.savefig(buf, format="png", dpi=dpi * pixelratio)
+        return buf.getvalue()
+
+
+def render_png(build, width, height, pixelratio):
+    """Run a plot builder and encode its result; executed in the render pool."""
+    return render_png_timed(build, width, height, pixelratio)[0]
+
+
+def render_png_timed(build, width, height, pixelratio):
+    """render_png() plus {phase: (wall, cpu)} for the figure and rasterize phases.
+
+    Builders that return PNG bytes (composed scatter frames) only report a
+    figure phase. CPU time is that of the pool thread or process.
+    """
+    wall, cpu = time.perf_counter(), time.thread_time()
+    result = build()
+    phases = {"figure": (time.perf_counter() - wall, time.thread_time() - cpu)}
+    if isinstance(result, bytes):
+        return result, phases
+    wall, cpu = time.perf_counter(), time.thread_time()
+    png = figure_to_png(result, width, height, pixelratio)
+    phases["rasterize"] = (time.perf_counter() - wall, time.thread_time() - cpu)
+    return png, phases
+
+
+class cached_plot(render.plot):
+    """Drop-in replacement for @render.plot backed by `plot_cache`.
+
+    The decorated function returns `(key, build)`: `key` is a hashable tuple
+    of the normalized inputs the plot depends on and `build` is a callable
+    returning a matplotlib figure (or already encoded PNG bytes). On a cache
+    miss `build` runs in the render pool, so it must be picklable when the
+    pool uses processes (e.g. a functools.partial of a module-level function).
+
+    While the job runs the output stays in its "recalculating" state and the
+    reactive flush is released; the output re-renders once the image is
+    ready. A newer input for the same output cancels a job that hasn't
+    started yet. One that is already running is left to finish, and the
+    output then renders whatever the inputs are by that time, so only the
+    latest of the values that arrived meanwhile is rendered (unless
+    HIV_INPUT_COALESCE=off, see coalesce.py).
+    """
+
+    def __init__(self, _fn=None, **kwargs):
+        super().__init__(_fn, **kwargs)
+        self._ready = reactive.value(0)
+        self._result = None
+        self._job = None
+        self._job_key = None
+
+    async def render(self):
+        session = require_active_session(None)
+        output_name = session.ns(self.output_id)
+        inputs = session.root_scope().input
+
+        pixelratio = inputs[".clientdata_pixelratio"]()
+        width = inputs[f".clientdata_output_{output_name}_width"]()
+        height = inputs[f".clientdata_output_{output_name}_height"]()
+
+        key, build = await self.fn()
+        cache_key = (output_name, key, width, height, pixelratio)
+
+        src = plot_cache.get(cache_key)
+        if src is None and self._result is not None and self._result[0] == cache_key:
+            # Finished job whose image didn't fit in (or was evicted from) the cache
+            src = self._result[1]
+            if isinstance(src, BaseException):
+                raise src
+        if src is None:
+            self._ready()
+            token = (session.id, output_name)
+            if self._job is None or self._job.done() or self._job_key != cache_key:
+                if COALESCE_ENABLED and self._job is not None and render_pool.running(token):
+                    # _finished() re-renders this output once the job is done
+                    record_deferred(output_name)
+                    raise SilentOperationInProgressException()
+                submitted = time.perf_counter()
+                # Inputs as they were when the render was requested
+                inputs = input_values(session) if SLOW_RENDER_MS else None
+                job = render_pool.submit(
+                    token, render_png_timed, build, width, height, pixelratio
+                )
+                job.add_done_callback(
+                    lambda job: self._finished(cache_key, job, submitted, session, inputs)
+                )
+                self._job, self._job_key = job, cache_key
+            raise SilentOperationInProgressException()
+
+        res = {"src": src, "width": "100%", "height": "100%"}
+        if self.alt is not None:
+            res["alt"] = self.alt
+        return res
+
+    def _finished(self, cache_key, job, submitted, session, inputs):
+        if job.cancelled():
+            return
+        if job.exception() is not None:
+            result = job.exception()
+        else:
+            png, phases = job.result()
+            wall, cpu = time.perf_counter(), time.thread_time()
+            result = "data:image/png;base64," + base64.b64encode(png).decode("ascii")
+            phases["serialize"] = (time.perf_counter() - wall, time.thread_time() - cpu)
+            plot_cache.put(cache_key, result)
+            record_job(cache_key[0], time.perf_counter() - submitted, phases, session, inputs)
+        # Only the latest job for this output triggers a re-render
+        if job is self._job:
+            self._result = (cache_key, result)
+            self._rerender_task = asyncio.create_task(self._rerender())
+
+    async def _rerender(self):
+        async with reactive.lock():
+            self._ready.set(self._ready.get() + 1)
+            await reactive.flush()
+
+
+def call_timed(fn, *args):
+    """fn(*args) plus its {"figure": (wall, cpu)} phase; executed in the render pool."""
+    wall, cpu = time.perf_counter(), time.thread_time()
+    result = fn(*args)
+    return result, {"figure": (time.perf_counter() - wall, time.thread_time() - cpu)}
+
+
+class PooledResult:
+    """Result of a render pool job for an output that isn't a cached_plot.
+
+    Works like cached_plot without the cache: the output's value function
+    calls `await get(key, fn, *args)`, which returns fn(*args) once the job
+    for `key` is done. Until then it submits the job (unless it is already
+    running for `key`) and raises SilentOperationInProgressException, so the
+    reactive flush never waits for the pool; the output re-renders when the
+    job finishes. Create one per session and output, in the server function.
+    """
+
+    def __init__(self, output_name):
+        self.output_name = output_name
+        self._ready = reactive.value(0)
+        self._result = None
+        self._job = None
+        self._job_key = None
+
+    async def get(self, key, fn, *args):
+        session = require_active_session(None)
+        self._ready()
+        if self._result is not None and self._result[0] == key:
+            result = self._result[1]
+            if isinstance(result, BaseException):
+                raise result
+            return result
+        if self._job is None or self._job.done() or self._job_key != key:
+            submitted = time.perf_counter()
+            job = render_pool.submit((session.id, self.output_name), call_timed, fn, *args)
+            job.add_done_callback(lambda job: self._finished(key, job, submitted, session))
+            self._job, self._job_key = job, key
+        raise SilentOperationInProgressException()
+
+    def _finished(self, key, job, submitted, session):
+        if job.cancelled():
+            return
+        if job.exception() is not None:
+            result = job.exception()
+        else:
+            result, phases = job.result()
+            record_job(self.output_name, time.perf_counter() - submitted, phases, session)
+        if job is self._job:
+            self._result = (key, result)
+            self._rerender_task = asyncio.create_task(self._rerender())
+
+    async def _rerender(self):
+        async with reactive.lock():
+            self._ready.set(self._ready.get() + 1)
+            await reactive.flush()
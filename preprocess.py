@@ -0,0 +1,225 @@
+import os
+import sys
+
+from indicators import WORLD_BANK_INDICATORS, load_cube, read_indicators
+from rollups import GROUPS_FILE, aggregate_choices, read_country_groups, with_rollups
+
+###############################################################################
+# Source files (relative to the data directory)
+# Our World in Data files; the World Bank indicator files are registered in
+# indicators.py. GROUPS_FILE maps countries to the regions and income groups
+# rolled up in the deaths / new cases / ART panel (see rollups.py).
+OWID_FILES = [
+    "deaths-and-new-cases-of-hiv.csv",
+    "antiretroviral-therapy-coverage-among-people-living-with-hiv.csv",
+]
+
+
+def source_files():
+    return OWID_FILES + list(WORLD_BANK_INDICATORS.values()) + [GROUPS_FILE]
+
+
+# Frames and lists produced by build_datasets()
+FRAMES = [
+    "df_deaths_new_cases",
+    "df_prevalence_male_reshaped",
+    "df_prevalence_female_reshaped",
+    "df_children_newly_infected_reshaped",
+    "df_adult_newly_infected_reshaped",
+]
+# The LISTS are all the UI needs (choices and slider bounds); snapshots keep
+# them in their manifest so the UI can be served without loading any frame.
+LISTS = ["countries", "year_range", "years_scatter", "countries_list", "available_years", "aggregates"]
+# IndicatorCube of the World Bank files
+CUBE = "cube"
+
+
+# Compact ingestion reads only the columns the app uses, with categorical
+# Country/Code, int16 Year and float32 metrics. HIV_COMPACT_INGEST=0 restores
+# the default pandas dtypes (object strings, int64, float64).
+COMPACT_INGEST = os.environ.get("HIV_COMPACT_INGEST", "1") != "0"
+
+DEATHS_COLUMNS = {
+    'Entity': 'category',
+    'Code': 'category',
+    'Year': 'int16',
+    'Deaths - HIV/AIDS - Sex: Both - Age: All Ages (Number)': 'float32',
+    'Incidence - HIV/AIDS - Sex: Both - Age: All Ages (Number)': 'float32',
+    'Prevalence - HIV/AIDS - Sex: Both - Age: All Ages (Number)': 'float32',
+}
+ART_COLUMNS = {
+    'Entity': 'category',
+    'Code': 'category',
+    'Year': 'int16',
+    'Antiretroviral therapy coverage (% of people living with HIV)': 'float32',
+}
+
+
+def read_owid(path, columns, compact=COMPACT_INGEST):
+    # pandas is imported where it is used, so a fast start can serve the UI
+    # before it is loaded (see app.py)
+    import pandas as pd
+
+    if compact:
+        return pd.read_csv(path, usecols=list(columns), dtype=columns)
+    return pd.read_csv(path)
+
+
+def build_deaths_new_cases(data_dir, compact=COMPACT_INGEST):
+    """The merged panel with the region and income group rows (see rollups.py)."""
+    def path(name):
+        return os.path.join(data_dir, name)
+
+    ###########################################################################
+    # Load datasets
+    df_deaths_new_cases = read_owid(path("deaths-and-new-cases-of-hiv.csv"), DEATHS_COLUMNS, compact)
+    df_art = read_owid(path("antiretroviral-therapy-coverage-among-people-living-with-hiv.csv"), ART_COLUMNS, compact)
+
+    ###########################################################################
+    # Preprocessing
+    # Deaths and new cases dataset
+    df_deaths_new_cases = df_deaths_new_cases[df_deaths_new_cases['Code'].notna()]
+    df_deaths_new_cases = df_deaths_new_cases.rename(columns={
+        'Entity': 'Country',
+        'Incidence - HIV/AIDS - Sex: Both - Age: All Ages (Number)': 'New Cases',
+        'Deaths - HIV/AIDS - Sex: Both - Age: All Ages (Number)': 'Deaths',
+        # People living with HIV: the weights of the groups' ART coverage
+        'Prevalence - HIV/AIDS - Sex: Both - Age: All Ages (Number)': 'PLHIV',
+    })
+
+    # ART dataset
+    df_art = df_art[df_art['Code'].notna()]
+    df_art = df_art.rename(columns={
+        'Entity': 'Country',
+        'Antiretroviral therapy coverage (% of people living with HIV)': 'ART',
+    })
+
+    # Merge data set for part 1
+    df_deaths_new_cases = df_deaths_new_cases.merge(
+        df_art[['Country', 'Code', 'Year', 'ART']],
+        on=['Country', 'Code', 'Year'],
+        how='left'
+    )
+
+    # Regions and income groups, weighting ART by the countries that report it
+    df_deaths_new_cases = with_rollups(df_deaths_new_cases, read_country_groups(data_dir))
+
+    # Fill missing ART values with 0
+    df_deaths_new_cases['ART'] = df_deaths_new_cases['ART'].fillna(0)
+
+    if compact:
+        # Merging on categoricals with different categories yields object keys
+        for col in ['Country', 'Code']:
+            df_deaths_new_cases[col] = df_deaths_new_cases[col].astype('category')
+
+    # Stored in CountryIndex order so workers can use the columns as they are
+    return df_deaths_new_cases.sort_values(['Country', 'Year'], kind='stable', ignore_index=True)
+
+
+def build_cube(data_dir, datasets, changed, compact=COMPACT_INGEST):
+    """The indicator cube, re-reading only the `changed` indicator files if there is one."""
+    # World Bank indicators (prevalence by gender, children/adult newly
+    # infected, ART coverage) share one dense country x year cube
+    if CUBE not in datasets:
+        return load_cube(data_dir, compact=compact)
+    indicators = {
+        name: filename for name, filename in WORLD_BANK_INDICATORS.items() if filename in changed
+    }
+    return datasets[CUBE].with_indicators(read_indicators(data_dir, indicators, compact))
+
+
+def _long(indicator, value_name):
+    # Long frames (Country, Code, Year, value) of the cube indicators
+    return lambda datasets, compact: datasets[CUBE].to_long(indicator, value_name, compact)
+
+
+def _available_years(datasets, compact):
+    years_children = datasets["df_children_newly_infected_reshaped"]['Year'].unique()
+    years_adult = datasets["df_adult_newly_infected_reshaped"]['Year'].unique()
+    return sorted(int(year) for year in set(years_children).union(years_adult))
+
+
+# Every name in FRAMES and LISTS (besides the deaths frame and the cube):
+# (inputs, build(datasets, compact)). Inputs are source files or names built
+# earlier in this dict; a name is rebuilt when any of its inputs changes.
+DERIVED = {
+    "df_prevalence_male_reshaped": (
+        [WORLD_BANK_INDICATORS["prevalence_male"]], _long("prevalence_male", 'Prevalence_male')),
+    "df_prevalence_female_reshaped": (
+        [WORLD_BANK_INDICATORS["prevalence_female"]], _long("prevalence_female", 'Prevalence_female')),
+    "df_children_newly_infected_reshaped": (
+        [WORLD_BANK_INDICATORS["children_newly_infected"]], _long("children_newly_infected", 'Children')),
+    "df_adult_newly_infected_reshaped": (
+        [WORLD_BANK_INDICATORS["adult_newly_infected"]], _long("adult_newly_infected", 'Adult')),
+    # List all countries, years
+    "countries": (
+        ["df_deaths_new_cases"], lambda datasets, compact: sorted(datasets["df_deaths_new_cases"]['Country'].unique())),
+    # [first, last] year of the line charts' sliders
+    "year_range": (
+        ["df_deaths_new_cases"],
+        lambda datasets, compact: [int(datasets["df_deaths_new_cases"]['Year'].min()),
+                                   int(datasets["df_deaths_new_cases"]['Year'].max())]),
+    "years_scatter": (
+        ["df_prevalence_male_reshaped"],
+        lambda datasets, compact: [str(year) for year in sorted(datasets["df_prevalence_male_reshaped"]['Year'].unique())]),
+    "countries_list": (
+        ["df_prevalence_male_reshaped"],
+        lambda datasets, compact: sorted(datasets["df_prevalence_male_reshaped"]['Country'].unique())),
+    "available_years": (
+        ["df_children_newly_infected_reshaped", "df_adult_newly_infected_reshaped"], _available_years),
+    # [heading, name] of the region and income group rows of the panel
+    "aggregates": (
+        ["df_deaths_new_cases"], lambda datasets, compact: aggregate_choices(datasets["df_deaths_new_cases"])),
+}
+
+
+def affected(changed):
+    """Names in FRAMES, LISTS and CUBE that depend on the `changed` source files."""
+    changed = set(changed)
+    names = set()
+    if changed & {*OWID_FILES, GROUPS_FILE}:
+        names.add("df_deaths_new_cases")
+    if changed & set(WORLD_BANK_INDICATORS.values()):
+        names.add(CUBE)
+    for name, (inputs, _) in DERIVED.items():
+        if changed.intersection(inputs) or names.intersection(inputs):
+            names.add(name)
+    return names
+
+
+def rebuild_datasets(datasets, changed, data_dir="data", compact=COMPACT_INGEST):
+    """Rebuild only what depends on the `changed` source files.
+
+    Returns a new dict (`datasets` itself is left untouched) and the set of
+    rebuilt names. Unchanged frames and lists are shared with `datasets`.
+    """
+    names = affected(changed)
+    datasets = dict(datasets)
+    if "df_deaths_new_cases" in names:
+        datasets["df_deaths_new_cases"] = build_deaths_new_cases(data_dir, compact)
+    if CUBE in names:
+        datasets[CUBE] = build_cube(data_dir, datasets, changed, compact)
+    for name, (_, build) in DERIVED.items():
+        if name in names:
+            datasets[name] = build(datasets, compact)
+    return datasets, names
+
+
+def build_datasets(data_dir="data", compact=COMPACT_INGEST):
+    """Load the raw CSVs and run the full preprocessing pipeline.
+
+    Returns a dict with every name in FRAMES and LISTS, plus CUBE.
+    """
+    datasets, _ = rebuild_datasets({}, source_files(), data_dir, compact)
+    return datasets
+
+
+def memory_report(datasets):
+    """Bytes held by every frame (memory_usage(deep=True)) and by the cube."""
+    report = {name: int(datasets[name].memory_usage(deep=True).sum()) for name in FRAMES}
+    cube = datasets[CUBE]
+    report[CUBE] = int(sum(
+        arr.nbytes for arr in (cube.values, cube.years, cube.codes, cube.countries)
+    ) + sum(sys.getsizeof(s) for s in (*cube.codes, *cube.countries)))
+    report["total"] = sum(report.values())
+    return report
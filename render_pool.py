@@ -0,0 +1,145 @@
+import asyncio
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+###############################################################################
+# Off-event-loop rendering pool
+#
+# Figure building and rasterization run in a thread or process pool so the
+# event loop keeps serving websocket traffic while they work. Jobs are keyed
+# by a token (session id, output name): submitting a new job for a token
+# cancels the previous one if it hasn't started yet, and its result is never
+# delivered; running() tells whether a token's job is executing.
+#
+# At most `max_pending` jobs are handed to the executor at once. Jobs beyond
+# that wait for a free slot in their own task: submit() itself never waits,
+# since it is called during a reactive flush, which holds the lock every
+# session shares.
+
+RENDER_POOL = os.environ.get("HIV_RENDER_POOL", "thread")  # "thread" or "process"
+RENDER_WORKERS = int(os.environ.get("HIV_RENDER_WORKERS", "4"))
+RENDER_QUEUE = int(os.environ.get("HIV_RENDER_QUEUE", "32"))
+
+
+def exit_with_parent(parent_pid):
+    """Process pool initializer: exit when the server process goes away.
+
+    A worker that is still starting up when the server exits never gets the
+    pool's shutdown sentinel, so it also watches its parent process.
+    """
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+        os._exit(0)
+
+    threading.Thread(target=watch, daemon=True).start()
+
+
+class RenderPool:
+    def __init__(self, kind=RENDER_POOL, max_workers=RENDER_WORKERS, max_pending=RENDER_QUEUE):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown render pool kind: {kind!r}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._slots = None
+        self._pending = {}
+        self._work = {}
+        self.submitted = 0
+        self.completed = 0
+        self.superseded = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == "process":
+                # Job functions and arguments must be picklable in this mode.
+                # spawn rather than fork: the server process already runs threads.
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=exit_with_parent,
+                    initargs=(os.getpid(),),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="render"
+                )
+            atexit.register(self.shutdown)
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def submit(self, token, fn, *args):
+        """Schedule fn(*args) in the pool and return an asyncio future."""
+        previous = self._pending.pop(token, None)
+        if previous is not None and not previous.done():
+            previous.cancel()
+            self.superseded += 1
+        self._work.pop(token, None)
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        job = asyncio.ensure_future(self._execute(token, fn, args))
+        self.submitted += 1
+        self._pending[token] = job
+        job.add_done_callback(lambda job: self._finished(token, job))
+        return job
+
+    async def _execute(self, token, fn, args):
+        await self._slots.acquire()
+        loop = asyncio.get_running_loop()
+        try:
+            work = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is held until the work itself ends, even if the job was
+        # cancelled while it was already running.
+        work.add_done_callback(lambda _: loop.call_soon_threadsafe(self._slots.release))
+        if self._pending.get(token) is asyncio.current_task():
+            self._work[token] = work
+        return await asyncio.wrap_future(work)
+
+    def _finished(self, token, job):
+        if not job.cancelled():
+            self.completed += 1
+        if self._pending.get(token) is job:
+            del self._pending[token]
+            self._work.pop(token, None)
+
+    async def run(self, token, fn, *args):
+        """Run fn(*args) in the pool and wait for its result."""
+        return await self.submit(token, fn, *args)
+
+    def running(self, token):
+        """Whether the latest job for `token` has started and not yet ended."""
+        work = self._work.get(token)
+        return work is not None and work.running()
+
+    def cancel_session(self, session_id):
+        for token in [t for t in self._pending if t[0] == session_id]:
+            self._pending.pop(token).cancel()
+            self._work.pop(token, None)
+
+    def stats(self):
+        return {
+            "kind": self.kind,
+            "workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": len(self._pending),
+            "executing": len(self._work),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "superseded": self.superseded,
+        }
+
+
+render_pool = RenderPool()
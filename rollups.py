@@ -0,0 +1,129 @@
+import os
+
+import numpy as np
+
+###############################################################################
+# Regional and income group rollups of the deaths / new cases / ART panel
+#
+# The Our World in Data panel has countries and a "World" row, but no
+# regional totals. build_deaths_new_cases() appends one row per year for
+# every World Bank region and income group, computed from the country rows
+# with one group-by over the country -> group table in
+# data/country-groups.csv (the World Bank classification, FY2025). The
+# aggregates then behave as extra entities: CountryIndex, the backends and
+# the data API serve them like any country, and the `country` selector lists
+# them under their own headings.
+#
+#   New Cases, Deaths, PLHIV  sums over the group's countries
+#   ART                       coverage weighted by people living with HIV
+#                             (PLHIV), over the countries that report it
+#
+# The panel's own "World" row stays the global aggregate. The World Bank
+# files (prevalence, newly infected children and adults) already ship the
+# same regional, income and global aggregates, computed by the World Bank
+# with population weights this repository doesn't have, so those are used
+# as they are.
+#
+# A reload recomputes every group. The group-by takes about as long as
+# finding the countries whose rows changed would, since the whole panel is
+# read again either way (see benchmarks/bench_rollups.py).
+
+GROUPS_FILE = "country-groups.csv"
+
+# Group code -> name, as in the World Bank files
+REGIONS = {
+    "EAS": "East Asia & Pacific",
+    "ECS": "Europe & Central Asia",
+    "LCN": "Latin America & Caribbean",
+    "MEA": "Middle East & North Africa",
+    "NAC": "North America",
+    "SAS": "South Asia",
+    "SSF": "Sub-Saharan Africa",
+}
+INCOME_GROUPS = {
+    "HIC": "High income",
+    "UMC": "Upper middle income",
+    "LMC": "Lower middle income",
+    "LIC": "Low income",
+}
+GROUPS = {**REGIONS, **INCOME_GROUPS}
+# Headings of the `country` selector
+GROUP_KINDS = {"Regions": REGIONS, "Income groups": INCOME_GROUPS}
+
+SUMS = ["New Cases", "Deaths", "PLHIV"]
+
+
+def read_country_groups(data_dir="data"):
+    """Long (Code, Group) frame: every country once per group it belongs to."""
+    import pandas as pd
+
+    table = pd.read_csv(
+        os.path.join(data_dir, GROUPS_FILE), dtype=str, keep_default_na=False
+    )
+    membership = pd.concat([
+        table[["Code", "Region"]].rename(columns={"Region": "Group"}),
+        table[["Code", "Income group"]].rename(columns={"Income group": "Group"}),
+    ], ignore_index=True)
+    # Unclassified countries (e.g. no income group) have an empty cell
+    return membership[membership["Group"].isin(list(GROUPS))].reset_index(drop=True)
+
+
+def group_rows(panel, membership):
+    """The aggregate rows of every group for `panel`'s country rows.
+
+    `panel` has the Country, Code, Year, SUMS and ART columns, with ART
+    missing (not yet filled with 0) where a country doesn't report it.
+    """
+    import pandas as pd
+
+    columns = ["Code", "Year", *SUMS, "ART"]
+    rows = membership.merge(panel[columns].astype({"Code": str}), on="Code")
+    art = rows["ART"].to_numpy(dtype=np.float64)
+    plhiv = rows["PLHIV"].to_numpy(dtype=np.float64)
+    reported = ~np.isnan(art) & ~np.isnan(plhiv)
+    rows["_weight"] = np.where(reported, plhiv, 0.0)
+    rows["_weighted"] = np.where(reported, art * plhiv, 0.0)
+
+    grouped = rows.groupby(["Group", "Year"], sort=True)
+    totals = grouped[SUMS].sum(min_count=1)
+    totals[["_weight", "_weighted"]] = grouped[["_weight", "_weighted"]].sum()
+    totals = totals.reset_index()
+    weight = totals["_weight"].to_numpy()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        totals["ART"] = np.where(weight > 0, totals["_weighted"].to_numpy() / weight, np.nan)
+
+    out = pd.DataFrame({
+        "Country": totals["Group"].map(GROUPS),
+        "Code": totals["Group"],
+        "Year": totals["Year"].astype(panel["Year"].dtype),
+    })
+    for column in panel.columns:
+        if column not in out:
+            out[column] = totals[column].astype(panel[column].dtype)
+    return out[list(panel.columns)]
+
+
+def with_rollups(panel, membership):
+    """`panel` (country rows, ART not filled yet) with every group's rows appended."""
+    import pandas as pd
+
+    return pd.concat([panel, group_rows(panel, membership)], ignore_index=True)
+
+
+def aggregate_choices(frame):
+    """[heading, name] of the aggregates in `frame`, in GROUP_KINDS order."""
+    present = set(frame["Code"].astype(str).unique())
+    return [
+        [kind, name] for kind, groups in GROUP_KINDS.items()
+        for code, name in groups.items() if code in present
+    ]
+
+
+def country_choices(countries, aggregates):
+    """Choices of the `country` selector: the countries, then a heading per group kind."""
+    names = {name for _, name in aggregates}
+    # Option groups are {value: label} dicts
+    choices = {"Countries": {country: country for country in countries if country not in names}}
+    for kind, name in aggregates:
+        choices.setdefault(kind, {})[name] = name
+    return choices
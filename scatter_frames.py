@@ -0,0 +1,259 @@
+import atexit
+import io
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+
+from figure_templates import agg_figure, figure_template
+from figures import hide_spines
+from indicators import YearMap
+from render_pool import exit_with_parent
+
+###############################################################################
+# Pre-rendered frames for the gender_scatter animation
+#
+# The scatter of every country for one year doesn't depend on the highlighted
+# country, so the base image for every year is rendered ahead of time in a
+# process pool (on first use of a given output size). Playback then only
+# draws the highlighted point, its annotation and the legend on top of the
+# stored frame, in a reused overlay figure (see figure_templates.py).
+#
+# Output sizes are rounded to HIV_SCATTER_FRAME_STEP pixels and the pixel
+# ratio to 1 or 2, so resizing the browser a little reuses the frames of a
+# nearby size (the image is scaled to the output) instead of rendering every
+# year again. Frames are kept PNG-encoded, and the frame sets stay within
+# HIV_SCATTER_FRAME_MB, least recently used first out.
+
+SCATTER_WORKERS = int(os.environ.get("HIV_SCATTER_WORKERS", min(4, os.cpu_count() or 1)))
+SCATTER_FRAME_STEP = int(os.environ.get("HIV_SCATTER_FRAME_STEP", "100"))
+SCATTER_FRAME_MB = float(os.environ.get("HIV_SCATTER_FRAME_MB", "32"))
+
+Frame = namedtuple("Frame", ["png", "dpi", "axes_bounds", "xlim", "ylim", "legend_anchor"])
+
+
+def frame_size(width, height, pixelratio, step=SCATTER_FRAME_STEP):
+    """The (width, height, pixel ratio) bucket frames for an output size are rendered at."""
+    def bucket(pixels):
+        return max(step, round(pixels / step) * step)
+
+    return bucket(width), bucket(height), 1 if pixelratio <= 1 else 2
+
+
+def year_points(source):
+    """Map year -> (countries, male, female) for countries with both prevalences.
+
+    `source` is the IndicatorCube or a data backend (see backends.py). The
+    cube keeps both indicators on the same country axis, so pairing male and
+    female values is a mask over two column views rather than a merge.
+    """
+    names = ("prevalence_male", "prevalence_female")
+
+    def points(year):
+        _, countries, male, female = source.aligned(year, *names)
+        return countries, male, female
+
+    return YearMap(source.years_with_data(*names), points)
+
+
+def render_base_frame(year, male, female, width, height, pixelratio):
+    """Render the scatter for one year without the highlighted country."""
+    fig = agg_figure()
+    dpi = fig.get_dpi() * pixelratio
+    fig.set_size_inches(width * pixelratio / dpi, height * pixelratio / dpi)
+    fig.set_dpi(dpi)
+    fig.set_layout_engine(layout="tight")
+
+    ax = fig.add_subplot()
+    ax.scatter(male, female, s=30, alpha=0.7, label="Countries")
+    ax.set_title(f"HIV Prevalence by Gender in {year}")
+    ax.set_xlabel("Male Prevalence")
+    ax.set_ylabel("Female Prevalence")
+    ax.grid(True)
+    hide_spines(ax)
+
+    # Let matplotlib pick the legend position against the data, then leave
+    # the legend itself to the overlay (its entries depend on the highlight).
+    legend = ax.legend()
+    fig.canvas.draw()
+    box = legend.get_window_extent().transformed(ax.transAxes.inverted())
+    legend.remove()
+    fig.set_layout_engine(None)
+    fig.canvas.draw()
+
+    from matplotlib.image import imsave
+
+    with io.BytesIO() as buf:
+        imsave(buf, np.asarray(fig.canvas.buffer_rgba()), format="png")
+        png = buf.getvalue()
+    return Frame(
+        png=png,
+        dpi=dpi,
+        axes_bounds=tuple(ax.get_position().bounds),
+        xlim=ax.get_xlim(),
+        ylim=ax.get_ylim(),
+        legend_anchor=(box.x0, box.y1),
+    )
+
+
+def _overlay_template():
+    fig = agg_figure()
+    image = fig.figimage(np.zeros((1, 1, 4), dtype=np.uint8), 0, 0, origin="upper")
+    ax = fig.add_axes((0, 0, 1, 1), zorder=1)
+    ax.set_axis_off()
+    countries = ax.scatter([], [], s=30, alpha=0.7, color="C0", label="Countries")
+    highlight = ax.scatter([], [], color="red", s=100)
+    annotation = ax.annotate(
+        "", (0, 0), textcoords="offset points", xytext=(-10, 20), fontsize=12, color='red'
+    )
+    return SimpleNamespace(
+        fig=fig, image=image, ax=ax, countries=countries, highlight=highlight, annotation=annotation
+    )
+
+
+def compose_frame(frame, highlight=None, point=None):
+    """Draw the highlighted country over a base frame and encode it as PNG."""
+    t = figure_template("scatter_overlay", _overlay_template)
+    fig, ax = t.fig, t.ax
+    if getattr(t, "png", None) is not frame.png:
+        # Decoded once per base frame, not again for each highlighted country
+        from matplotlib.image import imread
+
+        with io.BytesIO(frame.png) as buf:
+            t.image.set_data(imread(buf, format="png"))
+        t.png = frame.png
+    h, w = t.image.get_array().shape[:2]
+    fig.set_dpi(frame.dpi)
+    fig.set_size_inches(w / frame.dpi, h / frame.dpi)
+
+    ax.set_position(frame.axes_bounds)
+    ax.set_xlim(frame.xlim)
+    ax.set_ylim(frame.ylim)
+
+    handles = [t.countries]
+    if point is not None:
+        x_val, y_val = point
+        t.highlight.set_offsets([[x_val, y_val]])
+        t.highlight.set_label(highlight)
+        handles.append(t.highlight)
+        # The base layout can't make room for the label, so keep it inside
+        # the axes for points near the right edge.
+        near_right = x_val > frame.xlim[0] + 0.7 * (frame.xlim[1] - frame.xlim[0])
+        t.annotation.set_text(f"({x_val:.2f}, {y_val:.2f})")
+        t.annotation.xy = (x_val, y_val)
+        t.annotation.xyann = (10 if near_right else -10, 20)  # offset to avoid overlapping the point
+        t.annotation.set_horizontalalignment('right' if near_right else 'left')
+    t.highlight.set_visible(point is not None)
+    t.annotation.set_visible(point is not None)
+    ax.legend(handles=handles, loc="upper left", bbox_to_anchor=frame.legend_anchor)
+
+    with io.BytesIO() as buf:
+        fig.savefig(buf, format="png", dpi=frame.dpi)
+        return buf.getvalue()
+
+
+class ScatterFrames:
+    """Per-size sets of pre-rendered base frames, one per year.
+
+    `points` is called for the current year_points() map whenever it is
+    needed, so the frames follow the data store's snapshot. The sets are
+    bounded by `max_bytes` of rendered frames in total.
+    """
+
+    def __init__(self, points, version, max_bytes=int(SCATTER_FRAME_MB * 1024 * 1024)):
+        # Reentrant: a done callback can run in the thread that adds it
+        self._lock = threading.RLock()
+        self._pool = None
+        self._frames = OrderedDict()
+        self.max_bytes = max_bytes
+        self._points = points
+        self.version = version
+
+    @property
+    def points(self):
+        return self._points()
+
+    def invalidate(self, version):
+        """Drop every frame set; used when the scatter data changes."""
+        with self._lock:
+            for futures in self._frames.values():
+                for future in futures.values():
+                    future.cancel()
+            self._frames.clear()
+            self.version = version
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=SCATTER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=exit_with_parent,
+                initargs=(os.getpid(),),
+            )
+            atexit.register(self.shutdown)
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _frame_set(self, width, height, pixelratio):
+        key = (self.version, width, height, pixelratio)
+        with self._lock:
+            futures = self._frames.get(key)
+            if futures is not None:
+                self._frames.move_to_end(key)
+                return futures
+            pool = self._executor()
+            futures = {
+                year: pool.submit(render_base_frame, year, male, female, width, height, pixelratio)
+                for year, (_, male, female) in self.points.items()
+            }
+            self._frames[key] = futures
+            for future in futures.values():
+                future.add_done_callback(lambda _: self._trim())
+            return futures
+
+    def _trim(self):
+        """Evict the least recently used sets while the frames exceed max_bytes."""
+        with self._lock:
+            while len(self._frames) > 1 and self.nbytes() > self.max_bytes:
+                _, evicted = self._frames.popitem(last=False)
+                for future in evicted.values():
+                    future.cancel()
+
+    def nbytes(self):
+        """Size of the rendered frames of every set."""
+        with self._lock:
+            return sum(
+                len(future.result().png)
+                for futures in self._frames.values()
+                for future in futures.values()
+                if future.done() and not future.cancelled() and future.exception() is None
+            )
+
+    def base_frame(self, year, width, height, pixelratio):
+        """The stored base frame for `year`, or None if it isn't ready yet.
+
+        The first call for a given size bucket (see frame_size()) schedules
+        every year's base frame.
+        """
+        future = self._frame_set(*frame_size(width, height, pixelratio)).get(year)
+        if future is None or not future.done() or future.cancelled() or future.exception():
+            return None
+        return future.result()
+
+    def highlight_point(self, year, highlight):
+        """(male, female) prevalence of `highlight` in `year`, or None."""
+        if year not in self.points:
+            return None
+        countries, male, female = self.points[year]
+        matches = (countries == highlight).nonzero()[0]
+        if not len(matches):
+            return None
+        return (male[matches[0]], female[matches[0]])
@@ -0,0 +1,46 @@
+"""Run the dashboard with several uvicorn workers sharing one dataset snapshot.
+
+The launcher loads (and if needed rebuilds) the snapshot once, then starts
+the workers with HIV_SNAPSHOT_PATH pointing at it and HIV_DATA_DIR at the
+CSVs it was built from. Each worker memory maps the same files instead of
+parsing its own copy of the data, so the dataset pages are shared between
+workers through the OS page cache. Put the snapshot directory on a tmpfs
+such as /dev/shm to keep it in shared memory rather than on disk:
+
+    python serve.py --workers 4 --port 8000 --snapshot-dir /dev/shm/hiv-dashboard
+"""
+import argparse
+import os
+import sys
+
+import uvicorn
+
+from snapshot import SNAPSHOT_DIR, open_datasets
+
+
+def publish_snapshot(data_dir, snapshot_dir):
+    """Make sure a valid snapshot of `data_dir` exists and return its path."""
+    datasets = open_datasets(data_dir, snapshot_dir)
+    path = os.path.abspath(os.path.join(snapshot_dir, datasets["version"]))
+    if not os.path.exists(os.path.join(path, "manifest.json")):
+        sys.exit(f"Could not write a snapshot to {snapshot_dir}")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--snapshot-dir", default=SNAPSHOT_DIR)
+    args = parser.parse_args()
+
+    os.environ["HIV_SNAPSHOT_PATH"] = publish_snapshot(args.data_dir, args.snapshot_dir)
+    # The workers watch (and reload from) the same CSVs the snapshot was built from
+    os.environ["HIV_DATA_DIR"] = os.path.abspath(args.data_dir)
+    uvicorn.run("app:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
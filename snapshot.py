@@ -0,0 +1,349 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections.abc import Mapping
+
+import numpy as np
+
+from indicators import IndicatorCube
+from preprocess import COMPACT_INGEST, CUBE, FRAMES, LISTS, affected, build_datasets, rebuild_datasets, source_files
+
+###############################################################################
+# Preprocessed dataset snapshots
+#
+# A snapshot is a directory with one .npy file per column of every frame in
+# FRAMES, one per array of the indicator cube, plus a manifest.json holding
+# the column layout, the cube's indicator names and the LISTS values.
+# Categorical columns are stored as their integer codes plus a categories file.
+# Snapshots are keyed on the content hash of the source CSVs, so editing any
+# file in data/ makes the snapshot stale and it is rebuilt on the next start.
+# Valid snapshots are opened with np.load(mmap_mode="r"), so the numeric
+# columns are paged in from the OS cache instead of being parsed again. Each
+# frame and the cube are only opened on first access, while the LISTS (all
+# the UI needs: choices and slider bounds) are read with the manifest.
+#
+# Columns and cube arrays stay views over the mapped files, so every process
+# that opens the same snapshot shares one copy of the data in the page cache.
+# serve.py relies on this: the launcher publishes the snapshot once and
+# points its uvicorn workers at it through HIV_SNAPSHOT_PATH. The manifest
+# records the data directory the snapshot was built from, and a worker
+# refuses to attach to one built from other CSVs than those in its own
+# HIV_DATA_DIR, which its reloads would otherwise replace.
+#
+# Since frames are mapped on first access, a process can still need the
+# files of a snapshot that another one has replaced. When a process opens
+# the datasets at startup (the launcher, with serve.py), the
+# HIV_SNAPSHOT_KEEP most recently used snapshots are kept. After a reload,
+# the new and the previous snapshot are kept, and older ones are removed
+# HIV_SNAPSHOT_GRACE seconds after they were replaced: by then every worker
+# watching the same files has reloaded past them, and a reload loads its
+# snapshot in full (see DataStore.reload). A launcher's snapshot is always
+# kept, for the workers it restarts.
+
+SNAPSHOT_DIR = os.environ.get("HIV_SNAPSHOT_DIR", ".cache/snapshots")
+# Snapshot published by a launcher; workers attach to it as is
+SNAPSHOT_PATH = os.environ.get("HIV_SNAPSHOT_PATH")
+SNAPSHOT_KEEP = int(os.environ.get("HIV_SNAPSHOT_KEEP", "3"))
+SNAPSHOT_GRACE = float(os.environ.get("HIV_SNAPSHOT_GRACE", "300"))
+SNAPSHOT_FORMAT = 5
+
+
+def publish_dir():
+    """Where this process publishes snapshots: next to the attached one, if any."""
+    return os.path.dirname(os.path.normpath(SNAPSHOT_PATH)) if SNAPSHOT_PATH else SNAPSHOT_DIR
+
+
+def source_hash(data_dir="data", compact=COMPACT_INGEST):
+    h = hashlib.sha256()
+    h.update(f"format={SNAPSHOT_FORMAT};compact={compact}".encode())
+    for name in source_files():
+        h.update(name.encode())
+        with open(os.path.join(data_dir, name), "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+def _column_to_array(series):
+    if series.dtype == object:
+        # Fixed-width unicode so the column can be memory mapped
+        return series.to_numpy().astype(str)
+    return series.to_numpy()
+
+
+def save_snapshot(datasets, path, data_dir=None):
+    import pandas as pd
+
+    # Write into a temporary directory and rename it into place so a
+    # concurrent worker never sees a half-written snapshot.
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+    manifest = {"format": SNAPSHOT_FORMAT, "frames": {}, "ranges": {}, "lists": {}}
+    if data_dir is not None:
+        manifest["data_dir"] = os.path.abspath(data_dir)
+    try:
+        for name in FRAMES:
+            df = datasets[name]
+            if isinstance(df.index, pd.RangeIndex):
+                manifest["ranges"][name] = [df.index.start, df.index.stop, df.index.step]
+            else:
+                np.save(os.path.join(tmp, f"{name}.__index__.npy"), df.index.to_numpy())
+            columns = []
+            for i, col in enumerate(df.columns):
+                series = df[col]
+                if isinstance(series.dtype, pd.CategoricalDtype):
+                    np.save(os.path.join(tmp, f"{name}.{i}.npy"), series.cat.codes.to_numpy())
+                    np.save(
+                        os.path.join(tmp, f"{name}.{i}.categories.npy"),
+                        series.cat.categories.to_numpy().astype(str),
+                    )
+                    columns.append([col, "category"])
+                else:
+                    np.save(os.path.join(tmp, f"{name}.{i}.npy"), _column_to_array(series))
+                    columns.append([col, "array"])
+            manifest["frames"][name] = columns
+        cube = datasets[CUBE]
+        np.save(os.path.join(tmp, "cube.values.npy"), cube.values)
+        np.save(os.path.join(tmp, "cube.years.npy"), cube.years)
+        np.save(os.path.join(tmp, "cube.codes.npy"), cube.codes.astype(str))
+        np.save(os.path.join(tmp, "cube.countries.npy"), cube.countries.astype(str))
+        manifest["cube"] = cube.names
+        for name in LISTS:
+            manifest["lists"][name] = [
+                v.item() if isinstance(v, np.generic) else v for v in datasets[name]
+            ]
+        with open(os.path.join(tmp, "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # Another worker published the same snapshot first
+            shutil.rmtree(tmp, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+class SnapshotDatasets(Mapping):
+    """The datasets of one snapshot, each frame and the cube loaded on first access.
+
+    The lists come with the manifest, so they (and the UI built from them)
+    don't need pandas or any column file. Loading is thread-safe and happens
+    once per name.
+    """
+
+    def __init__(self, path, manifest, version=None, loaded=None):
+        self._path = path
+        self._manifest = manifest
+        # Absolute path of the CSVs it was built from (None for older snapshots)
+        self.data_dir = manifest.get("data_dir")
+        self._names = [*manifest["frames"], CUBE, *manifest["lists"]]
+        self._values = {**manifest["lists"], **(loaded or {})}
+        if version is not None:
+            self._names.append("version")
+            self._values["version"] = version
+        self._lock = threading.Lock()
+        # Frames share their Country/Code categories; build each dtype only once
+        self._dtypes = {}
+
+    def __getitem__(self, name):
+        value = self._values.get(name)
+        if value is not None:
+            return value
+        if name not in self._names:
+            raise KeyError(name)
+        with self._lock:
+            if self._values.get(name) is None:
+                self._values[name] = self._load_cube() if name == CUBE else self._load_frame(name)
+            return self._values[name]
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def _load_frame(self, name):
+        import pandas as pd
+
+        path, manifest = self._path, self._manifest
+        if name in manifest["ranges"]:
+            index = pd.RangeIndex(*manifest["ranges"][name])
+        else:
+            index = pd.Index(np.asarray(
+                np.load(os.path.join(path, f"{name}.__index__.npy"), mmap_mode="r")
+            ))
+        data = {}
+        for i, (col, kind) in enumerate(manifest["frames"][name]):
+            arr = np.load(os.path.join(path, f"{name}.{i}.npy"), mmap_mode="r")
+            if kind == "category":
+                categories = np.load(os.path.join(path, f"{name}.{i}.categories.npy"))
+                key = (categories.dtype.str, categories.tobytes())
+                if key not in self._dtypes:
+                    self._dtypes[key] = pd.CategoricalDtype(categories.astype(object))
+                data[col] = pd.Categorical.from_codes(np.asarray(arr), dtype=self._dtypes[key])
+            else:
+                data[col] = arr.astype(object) if arr.dtype.kind == "U" else np.asarray(arr)
+        return pd.DataFrame(data, index=index, copy=False)
+
+    def _load_cube(self):
+        def cube_array(name):
+            return np.asarray(np.load(os.path.join(self._path, f"cube.{name}.npy"), mmap_mode="r"))
+
+        return IndicatorCube(
+            self._manifest["cube"],
+            cube_array("codes").astype(object),
+            cube_array("countries").astype(object),
+            cube_array("years"),
+            cube_array("values"),
+        )
+
+
+def open_snapshot(path, version=None, loaded=None):
+    """SnapshotDatasets of the snapshot at `path`, or None if its format is outdated."""
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        return None
+    return SnapshotDatasets(path, manifest, version, loaded)
+
+
+def load_snapshot(path):
+    """Every frame, list and the cube of a snapshot, or None if its format is outdated."""
+    datasets = open_snapshot(path)
+    if datasets is None:
+        return None
+    return dict(datasets)
+
+
+def _remove_stale(snapshot_dir, keep, retain=SNAPSHOT_KEEP, grace=0.0):
+    """Remove all but the `retain` most recently used snapshots (and those in `keep`).
+
+    A snapshot is also kept until `grace` seconds after a more recently used
+    one was last switched to, i.e. after it was replaced.
+    """
+    # A launcher's snapshot is kept: workers it restarts still attach to it
+    keep = {*keep, os.path.basename(os.path.normpath(SNAPSHOT_PATH or ""))}
+    cutoff = time.time() - grace
+
+    def last_used(entry):
+        try:
+            return os.path.getmtime(os.path.join(snapshot_dir, entry, "manifest.json"))
+        except OSError:
+            return 0.0
+
+    entries = [
+        (last_used(entry), entry) for entry in os.listdir(snapshot_dir) if not entry.startswith(".")
+    ]
+    entries.sort(reverse=True)
+    for i, (_, entry) in enumerate(entries):
+        replaced = entries[i - 1][0] if i else time.time()
+        if i >= retain and entry not in keep and replaced < cutoff:
+            shutil.rmtree(os.path.join(snapshot_dir, entry), ignore_errors=True)
+
+
+def attach_datasets(path, data_dir=None):
+    """Open a published snapshot without rebuilding it.
+
+    Only its recorded data directory is compared with `data_dir`; the CSVs
+    are hashed only if that differs (a copy of the same files is fine).
+    """
+    version = os.path.basename(os.path.normpath(path))
+    datasets = open_snapshot(path, version=version)
+    if datasets is None:
+        raise RuntimeError(f"Snapshot {path} has an unsupported format")
+    if (
+        data_dir is not None
+        and datasets.data_dir not in (None, os.path.abspath(data_dir))
+        and source_hash(data_dir) != version
+    ):
+        raise RuntimeError(
+            f"Snapshot {path} was built from {datasets.data_dir}, not {os.path.abspath(data_dir)}"
+            " (set HIV_DATA_DIR to the launcher's data directory)"
+        )
+    return datasets
+
+
+def open_datasets(data_dir="data", snapshot_dir=SNAPSHOT_DIR, compact=COMPACT_INGEST):
+    """Return the preprocessed datasets, using a snapshot when it is valid.
+
+    Frames and the cube of a valid snapshot are only loaded when first
+    accessed (see SnapshotDatasets). A missing or stale snapshot is rebuilt
+    from the CSVs. If the snapshot directory is not writable the datasets
+    are still returned. When HIV_SNAPSHOT_PATH is set, that snapshot is
+    attached instead.
+    """
+    if SNAPSHOT_PATH:
+        return attach_datasets(SNAPSHOT_PATH, data_dir)
+
+    # Lets caches derived from the data (e.g. scatter frames) detect changes
+    key = source_hash(data_dir, compact)
+    path = os.path.join(snapshot_dir, key)
+    if os.path.exists(os.path.join(path, "manifest.json")):
+        datasets = open_snapshot(path, version=key)
+        if datasets is not None:
+            try:
+                # Marks it as used for _remove_stale()
+                os.utime(os.path.join(path, "manifest.json"))
+                _remove_stale(snapshot_dir, keep={key})
+            except OSError:
+                pass
+            return datasets
+
+    datasets = build_datasets(data_dir, compact)
+    try:
+        save_snapshot(datasets, path, data_dir)
+        _remove_stale(snapshot_dir, keep={key})
+    except OSError:
+        pass
+    datasets["version"] = key
+    return datasets
+
+
+def load_datasets(data_dir="data", snapshot_dir=SNAPSHOT_DIR, compact=COMPACT_INGEST):
+    """open_datasets() with every frame and the cube loaded."""
+    return dict(open_datasets(data_dir, snapshot_dir, compact))
+
+
+def reload_datasets(datasets, changed, data_dir="data", snapshot_dir=SNAPSHOT_DIR, compact=COMPACT_INGEST):
+    """Datasets after the `changed` source files were edited, and the names that changed.
+
+    Only the names depending on `changed` are rebuilt; the others are shared
+    with `datasets`, which is left untouched. The result is published as a
+    snapshot like load_datasets() does and the rebuilt names are taken from
+    it, so workers reloading the same edit map the same files (the first one
+    to finish builds it, the others find it).
+    """
+    key = source_hash(data_dir, compact)
+    path = os.path.join(snapshot_dir, key)
+    names = affected(changed)
+    published = None
+    if os.path.exists(os.path.join(path, "manifest.json")):
+        published = load_snapshot(path)
+
+    if published is None:
+        published, names = rebuild_datasets(datasets, changed, data_dir, compact)
+        try:
+            save_snapshot(published, path, data_dir)
+            published = load_snapshot(path) or published
+        except OSError:
+            pass
+    try:
+        # Marks it as used; the previous snapshot is kept, since this or
+        # another process may still map frames from it (see _remove_stale)
+        os.utime(os.path.join(path, "manifest.json"))
+        _remove_stale(snapshot_dir, keep={key, datasets["version"]}, retain=0, grace=SNAPSHOT_GRACE)
+    except OSError:
+        pass
+
+    datasets = dict(datasets)
+    # A list that came out the same (e.g. the same countries) changes nothing
+    names = {name for name in names if name not in LISTS or published[name] != datasets[name]}
+    datasets.update({name: published[name] for name in names})
+    datasets["version"] = key
+    return datasets, names
@@ -0,0 +1,268 @@
+// Client-side charts for HIV_CHART_MODE=client (see client_charts.py).
+//
+// Plain SVG line and scatter charts with hover tooltips, drag to zoom and
+// double-click to reset the zoom. The server sends only the data; the year
+// range sliders and the highlighted country are applied here, and their
+// changes are kept from the server, which doesn't use them in this mode.
+(function () {
+  "use strict";
+
+  var SVG = "http://www.w3.org/2000/svg";
+  var MARGIN = { top: 32, right: 20, bottom: 44, left: 72 };
+  // Inputs handled in the browser, by id
+  var localInputs = {};
+
+  function svg(name, attrs, parent) {
+    var node = document.createElementNS(SVG, name);
+    for (var key in attrs) node.setAttribute(key, attrs[key]);
+    if (parent) parent.appendChild(node);
+    return node;
+  }
+
+  // About n round tick values covering [lo, hi]
+  function ticks(lo, hi, n) {
+    if (hi <= lo) return [lo];
+    var step = Math.pow(10, Math.floor(Math.log10((hi - lo) / n)));
+    var err = (hi - lo) / n / step;
+    step *= err >= 7.5 ? 10 : err >= 3.5 ? 5 : err >= 1.5 ? 2 : 1;
+    var out = [];
+    for (var v = Math.ceil(lo / step) * step; v <= hi + step * 1e-9; v += step) {
+      out.push(Math.round(v / step) * step);
+    }
+    return out;
+  }
+
+  function format(v) {
+    if (Math.abs(v) >= 1000) return Math.round(v).toLocaleString();
+    return String(+v.toFixed(2));
+  }
+
+  function extent(values, pad) {
+    var lo = Math.min.apply(null, values), hi = Math.max.apply(null, values);
+    if (!isFinite(lo)) return [0, 1];
+    var margin = (hi - lo || Math.abs(hi) || 1) * pad;
+    return [lo - margin, hi + margin];
+  }
+
+  function Chart(node) {
+    this.node = node;
+    this.kind = node.dataset.kind;
+    this.options = JSON.parse(node.dataset.options || "{}");
+    this.data = null;
+    this.zoom = null;
+
+    node.style.position = "relative";
+    this.svg = svg("svg", { width: "100%", height: "100%" }, node);
+    this.tooltip = document.createElement("div");
+    this.tooltip.style.cssText =
+      "position:absolute;display:none;pointer-events:none;background:rgba(255,255,255,.95);" +
+      "border:1px solid #ccc;border-radius:4px;padding:2px 6px;font-size:12px;white-space:nowrap;";
+    node.appendChild(this.tooltip);
+
+    var redraw = this.draw.bind(this);
+    [this.options.range_input, this.options.highlight_input].forEach(function (id) {
+      if (!id) return;
+      localInputs[id] = true;
+      $(document).on("change", "#" + id, redraw);
+    });
+    this.listen();
+  }
+
+  Chart.prototype.range = function () {
+    var input = $("#" + this.options.range_input);
+    var slider = input.data("ionRangeSlider");
+    if (slider) return [slider.result.from, slider.result.to];
+    return [Number(input.data("from")), Number(input.data("to"))];
+  };
+
+  Chart.prototype.points = function () {
+    var d = this.data, points = [];
+    if (this.kind === "line") {
+      var range = this.range();
+      for (var i = 0; i < d.x.length; i++) {
+        if (d.x[i] >= range[0] && d.x[i] <= range[1]) {
+          points.push({ x: d.x[i], y: d.y[i], label: String(d.x[i]) });
+        }
+      }
+    } else {
+      for (var j = 0; j < d.x.length; j++) {
+        if (d.x[j] !== null && d.y[j] !== null) {
+          points.push({ x: d.x[j], y: d.y[j], label: d.labels[j] });
+        }
+      }
+    }
+    return points;
+  };
+
+  Chart.prototype.setData = function (data) {
+    this.data = data;
+    this.zoom = null;
+    this.draw();
+  };
+
+  Chart.prototype.draw = function () {
+    if (!this.data) return;
+    var self = this, opts = this.options;
+    var width = this.node.clientWidth, height = this.node.clientHeight;
+    var plotW = Math.max(width - MARGIN.left - MARGIN.right, 10);
+    var plotH = Math.max(height - MARGIN.top - MARGIN.bottom, 10);
+    while (this.svg.firstChild) this.svg.removeChild(this.svg.firstChild);
+
+    var points = this.points();
+    var present = points.filter(function (p) { return p.y !== null; });
+    var xs = this.zoom ? this.zoom.x : extent(points.map(function (p) { return p.x; }), 0.03);
+    var ys = this.zoom && this.zoom.y ? this.zoom.y : extent(present.map(function (p) { return p.y; }), 0.05);
+    var sx = function (v) { return MARGIN.left + (v - xs[0]) / (xs[1] - xs[0]) * plotW; };
+    var sy = function (v) { return MARGIN.top + plotH - (v - ys[0]) / (ys[1] - ys[0]) * plotH; };
+    this.scale = { x: sx, y: sy, xs: xs, ys: ys, plotW: plotW, plotH: plotH };
+
+    var axes = svg("g", { "font-size": 11, fill: "#444" }, this.svg);
+    ticks(xs[0], xs[1], Math.max(2, Math.floor(plotW / 70))).forEach(function (v) {
+      if (self.kind === "line" && v % 1) return;
+      svg("line", { x1: sx(v), x2: sx(v), y1: MARGIN.top, y2: MARGIN.top + plotH, stroke: "#e5e5e5" }, axes);
+      svg("text", { x: sx(v), y: MARGIN.top + plotH + 16, "text-anchor": "middle" }, axes).textContent = format(v);
+    });
+    ticks(ys[0], ys[1], Math.max(2, Math.floor(plotH / 50))).forEach(function (v) {
+      svg("line", { x1: MARGIN.left, x2: MARGIN.left + plotW, y1: sy(v), y2: sy(v), stroke: "#e5e5e5" }, axes);
+      svg("text", { x: MARGIN.left - 6, y: sy(v) + 4, "text-anchor": "end" }, axes).textContent = format(v);
+    });
+    svg("text", { x: MARGIN.left + plotW / 2, y: height - 6, "text-anchor": "middle", "font-size": 13 }, axes)
+      .textContent = opts.xlabel || "";
+    svg("text", {
+      x: 0, y: 0, "text-anchor": "middle", "font-size": 13,
+      transform: "translate(14," + (MARGIN.top + plotH / 2) + ") rotate(-90)",
+    }, axes).textContent = opts.ylabel || "";
+    if (this.kind === "scatter") {
+      svg("text", { x: MARGIN.left + plotW / 2, y: 18, "text-anchor": "middle", "font-size": 14 }, axes)
+        .textContent = "HIV Prevalence by Gender in " + this.data.year;
+    }
+
+    svg("clipPath", { id: this.node.id + "-clip" }, this.svg).appendChild(
+      svg("rect", { x: MARGIN.left, y: MARGIN.top, width: plotW, height: plotH })
+    );
+    var plot = svg("g", { "clip-path": "url(#" + this.node.id + "-clip)" }, this.svg);
+    var color = opts.color || "#1f77b4";
+
+    if (this.kind === "line") {
+      // Missing years break the line, as in the PNG charts
+      var d = "", pen = "M";
+      points.forEach(function (p) {
+        if (p.y === null) { pen = "M"; return; }
+        d += pen + sx(p.x) + "," + sy(p.y);
+        pen = "L";
+      });
+      svg("path", { d: d, fill: "none", stroke: color, "stroke-width": 1.5 }, plot);
+      present.forEach(function (p) {
+        svg("circle", { cx: sx(p.x), cy: sy(p.y), r: 3.5, fill: color }, plot);
+      });
+    } else {
+      var highlight = $("#" + opts.highlight_input).val();
+      var selected = null;
+      present.forEach(function (p) {
+        if (p.label === highlight) selected = p;
+        svg("circle", { cx: sx(p.x), cy: sy(p.y), r: 4, fill: color, "fill-opacity": 0.7 }, plot);
+      });
+      if (selected) {
+        svg("circle", { cx: sx(selected.x), cy: sy(selected.y), r: 7, fill: "red" }, plot);
+        svg("text", { x: sx(selected.x) - 10, y: sy(selected.y) - 14, fill: "red", "font-size": 13 }, plot)
+          .textContent = "(" + selected.x.toFixed(2) + ", " + selected.y.toFixed(2) + ") " + selected.label;
+      }
+    }
+    this.present = present;
+    this.selection = svg("rect", { fill: "rgba(0,0,0,.08)", stroke: "#999", display: "none" }, this.svg);
+  };
+
+  // Nearest point within 30 px of the pointer
+  Chart.prototype.nearest = function (mx, my) {
+    var best = null, bestD = 900, s = this.scale, line = this.kind === "line";
+    (this.present || []).forEach(function (p) {
+      var dx = s.x(p.x) - mx, dy = line ? 0 : s.y(p.y) - my;
+      var d = dx * dx + dy * dy;
+      if (d < bestD) { best = p; bestD = d; }
+    });
+    return best;
+  };
+
+  Chart.prototype.listen = function () {
+    var self = this, start = null;
+    function position(e) {
+      var box = self.svg.getBoundingClientRect();
+      return [e.clientX - box.left, e.clientY - box.top];
+    }
+
+    this.svg.addEventListener("mousedown", function (e) {
+      start = position(e);
+      e.preventDefault();
+    });
+    this.svg.addEventListener("mousemove", function (e) {
+      if (!self.scale) return;
+      var pos = position(e);
+      if (start) {
+        var x = Math.min(start[0], pos[0]), y = Math.min(start[1], pos[1]);
+        var full = self.kind === "line";
+        self.selection.setAttribute("display", "inline");
+        self.selection.setAttribute("x", x);
+        self.selection.setAttribute("width", Math.abs(pos[0] - start[0]));
+        self.selection.setAttribute("y", full ? MARGIN.top : y);
+        self.selection.setAttribute("height", full ? self.scale.plotH : Math.abs(pos[1] - start[1]));
+      }
+      var p = self.nearest(pos[0], pos[1]);
+      if (!p) {
+        self.tooltip.style.display = "none";
+        return;
+      }
+      var opts = self.options;
+      self.tooltip.textContent = self.kind === "line"
+        ? p.label + ": " + format(p.y) + " " + (opts.ylabel || "")
+        : p.label + " (" + format(p.x) + ", " + format(p.y) + ")";
+      self.tooltip.style.display = "block";
+      self.tooltip.style.left = Math.min(self.scale.x(p.x) + 8, self.node.clientWidth - 160) + "px";
+      self.tooltip.style.top = Math.max(self.scale.y(p.y) - 28, 0) + "px";
+    });
+    document.addEventListener("mouseup", function (e) {
+      if (!start) return;
+      var end = position(e), s = self.scale;
+      self.selection.setAttribute("display", "none");
+      if (s && Math.abs(end[0] - start[0]) > 5) {
+        var invX = function (px) { return s.xs[0] + (px - MARGIN.left) / s.plotW * (s.xs[1] - s.xs[0]); };
+        var invY = function (py) { return s.ys[0] + (MARGIN.top + s.plotH - py) / s.plotH * (s.ys[1] - s.ys[0]); };
+        self.zoom = { x: [invX(Math.min(start[0], end[0])), invX(Math.max(start[0], end[0]))] };
+        if (self.kind === "scatter" && Math.abs(end[1] - start[1]) > 5) {
+          self.zoom.y = [invY(Math.max(start[1], end[1])), invY(Math.min(start[1], end[1]))];
+        }
+        self.draw();
+      }
+      start = null;
+    });
+    this.svg.addEventListener("mouseleave", function () { self.tooltip.style.display = "none"; });
+    this.svg.addEventListener("dblclick", function () {
+      self.zoom = null;
+      self.draw();
+    });
+  };
+
+  function chart(node) {
+    if (!node._hivChart) node._hivChart = new Chart(node);
+    return node._hivChart;
+  }
+
+  var binding = new Shiny.OutputBinding();
+  $.extend(binding, {
+    find: function (scope) {
+      return $(scope).find(".hiv-client-chart");
+    },
+    renderValue: function (node, data) {
+      chart(node).setData(data);
+    },
+  });
+  Shiny.outputBindings.register(binding, "hiv.clientChart");
+
+  $(document).on("shiny:inputchanged", function (e) {
+    if (localInputs[e.name]) e.preventDefault();
+  });
+  $(window).on("resize", function () {
+    $(".hiv-client-chart").each(function () {
+      if (this._hivChart) this._hivChart.draw();
+    });
+  });
+})();